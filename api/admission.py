@@ -0,0 +1,299 @@
+"""
+准入控制（ADMISSION_ENABLED 开启时由路由调用）
+
+- 全局并发上限与单客户端并发上限，超出时进入有界等待队列
+- 等待队列按优先级出队：interactive 先于 batch，同级按到达顺序
+- 每个客户端一个令牌桶限制请求速率
+- 队列已满、排队超时或超出速率时返回 429 与 Retry-After
+
+计数只在事件循环线程中修改，不需要加锁；多 worker 部署时上限按 worker 生效。
+"""
+import asyncio
+import hashlib
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+from fastapi import Request
+from api.config import get_settings
+from api.logger import setup_logger
+from api.metrics import (
+    ADMISSION_ACTIVE,
+    ADMISSION_QUEUE_DEPTH,
+    ADMISSION_REJECTED_TOTAL,
+    ADMISSION_WAIT_SECONDS,
+)
+
+logger = setup_logger(__name__)
+
+PRIORITY_HEADER = "X-Priority"
+CLIENT_ID_HEADER = "X-Client-ID"
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+# 出队顺序
+PRIORITIES: Tuple[str, ...] = (INTERACTIVE, BATCH)
+
+# 令牌桶数量超过该值时清理已经回满的桶
+_MAX_IDLE_BUCKETS = 10000
+
+
+class AdmissionRejected(Exception):
+    """请求未获准入，应返回 429"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class _TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+
+class _Waiter:
+    __slots__ = ("client", "priority", "future", "enqueued")
+
+    def __init__(self, client: str, priority: str, future: "asyncio.Future[None]"):
+        self.client = client
+        self.priority = priority
+        self.future = future
+        self.enqueued = time.perf_counter()
+
+
+class AdmissionTicket:
+    """已获准入的请求，结束时调用 release() 归还名额，重复调用无副作用"""
+
+    __slots__ = ("_controller", "client", "priority", "_released")
+
+    def __init__(self, controller: "AdmissionController", client: str, priority: str):
+        self._controller = controller
+        self.client = client
+        self.priority = priority
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(self.client)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrent: int,
+        max_per_client: int,
+        queue_size: int,
+        queue_timeout: float,
+        rate: float = 0.0,
+        burst: float = 0.0,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_per_client = max_per_client
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self._active = 0
+        self._per_client: Dict[str, int] = {}
+        self._queues: Dict[str, Deque[_Waiter]] = {priority: deque() for priority in PRIORITIES}
+        self._buckets: Dict[str, _TokenBucket] = {}
+        self._admitted = 0
+        self._queued = 0
+        self._rejected: Dict[str, int] = {}
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _has_capacity(self, client: str) -> bool:
+        if self.max_concurrent > 0 and self._active >= self.max_concurrent:
+            return False
+        if self.max_per_client > 0 and self._per_client.get(client, 0) >= self.max_per_client:
+            return False
+        return True
+
+    def _occupy(self, client: str, priority: str) -> AdmissionTicket:
+        self._active += 1
+        self._per_client[client] = self._per_client.get(client, 0) + 1
+        self._admitted += 1
+        ADMISSION_ACTIVE.inc()
+        return AdmissionTicket(self, client, priority)
+
+    def _reject(self, reason: str, retry_after: float) -> AdmissionRejected:
+        self._rejected[reason] = self._rejected.get(reason, 0) + 1
+        ADMISSION_REJECTED_TOTAL.labels(reason).inc()
+        return AdmissionRejected(reason, retry_after)
+
+    def _take_token(self, client: str) -> float:
+        """
+        从客户端的令牌桶取一个令牌
+
+        Returns:
+            0 表示成功，否则为下一个令牌到达前需要等待的秒数
+        """
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= _MAX_IDLE_BUCKETS:
+                self._prune_buckets(now)
+            bucket = self._buckets[client] = _TokenBucket(self.burst, now)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        return (1 - bucket.tokens) / self.rate
+
+    def _prune_buckets(self, now: float) -> None:
+        refill = self.burst / self.rate
+        for client in [c for c, b in self._buckets.items() if now - b.updated >= refill]:
+            del self._buckets[client]
+
+    async def acquire(self, client: str, priority: str = INTERACTIVE) -> AdmissionTicket:
+        """
+        获取一个执行名额，必要时排队等待
+
+        Raises:
+            AdmissionRejected: 超出速率、队列已满或排队超时
+        """
+        wait = self._take_token(client)
+        if wait > 0:
+            raise self._reject("rate_limited", wait)
+        # 有空闲名额时排队中的请求都已被唤醒，新请求可以直接执行
+        if self._has_capacity(client):
+            ADMISSION_WAIT_SECONDS.labels(priority).observe(0)
+            return self._occupy(client, priority)
+        if self.queue_depth >= self.queue_size:
+            raise self._reject("queue_full", self.queue_timeout)
+
+        waiter = _Waiter(client, priority, asyncio.get_running_loop().create_future())
+        self._queues[priority].append(waiter)
+        self._queued += 1
+        ADMISSION_QUEUE_DEPTH.labels(priority).inc()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            # 超时与唤醒发生在同一轮事件循环时，名额已经分配，照常执行
+            if self._dequeue(waiter):
+                raise self._reject("queue_timeout", self.queue_timeout)
+        except asyncio.CancelledError:
+            # 客户端在排队期间断开；若名额已经分配给它，则转交给下一个请求
+            if not self._dequeue(waiter):
+                self._release(client)
+            raise
+        finally:
+            ADMISSION_WAIT_SECONDS.labels(priority).observe(time.perf_counter() - waiter.enqueued)
+        return AdmissionTicket(self, client, priority)
+
+    def _dequeue(self, waiter: _Waiter) -> bool:
+        """把仍在排队的请求移出队列；已被唤醒时返回 False"""
+        if waiter.future.done():
+            return False
+        waiter.future.cancel()
+        self._queues[waiter.priority].remove(waiter)
+        ADMISSION_QUEUE_DEPTH.labels(waiter.priority).dec()
+        return True
+
+    def _release(self, client: str) -> None:
+        self._active -= 1
+        remaining = self._per_client[client] - 1
+        if remaining:
+            self._per_client[client] = remaining
+        else:
+            del self._per_client[client]
+        ADMISSION_ACTIVE.dec()
+        self._wake()
+
+    def _wake(self) -> None:
+        """按优先级唤醒可以执行的排队请求，名额在唤醒时即被占用"""
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            if not queue:
+                continue
+            blocked: List[_Waiter] = []
+            while queue:
+                if self.max_concurrent > 0 and self._active >= self.max_concurrent:
+                    break
+                waiter = queue.popleft()
+                if not self._has_capacity(waiter.client):
+                    # 只受单客户端上限限制，让同队列后面的其他客户端先执行
+                    blocked.append(waiter)
+                    continue
+                ADMISSION_QUEUE_DEPTH.labels(priority).dec()
+                self._occupy(waiter.client, priority)
+                waiter.future.set_result(None)
+            queue.extendleft(reversed(blocked))
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "active": self._active,
+            "max_concurrent": self.max_concurrent,
+            "max_per_client": self.max_per_client,
+            "queue_size": self.queue_size,
+            "queue_depth": {priority: len(queue) for priority, queue in self._queues.items()},
+            "clients": len(self._per_client),
+            "admitted": self._admitted,
+            "queued": self._queued,
+            "rejected": dict(self._rejected),
+        }
+
+
+def client_key(request: Request, client_token: Optional[str], pooled: bool) -> str:
+    """
+    识别请求所属的客户端
+
+    直传模式下令牌即客户端身份（只保留摘要）；令牌池模式下所有客户端共用 APP_SECRET，
+    改用 X-Client-ID 头，未提供时退回客户端 IP。
+    """
+    if not pooled and client_token:
+        return "token:" + hashlib.sha256(client_token.encode("utf-8")).hexdigest()[:16]
+    client_id = request.headers.get(CLIENT_ID_HEADER)
+    if pooled and client_id:
+        return "id:" + client_id[:64]
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+def request_priority(request: Request, default: str = INTERACTIVE) -> str:
+    priority = request.headers.get(PRIORITY_HEADER, "").strip().lower()
+    return priority if priority in PRIORITIES else default
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """获取进程内共享的准入控制器；未开启时返回 None"""
+    global _controller
+    settings = get_settings()
+    if not settings.ADMISSION_ENABLED:
+        return None
+    if _controller is None:
+        _controller = AdmissionController(
+            max_concurrent=settings.ADMISSION_MAX_CONCURRENT,
+            max_per_client=settings.ADMISSION_MAX_PER_CLIENT,
+            queue_size=settings.ADMISSION_QUEUE_SIZE,
+            queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+            rate=settings.ADMISSION_RATE_PER_CLIENT,
+            burst=settings.ADMISSION_BURST,
+        )
+        logger.info(
+            "Admission control enabled",
+            extra={
+                "max_concurrent": settings.ADMISSION_MAX_CONCURRENT,
+                "max_per_client": settings.ADMISSION_MAX_PER_CLIENT,
+                "queue_size": settings.ADMISSION_QUEUE_SIZE,
+            },
+        )
+    return _controller
@@ -0,0 +1,306 @@
+"""
+Anthropic Messages API（/v1/messages）
+
+请求转换为内部的 ChatRequest 后走与 /v1/chat/completions 相同的上游路径；
+响应直接由解析后的上游事件生成 Anthropic SSE 事件
+（message_start → content_block_* → message_delta → message_stop），不经过 OpenAI JSON 中转。
+"""
+import uuid
+from typing import Any, Dict, FrozenSet, List, Optional
+from api import json_codec
+from api.logger import setup_logger
+from api.models import AnthropicRequest, ChatRequest, Message
+from api.stream_translator import (
+    CompletionAggregator,
+    ToolCallAssembler,
+    UpstreamEvent,
+    normalize_usage,
+)
+
+logger = setup_logger(__name__)
+
+_ERROR_TYPES = {
+    400: "invalid_request_error",
+    401: "authentication_error",
+    403: "permission_error",
+    404: "not_found_error",
+    413: "request_too_large",
+    429: "rate_limit_error",
+}
+
+
+def _sse(payload: Dict[str, Any]) -> str:
+    return f"event: {payload['type']}\ndata: {json_codec.dumps(payload)}\n\n"
+
+
+def error_body(message: str, status_code: Optional[int] = None) -> Dict[str, Any]:
+    return {
+        "type": "error",
+        "error": {"type": _ERROR_TYPES.get(status_code or 0, "api_error"), "message": message},
+    }
+
+
+def _block_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content or () if block.get("type") == "text")
+
+
+def _image_url(source: Dict[str, Any]) -> str:
+    if source.get("type") == "url":
+        return source.get("url", "")
+    return f"data:{source.get('media_type', 'image/png')};base64,{source.get('data', '')}"
+
+
+def to_chat_request(request: AnthropicRequest) -> ChatRequest:
+    """把 Anthropic 请求转换为内部的 ChatRequest"""
+    messages: List[Message] = []
+    system = _block_text(request.system) if request.system else ""
+    if system:
+        messages.append(Message(role="system", content=system))
+
+    for message in request.messages:
+        role = message.get("role", "user")
+        content = message.get("content")
+        if isinstance(content, str):
+            messages.append(Message(role=role, content=content))
+            continue
+        parts: List[Dict[str, Any]] = []
+        tool_calls: List[Dict[str, Any]] = []
+        for block in content or ():
+            block_type = block.get("type")
+            if block_type == "text":
+                parts.append({"type": "text", "text": block.get("text", "")})
+            elif block_type == "image":
+                parts.append({"type": "image_url", "image_url": {"url": _image_url(block.get("source") or {})}})
+            elif block_type == "tool_use":
+                tool_calls.append(
+                    {
+                        "id": block.get("id"),
+                        "type": "function",
+                        "function": {
+                            "name": block.get("name"),
+                            "arguments": json_codec.dumps(block.get("input") or {}),
+                        },
+                    }
+                )
+            elif block_type == "tool_result":
+                messages.append(
+                    Message(
+                        role="tool",
+                        tool_call_id=block.get("tool_use_id"),
+                        content=_block_text(block.get("content")),
+                    )
+                )
+        if parts or tool_calls:
+            if len(parts) == 1 and parts[0]["type"] == "text":
+                value: Any = parts[0]["text"]
+            else:
+                value = parts or None
+            messages.append(Message(role=role, content=value, tool_calls=tool_calls or None))
+
+    tools = None
+    if request.tools:
+        # 只转换客户端自定义工具，Anthropic 服务端工具（web_search 等）没有对应实现
+        tools = [
+            {
+                "type": "function",
+                "function": {
+                    "name": tool["name"],
+                    "description": tool.get("description", ""),
+                    "parameters": tool.get("input_schema") or {"type": "object"},
+                },
+            }
+            for tool in request.tools
+            if tool.get("name") and tool.get("type", "custom") == "custom"
+        ]
+
+    tool_choice: Any = None
+    if request.tool_choice:
+        choice_type = request.tool_choice.get("type")
+        if choice_type == "any":
+            tool_choice = "required"
+        elif choice_type == "tool":
+            tool_choice = {"type": "function", "function": {"name": request.tool_choice.get("name")}}
+        elif choice_type in ("auto", "none"):
+            tool_choice = choice_type
+
+    return ChatRequest(
+        model=request.model,
+        messages=messages,
+        stream=request.stream,
+        temperature=request.temperature,
+        top_p=request.top_p,
+        max_tokens=request.max_tokens,
+        tools=tools or None,
+        tool_choice=tool_choice,
+    )
+
+
+def thinking_requested(request: AnthropicRequest) -> bool:
+    """只有请求开启 extended thinking 时才输出 thinking 块"""
+    return bool(request.thinking and request.thinking.get("type") == "enabled")
+
+
+def _usage(usage: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    usage = normalize_usage(usage)
+    return {"input_tokens": usage["prompt_tokens"], "output_tokens": usage["completion_tokens"]}
+
+
+def _tool_input(arguments: str) -> Any:
+    try:
+        return json_codec.loads(arguments) if arguments else {}
+    except json_codec.DecodeError:
+        logger.warning(f"Tool call arguments are not valid JSON: {arguments[:200]}")
+        return {}
+
+
+class AnthropicStreamTranslator:
+    """把上游事件翻译为 Anthropic Messages 流式事件"""
+
+    def __init__(self, model: str, tool_names: FrozenSet[str], include_thinking: bool):
+        self.model = model
+        self.message_id = f"msg_{uuid.uuid4().hex}"
+        self.include_thinking = include_thinking
+        self.tools = ToolCallAssembler(tool_names) if tool_names else None
+        self.usage: Optional[Dict[str, Any]] = None
+        self._started = False
+        self._closed = False
+        self._block_index = -1
+        self._block_type: Optional[str] = None
+        # 工具调用 index 到内容块 index 的映射
+        self._tool_blocks: Dict[int, int] = {}
+
+    def _start(self) -> str:
+        self._started = True
+        return _sse(
+            {
+                "type": "message_start",
+                "message": {
+                    "id": self.message_id,
+                    "type": "message",
+                    "role": "assistant",
+                    "model": self.model,
+                    "content": [],
+                    "stop_reason": None,
+                    "stop_sequence": None,
+                    "usage": {"input_tokens": 0, "output_tokens": 0},
+                },
+            }
+        )
+
+    def _stop_block(self) -> str:
+        if self._block_type is None:
+            return ""
+        self._block_type = None
+        return _sse({"type": "content_block_stop", "index": self._block_index})
+
+    def _open_block(self, block: Dict[str, Any]) -> str:
+        out = self._stop_block()
+        self._block_index += 1
+        self._block_type = block["type"]
+        return out + _sse({"type": "content_block_start", "index": self._block_index, "content_block": block})
+
+    def _delta(self, block_type: str, empty_block: Dict[str, Any], delta: Dict[str, Any]) -> str:
+        out = "" if self._block_type == block_type else self._open_block(empty_block)
+        return out + _sse({"type": "content_block_delta", "index": self._block_index, "delta": delta})
+
+    def _tool_deltas(self, event: UpstreamEvent) -> str:
+        out = []
+        for delta in self.tools.feed(event):
+            arguments = delta["function"].get("arguments") or ""
+            if "id" in delta:
+                out.append(
+                    self._open_block(
+                        {"type": "tool_use", "id": delta["id"], "name": delta["function"]["name"], "input": {}}
+                    )
+                )
+                self._tool_blocks[delta["index"]] = self._block_index
+            if arguments:
+                out.append(
+                    _sse(
+                        {
+                            "type": "content_block_delta",
+                            "index": self._tool_blocks[delta["index"]],
+                            "delta": {"type": "input_json_delta", "partial_json": arguments},
+                        }
+                    )
+                )
+        return "".join(out)
+
+    def _close(self) -> str:
+        self._closed = True
+        stop_reason = "tool_use" if self.tools is not None and self.tools.calls else "end_turn"
+        return (
+            self._stop_block()
+            + _sse(
+                {
+                    "type": "message_delta",
+                    "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+                    "usage": _usage(self.usage),
+                }
+            )
+            + _sse({"type": "message_stop"})
+        )
+
+    def translate(self, event: UpstreamEvent) -> Optional[str]:
+        out = "" if self._started else self._start()
+        phase = event.phase
+        if phase == "thinking":
+            if self.include_thinking and event.content:
+                out += self._delta(
+                    "thinking",
+                    {"type": "thinking", "thinking": "", "signature": ""},
+                    {"type": "thinking_delta", "thinking": event.content},
+                )
+        elif phase in ("answer", "other"):
+            if event.content:
+                out += self._delta(
+                    "text", {"type": "text", "text": ""}, {"type": "text_delta", "text": event.content}
+                )
+            if phase == "other" and event.usage:
+                self.usage = event.usage
+        elif phase == "tool_call" and self.tools is not None:
+            out += self._tool_deltas(event)
+        elif phase == "done":
+            out += self._close()
+        return out or None
+
+    def finish(self) -> Optional[str]:
+        """上游没有发送 done 就结束时，补齐结束事件"""
+        if self._closed:
+            return None
+        return ("" if self._started else self._start()) + self._close()
+
+    def error(self, message: str, code: Optional[int] = None) -> str:
+        return _sse(error_body(message, code))
+
+
+def render_message(
+    aggregator: CompletionAggregator, model: str, include_thinking: bool
+) -> Dict[str, Any]:
+    """由聚合结果生成非流式的 Anthropic message 响应"""
+    content: List[Dict[str, Any]] = []
+    if include_thinking and aggregator.reasoning:
+        content.append({"type": "thinking", "thinking": aggregator.reasoning, "signature": ""})
+    if aggregator.content:
+        content.append({"type": "text", "text": aggregator.content})
+    for call in aggregator.tool_calls:
+        content.append(
+            {
+                "type": "tool_use",
+                "id": call["id"],
+                "name": call["function"]["name"],
+                "input": _tool_input(call["function"]["arguments"]),
+            }
+        )
+    return {
+        "id": f"msg_{uuid.uuid4().hex}",
+        "type": "message",
+        "role": "assistant",
+        "model": model,
+        "content": content,
+        "stop_reason": "tool_use" if aggregator.tool_calls else "end_turn",
+        "stop_sequence": None,
+        "usage": _usage(aggregator.usage),
+    }
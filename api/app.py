@@ -1,16 +1,87 @@
+import asyncio
+import hmac
 import json
+import signal
+import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Response
 from starlette.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from api.logger import setup_logger
+from api.admission import get_admission_controller
+from api.batches import get_batch_store
+from api.chat_service import single_flight
+from api.http_client import (
+    close_http_client,
+    get_pool_stats,
+    init_http_client,
+    prewarm_http_client,
+)
+from api.lifecycle import inflight, process_uptime, remaining_grace, watch_shutdown_signals
+from api.logger import (
+    RequestIdMiddleware,
+    dropped_records,
+    get_log_level,
+    set_log_level,
+    setup_logger,
+    toggle_debug,
+)
+from api.metrics import METRICS_CONTENT_TYPE, render_metrics
+from api.response_cache import get_response_cache
 from api.routes import router
+from api.token_pool import get_token_pool
 from api.config import get_settings
 
 settings = get_settings()
 logger = setup_logger(__name__)
 
 
+async def _prewarm_upstream() -> None:
+    start = time.perf_counter()
+    warmed = await prewarm_http_client(
+        settings.PROXY_URL,
+        settings.UPSTREAM_PREWARM_CONNECTIONS,
+        settings.UPSTREAM_PREWARM_TIMEOUT,
+    )
+    logger.info(
+        "Upstream connections prewarmed",
+        extra={"connections": warmed, "prewarm_ms": round((time.perf_counter() - start) * 1000, 1)},
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 每个 worker 启动时创建共享的上游连接池，关闭时释放
+    await init_http_client()
+    # 在后台预热上游连接，/health 不必等待握手完成
+    prewarm = None
+    if settings.UPSTREAM_PREWARM_CONNECTIONS > 0:
+        prewarm = asyncio.create_task(_prewarm_upstream())
+    # kill -USR1 <worker pid> 在 DEBUG 与 LOG_LEVEL 之间切换，无需重启
+    if hasattr(signal, "SIGUSR1"):
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGUSR1, lambda: logger.warning(f"Log level switched to {toggle_debug()}")
+            )
+        except (NotImplementedError, RuntimeError):
+            pass
+    watch_shutdown_signals()
+    uptime = process_uptime()
+    logger.info(
+        "Worker ready",
+        extra={"startup_ms": round(uptime * 1000, 1) if uptime is not None else None},
+    )
+    try:
+        yield
+    finally:
+        if prewarm is not None and not prewarm.done():
+            prewarm.cancel()
+        # uvicorn 在 lifespan 关闭前已等待连接结束（timeout_graceful_shutdown），
+        # 这里在剩余的宽限时间内等待不依附于连接的上游请求（例如合并请求的后台流）
+        await inflight.wait_idle(remaining_grace(settings.SHUTDOWN_GRACE_PERIOD))
+        await close_http_client()
+
+
 def create_app() -> FastAPI:
     app = FastAPI(
         title="ZAI Proxy API",
@@ -18,6 +89,7 @@ def create_app() -> FastAPI:
         version="1.0.0",
         docs_url="/docs" if settings.DEBUG else None,
         redoc_url="/redoc" if settings.DEBUG else None,
+        lifespan=lifespan,
     )
 
     # 配置中间件
@@ -37,6 +109,9 @@ def create_app() -> FastAPI:
         TrustedHostMiddleware, allowed_hosts=["*"]  # 在生产环境中应该限制允许的主机
     )
 
+    # 为每个请求分配 request_id，写入日志并通过 X-Request-ID 响应头返回
+    app.add_middleware(RequestIdMiddleware)
+
     # 添加路由
     app.include_router(router, prefix="/v1")
 
@@ -62,6 +137,79 @@ def health_check():
     return Response(content=json.dumps({"status": "ok"}), media_type="application/json")
 
 
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/metrics/pool")
+def pool_metrics():
+    return get_pool_stats()
+
+
+@app.get("/metrics/image-cache")
+def image_cache_metrics():
+    # 图片缓存（含 sqlite3）只在首次上传图片或查询时才导入
+    from api.image_cache import get_image_cache
+
+    cache = get_image_cache()
+    return {"enabled": cache is not None, **(cache.stats() if cache is not None else {})}
+
+
+@app.get("/metrics/response-cache")
+def response_cache_metrics():
+    cache = get_response_cache()
+    return {"enabled": cache is not None, **(cache.stats() if cache is not None else {})}
+
+
+@app.get("/metrics/single-flight")
+def single_flight_metrics():
+    return {"enabled": settings.COALESCE_ENABLED, **single_flight.stats()}
+
+
+@app.get("/metrics/admission")
+def admission_metrics():
+    controller = get_admission_controller()
+    return {"enabled": controller is not None, **(controller.stats() if controller else {})}
+
+
+@app.get("/metrics/batches")
+def batch_metrics():
+    return get_batch_store().stats()
+
+
+@app.get("/metrics/tokens")
+def token_pool_metrics():
+    pool = get_token_pool()
+    return {"enabled": pool is not None, "tokens": pool.stats() if pool else []}
+
+
+def _is_admin(request: Request) -> bool:
+    """管理接口要求配置 APP_SECRET 并以 Bearer 方式提供"""
+    token = request.headers.get("Authorization", "").split(" ")[-1]
+    return bool(settings.APP_SECRET) and hmac.compare_digest(token, settings.APP_SECRET)
+
+
+@app.get("/admin/log-level")
+def read_log_level(request: Request):
+    if not _is_admin(request):
+        return JSONResponse(status_code=403, content={"message": "Forbidden"})
+    return {"level": get_log_level(), "dropped_records": dropped_records()}
+
+
+@app.put("/admin/log-level")
+def update_log_level(request: Request, level: str):
+    """切换当前 worker 的日志级别，例如 PUT /admin/log-level?level=DEBUG"""
+    if not _is_admin(request):
+        return JSONResponse(status_code=403, content={"message": "Forbidden"})
+    try:
+        new_level = set_log_level(level)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+    logger.warning(f"Log level switched to {new_level}")
+    return {"level": new_level}
+
+
 @app.get("/")
 def powerby():
     return Response(
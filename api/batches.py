@@ -0,0 +1,429 @@
+"""
+批量补全（/v1/batches）
+
+一次提交多个 ChatRequest，代理在后台以有界并发逐个执行，每完成一个就向客户端输出一行 NDJSON。
+任务在后台运行，与提交请求的连接解耦：连接断开后任务继续执行，客户端可凭 batch id 与已读取的
+行数续读（GET /v1/batches/{id}?offset=N）。结果保留 BATCH_RESULT_TTL 秒。
+
+执行任务的 worker 在内存中保存结果并实时推送给本 worker 的读取者；配置了 BATCH_SQLITE_PATH 时
+结果同时写入 SQLite，续读请求落到其它 worker 时从 SQLite 中按 BATCH_POLL_INTERVAL 轮询读取。
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from pydantic import ValidationError
+from api import json_codec
+from api.config import get_settings
+from api.ids import uuid4_str
+from api.logger import setup_logger
+from api.lru_cache import TTLLRUCache
+from api.metrics import BATCH_ITEMS_TOTAL
+from api.models import ChatRequest
+
+logger = setup_logger(__name__)
+
+BATCH_ID_HEADER = "X-Batch-ID"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# 解析成功的请求，或解析失败时的错误信息
+BatchItem = Tuple[Optional[str], Union[ChatRequest, str]]
+
+
+class BatchItemError(Exception):
+    """单个请求失败，记录到该请求的结果行中，不影响其它请求"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class BatchRejected(Exception):
+    """整个批量请求无法受理"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _parse_item(raw: Any) -> BatchItem:
+    """
+    单个条目可以直接是 ChatRequest，也可以是 {"custom_id": ..., "body": ChatRequest}
+    """
+    custom_id = None
+    body = raw
+    if isinstance(raw, dict) and "body" in raw:
+        custom_id = raw.get("custom_id")
+        body = raw["body"]
+    elif isinstance(raw, dict):
+        custom_id = raw.get("custom_id")
+    if custom_id is not None:
+        custom_id = str(custom_id)
+    try:
+        request = ChatRequest.model_validate(body)
+    except ValidationError as e:
+        return custom_id, f"Invalid request: {e.errors()[0].get('msg', 'validation error')}"
+    # 批量结果按完整响应返回
+    return custom_id, request.model_copy(update={"stream": False})
+
+
+def parse_batch_items(body: bytes, content_type: str) -> List[BatchItem]:
+    """
+    解析批量请求体：NDJSON/JSONL（每行一个条目），或 JSON 数组 / {"requests": [...]}
+
+    Raises:
+        BatchRejected: 请求体无法解析、为空或超过 BATCH_MAX_ITEMS
+    """
+    settings = get_settings()
+    try:
+        if "ndjson" in content_type or "jsonl" in content_type:
+            raw_items = [json_codec.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            payload = json_codec.loads(body)
+            raw_items = payload.get("requests") if isinstance(payload, dict) else payload
+    except json_codec.DecodeError as e:
+        raise BatchRejected(400, f"Malformed batch body: {e}") from e
+    if not isinstance(raw_items, list) or not raw_items:
+        raise BatchRejected(400, "Batch must contain at least one request")
+    if len(raw_items) > settings.BATCH_MAX_ITEMS:
+        raise BatchRejected(
+            413, f"Batch has {len(raw_items)} requests, the limit is {settings.BATCH_MAX_ITEMS}"
+        )
+    return [_parse_item(raw) for raw in raw_items]
+
+
+def _summary(
+    job_id: str, created: int, done: bool, total: int, succeeded: int, failed: int
+) -> Dict[str, Any]:
+    return {
+        "object": "batch",
+        "id": job_id,
+        "created": created,
+        "status": "completed" if done else "in_progress",
+        "total": total,
+        "succeeded": succeeded,
+        "failed": failed,
+    }
+
+
+class SqliteBatchBackend:
+    """
+    基于本地 SQLite 文件的批量结果存储，供同一台机器上的多个 worker 共享
+
+    方法均为阻塞调用，由调用方放到线程池中执行。
+    """
+
+    def __init__(self, path: str, max_jobs: int):
+        self.path = path
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS batch_jobs ("
+            "id TEXT PRIMARY KEY, owner TEXT NOT NULL, total INTEGER NOT NULL, "
+            "created INTEGER NOT NULL, expires_at REAL NOT NULL, done INTEGER NOT NULL, "
+            "succeeded INTEGER NOT NULL, failed INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS batch_lines ("
+            "job_id TEXT NOT NULL, position INTEGER NOT NULL, line TEXT NOT NULL, "
+            "PRIMARY KEY (job_id, position))"
+        )
+        self._conn.commit()
+
+    def create(self, job: "BatchJob", expires_at: float) -> None:
+        with self._lock:
+            # 清理过期任务，并按创建时间淘汰超出数量上限的已完成任务；仍在执行的任务不淘汰
+            stale = self._conn.execute(
+                "SELECT id FROM batch_jobs WHERE expires_at <= ? UNION "
+                "SELECT id FROM (SELECT id, done FROM batch_jobs ORDER BY created DESC LIMIT -1 OFFSET ?) "
+                "WHERE done = 1",
+                (time.time(), max(0, self.max_jobs - 1)),
+            ).fetchall()
+            for (stale_id,) in stale:
+                self._conn.execute("DELETE FROM batch_lines WHERE job_id = ?", (stale_id,))
+                self._conn.execute("DELETE FROM batch_jobs WHERE id = ?", (stale_id,))
+            self._conn.execute(
+                "INSERT INTO batch_jobs VALUES (?, ?, ?, ?, ?, 0, 0, 0)",
+                (job.id, job.owner, job.total, job.created, expires_at),
+            )
+            self._conn.commit()
+
+    def append(self, job_id: str, position: int, line: str, succeeded: int, failed: int) -> None:
+        with self._lock:
+            # 任务已过期被清理时不再写入，避免留下没有任务的结果行
+            self._conn.execute(
+                "INSERT INTO batch_lines SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM batch_jobs WHERE id = ?)",
+                (job_id, position, line, job_id),
+            )
+            self._conn.execute(
+                "UPDATE batch_jobs SET succeeded = ?, failed = ? WHERE id = ?",
+                (succeeded, failed, job_id),
+            )
+            self._conn.commit()
+
+    def finish(self, job_id: str) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE batch_jobs SET done = 1 WHERE id = ?", (job_id,))
+            self._conn.commit()
+
+    def job(self, job_id: str) -> Optional[Tuple]:
+        """Returns: (owner, total, created, done, succeeded, failed)，不存在或已过期时返回 None"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT owner, total, created, done, succeeded, failed FROM batch_jobs "
+                "WHERE id = ? AND expires_at > ?",
+                (job_id, time.time()),
+            ).fetchone()
+
+    def read(self, job_id: str, position: int) -> Tuple[Optional[Tuple], List[str]]:
+        """
+        读取任务状态与第 position 行之后的结果
+
+        先读状态再读结果行：任务在写完所有结果行之后才标记完成，
+        状态为已完成时读到的结果行一定完整。
+        """
+        row = self.job(job_id)
+        with self._lock:
+            lines = self._conn.execute(
+                "SELECT line FROM batch_lines WHERE job_id = ? AND position >= ? ORDER BY position",
+                (job_id, position),
+            ).fetchall()
+        return row, [line for (line,) in lines]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class BatchJob:
+    """
+    一个批量任务
+
+    结果行按完成顺序追加到共享列表，每个读取者维护自己的位置，
+    与 single_flight.StreamBroadcast 相同，断线重连的读取者从指定位置追读。
+    """
+
+    def __init__(
+        self, job_id: str, owner: str, total: int, backend: Optional[SqliteBatchBackend] = None
+    ):
+        self.id = job_id
+        self.owner = owner
+        self.total = total
+        self.created = int(time.time())
+        self.lines: List[str] = []
+        self.succeeded = 0
+        self.failed = 0
+        self.done = False
+        self._backend = backend
+        self._changed = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _persist(self, method: Callable[..., None], *args: Any) -> None:
+        if self._backend is None:
+            return
+        try:
+            await asyncio.to_thread(method, *args)
+        except sqlite3.Error as e:
+            logger.warning(f"Batch {self.id} SQLite write failed: {e}")
+
+    def start(
+        self,
+        items: List[BatchItem],
+        execute: Callable[[ChatRequest], Awaitable[Dict[str, Any]]],
+        concurrency: int,
+    ) -> None:
+        self._task = asyncio.create_task(self._run(items, execute, concurrency))
+
+    async def _run(
+        self,
+        items: List[BatchItem],
+        execute: Callable[[ChatRequest], Awaitable[Dict[str, Any]]],
+        concurrency: int,
+    ) -> None:
+        pending = iter(enumerate(items))
+
+        async def worker() -> None:
+            # 共享同一个迭代器，每个 worker 完成一个再取下一个
+            for index, (custom_id, item) in pending:
+                await self._execute_one(index, custom_id, item, execute)
+
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, self.total)))))
+        finally:
+            if self._backend is not None:
+                await self._persist(self._backend.finish, self.id)
+            self.done = True
+            async with self._changed:
+                self._changed.notify_all()
+            logger.info(
+                "Batch finished",
+                extra={
+                    "batch_id": self.id,
+                    "total": self.total,
+                    "succeeded": self.succeeded,
+                    "failed": self.failed,
+                    "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+                },
+            )
+
+    async def _execute_one(
+        self,
+        index: int,
+        custom_id: Optional[str],
+        item: Union[ChatRequest, str],
+        execute: Callable[[ChatRequest], Awaitable[Dict[str, Any]]],
+    ) -> None:
+        result: Dict[str, Any] = {
+            "object": "batch.item",
+            "batch_id": self.id,
+            "index": index,
+            "custom_id": custom_id,
+        }
+        try:
+            if isinstance(item, str):
+                raise BatchItemError(400, item)
+            result["status_code"] = 200
+            result["response"] = await execute(item)
+            self.succeeded += 1
+            BATCH_ITEMS_TOTAL.labels("succeeded").inc()
+        except BatchItemError as e:
+            result["status_code"] = e.status_code
+            result["error"] = {"message": str(e), "code": e.status_code}
+            self.failed += 1
+            BATCH_ITEMS_TOTAL.labels("failed").inc()
+        except Exception as e:
+            logger.error(f"Batch item {index} failed: {e}", exc_info=True)
+            result["status_code"] = 500
+            result["error"] = {"message": "Internal error", "code": 500}
+            self.failed += 1
+            BATCH_ITEMS_TOTAL.labels("failed").inc()
+        line = json_codec.dumps(result) + "\n"
+        self.lines.append(line)
+        if self._backend is not None:
+            await self._persist(
+                self._backend.append, self.id, len(self.lines) - 1, line, self.succeeded, self.failed
+            )
+        async with self._changed:
+            self._changed.notify_all()
+
+    def summary(self) -> Dict[str, Any]:
+        return _summary(self.id, self.created, self.done, self.total, self.succeeded, self.failed)
+
+    async def results(self, offset: int = 0) -> AsyncIterator[str]:
+        """
+        从第 offset 行开始输出结果，直到任务结束；最后输出一行任务摘要
+
+        客户端断开只结束本次读取，不影响后台任务。
+        """
+        position = max(0, offset)
+        while True:
+            while position < len(self.lines):
+                yield self.lines[position]
+                position += 1
+            if self.done:
+                break
+            async with self._changed:
+                await self._changed.wait_for(lambda: position < len(self.lines) or self.done)
+        yield json_codec.dumps(self.summary()) + "\n"
+
+
+class StoredBatchJob:
+    """由其它 worker 执行、从 SQLite 读取结果的批量任务"""
+
+    def __init__(self, job_id: str, backend: SqliteBatchBackend, poll_interval: float):
+        self.id = job_id
+        self._backend = backend
+        self._poll_interval = poll_interval
+
+    async def results(self, offset: int = 0) -> AsyncIterator[str]:
+        """与 BatchJob.results 相同，轮询 SQLite 直到任务结束"""
+        position = max(0, offset)
+        while True:
+            try:
+                row, lines = await asyncio.to_thread(self._backend.read, self.id, position)
+            except sqlite3.Error as e:
+                logger.warning(f"Batch {self.id} SQLite read failed: {e}")
+                row, lines = None, []
+            if row is None:
+                # 任务已过期或被淘汰
+                return
+            for line in lines:
+                yield line
+            position += len(lines)
+            _, total, created, done, succeeded, failed = row
+            if done:
+                break
+            if not lines:
+                await asyncio.sleep(self._poll_interval)
+        yield json_codec.dumps(_summary(self.id, created, True, total, succeeded, failed)) + "\n"
+
+
+class BatchStore:
+    def __init__(
+        self,
+        max_jobs: int,
+        ttl: float,
+        sqlite_path: Optional[str] = None,
+        poll_interval: float = 0.5,
+    ):
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self._jobs: TTLLRUCache[BatchJob] = TTLLRUCache(max_jobs, ttl)
+        self.shared: Optional[SqliteBatchBackend] = None
+        if sqlite_path:
+            try:
+                self.shared = SqliteBatchBackend(sqlite_path, max_jobs)
+            except sqlite3.Error as e:
+                logger.warning(f"Batch SQLite backend disabled: {e}")
+
+    async def create(self, owner: str, total: int) -> BatchJob:
+        job = BatchJob(f"batch_{uuid4_str().replace('-', '')}", owner, total, self.shared)
+        self._jobs.set(job.id, job)
+        if self.shared is not None:
+            try:
+                await asyncio.to_thread(self.shared.create, job, time.time() + self.ttl)
+            except sqlite3.Error as e:
+                logger.warning(f"Batch {job.id} SQLite write failed: {e}")
+        return job
+
+    async def get(self, job_id: str, owner: str) -> Optional[Union[BatchJob, StoredBatchJob]]:
+        """只有提交者可以读取任务结果；本 worker 没有该任务时到 SQLite 中查找"""
+        job = self._jobs.get(job_id, count=False)
+        if job is not None:
+            return job if job.owner == owner else None
+        if self.shared is None:
+            return None
+        try:
+            row = await asyncio.to_thread(self.shared.job, job_id)
+        except sqlite3.Error as e:
+            logger.warning(f"Batch {job_id} SQLite lookup failed: {e}")
+            return None
+        if row is None or row[0] != owner:
+            return None
+        return StoredBatchJob(job_id, self.shared, self.poll_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._jobs.stats(),
+            "shared_backend": self.shared.path if self.shared is not None else None,
+        }
+
+
+_store: Optional[BatchStore] = None
+
+
+def get_batch_store() -> BatchStore:
+    global _store
+    if _store is None:
+        settings = get_settings()
+        _store = BatchStore(
+            settings.BATCH_MAX_JOBS,
+            settings.BATCH_RESULT_TTL,
+            sqlite_path=settings.BATCH_SQLITE_PATH or None,
+            poll_interval=settings.BATCH_POLL_INTERVAL,
+        )
+    return _store
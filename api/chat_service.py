@@ -1,63 +1,48 @@
+import asyncio
 from datetime import datetime
-import json
 import time
-from typing import Any, Dict, List, Optional
-import uuid
+from typing import Any, AsyncIterator, Callable, Dict, FrozenSet, List, Optional, Protocol
 import httpx
 from api.config import get_settings
-from api.image_uploader import ImageUploader
+from api.ids import uuid4_str
 from api.models import ChatRequest, Message
+from api.response_cache import make_request_key
+from api.token_pool import get_token_pool
+from api.lifecycle import inflight
 from api.logger import setup_logger
-from api.signature_generator import generate_signature
+from api.model_registry import get_model_registry
+from api.metrics import (
+    ACTIVE_STREAMS,
+    IMAGE_UPLOAD_SECONDS,
+    PREPARE_DATA_SECONDS,
+    StreamMetrics,
+)
+from api.single_flight import SingleFlight
+from api.stream_translator import (
+    CompletionAggregator,
+    OpenAIStreamTranslator,
+    UpstreamEvent,
+)
+from api.upstream import UpstreamError, upstream_events
 
 logger = setup_logger(__name__)
 
 settings = get_settings()
-BASE_URL = settings.PROXY_URL
-
-
-def create_chat_completion_data(
-    content: str,
-    model: str,
-    timestamp: int,
-    phase: str,
-    usage: Optional[dict] = None,
-    finish_reason: Optional[str] = None,
-) -> Dict[str, Any]:
-    if phase == "answer":
-        finish_reason = None
-        delta = {"content": content, "role": "assistant"}
-    elif phase == "thinking":
-        finish_reason = None
-        delta = {"reasoning_content": content, "role": "assistant"}
-    elif phase == "other":
-        finish_reason = finish_reason
-        delta = {"content": content, "role": "assistant"}
-    elif phase == "tool_call":
-        finish_reason = None
-        delta = {"content": content, "role": "assistant"}
-
-    return {
-        "id": f"chatcmpl-{uuid.uuid4()}",
-        "object": "chat.completion.chunk",
-        "created": timestamp,
-        "model": model,
-        "choices": [
-            {
-                "index": 0,
-                "delta": delta,
-                "finish_reason": finish_reason,
-            }
-        ],
-        "usage": None if usage is None else usage,
-    }
 
 
 def convert_messages(messages: List[Message]):
     trans_messages = []
     image_urls = []
     for message in messages:
-        if isinstance(message.content, str):
+        if message.tool_calls or message.role == "tool":
+            # 工具调用与工具结果按 OpenAI 格式转发；内容片段列表合并为文本，上游签名只接受字符串
+            converted = message.model_dump(exclude_none=True)
+            if isinstance(message.content, list):
+                converted["content"] = "".join(
+                    part.get("text", "") for part in message.content if part.get("type") == "text"
+                )
+            trans_messages.append(converted)
+        elif isinstance(message.content, str):
             trans_messages.append({"role": message.role, "content": message.content})
         elif isinstance(message.content, list):
             for part in message.content:
@@ -70,209 +55,234 @@ def convert_messages(messages: List[Message]):
     return {"messages": trans_messages, "image_urls": image_urls}
 
 
-def getfeatures(model: str, streaming: bool) -> Dict[str, bool]:
-    dict = {}
-    if streaming:
-        features = {
-            "image_generation": False,
-            "web_search": False,
-            "auto_web_search": False,
-            "preview_mode": False,
-            "flags": [],
-            "enable_thinking": True,
-        }
-
-        mcp_servers = []
-        if model in ["glm-4.6-search", "glm-4.6-advanced-search"]:
-            features["web_search"] = True
-            features["auto_web_search"] = True
-            features["preview_mode"] = True
-        if model == "glm-4.6-nothinking":
-            features["enable_thinking"] = False
-        if model == "glm-4.6-advanced-search":
-            mcp_servers = [
-                "advanced-search",
-            ]
-
-        dict["features"] = features
-        dict["mcp_servers"] = mcp_servers
-    else:
-        features = {
-            "image_generation": False,
-            "web_search": False,
-            "auto_web_search": False,
-            "preview_mode": False,
-            "flags": [],
-            "enable_thinking": False,
-        }
-        mcp_servers = []
-        dict["features"] = features
-        dict["mcp_servers"] = mcp_servers
-    return dict
+def tool_names(request: ChatRequest) -> FrozenSet[str]:
+    """客户端声明的函数名；tool_choice 为 none 时不输出工具调用"""
+    if not request.tools or request.tool_choice == "none":
+        return frozenset()
+    return frozenset(
+        tool["function"]["name"]
+        for tool in request.tools
+        if tool.get("type", "function") == "function" and tool.get("function", {}).get("name")
+    )
 
 
-async def prepare_data(request, access_token, streaming=True):
-    convert_dict = convert_messages(request.messages)
-    zai_data = {
-        "stream": True,
-        "model": settings.MODELS_MAPPING.get(request.model),
-        "messages": convert_dict["messages"],
-        "chat_id": str(uuid.uuid4()),
-        "id": str(uuid.uuid4()),
-    }
+async def upload_images(image_urls: List[str], access_token: str) -> List[Dict[str, str]]:
+    """
+    并发上传图片，返回上游 files 列表（保持原始顺序）
+
+    并发数由 IMAGE_UPLOAD_CONCURRENCY 限制，整体耗时受 IMAGE_UPLOAD_DEADLINE 约束；
+    失败或超时的图片记录日志后跳过，不会生成 id 为空的条目。
+    """
+    if not image_urls:
+        return []
+
+    # 图片上传模块（含缓存与 sqlite3）只在第一次遇到图片时导入，缩短冷启动时间
+    from api.image_uploader import ImageUploader
 
     image_uploader = ImageUploader(access_token)
+    semaphore = asyncio.Semaphore(max(1, settings.IMAGE_UPLOAD_CONCURRENCY))
+
+    async def upload_one(url: str) -> Optional[str]:
+        async with semaphore:
+            if url.startswith("data:image/"):
+                return await image_uploader.upload_data_url(url)
+            if url.startswith("http"):
+                return await image_uploader.upload_image_from_url(url)
+            logger.warning(f"Unsupported image url scheme: {url[:50]}")
+            return None
+
+    tasks = [asyncio.create_task(upload_one(url)) for url in image_urls]
+    done, pending = await asyncio.wait(tasks, timeout=settings.IMAGE_UPLOAD_DEADLINE)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
     files = []
-    for url in convert_dict["image_urls"]:
-        if url.startswith("data:image/"):
-            image_base64 = url.split("base64,")[-1]
-            pic_id = await image_uploader.upload_base64_image(image_base64)
-            files.append({"type": "image", "id": pic_id})
-        elif url.startswith("http"):
-            pic_id = await image_uploader.upload_image_from_url(url)
-            files.append({"type": "image", "id": pic_id})
-    zai_data["files"] = files
-
-    features_dict = getfeatures(request.model, streaming)
-    zai_data["features"] = features_dict["features"]
-    if len(features_dict["mcp_servers"]) > 0:
-        zai_data["mcp_servers"] = features_dict["mcp_servers"]
-
-    params = {
-        "requestId": str(uuid.uuid4()),
-        "timestamp": str(int(time.time() * 1000)),
-        "user_id": str(uuid.uuid4()),
-    }
-
-    e = "requestId,{request_id},timestamp,{timestamp},user_id,{user_id}".format(
-        request_id=params["requestId"],
-        timestamp=int(params["timestamp"]),
-        user_id=params["user_id"],
+    for index, task in enumerate(tasks):
+        if task not in done:
+            logger.warning(
+                f"Image {index} upload exceeded the {settings.IMAGE_UPLOAD_DEADLINE}s deadline, skipped"
+            )
+        elif task.exception() is not None:
+            logger.warning(f"Image {index} upload failed, skipped: {task.exception()}")
+        elif not task.result():
+            logger.warning(f"Image {index} upload returned no file id, skipped")
+        else:
+            files.append({"type": "image", "id": task.result()})
+    return files
+
+
+async def prepare_data(request, access_token, streaming=True):
+    prepare_start = time.perf_counter()
+    convert_dict = convert_messages(request.messages)
+    zai_data = get_model_registry().template(request.model, streaming).payload()
+    zai_data["messages"] = convert_dict["messages"]
+    zai_data["chat_id"] = uuid4_str()
+    zai_data["id"] = uuid4_str()
+    if request.tools:
+        zai_data["tools"] = request.tools
+        if request.tool_choice is not None:
+            zai_data["tool_choice"] = request.tool_choice
+
+    if convert_dict["image_urls"]:
+        upload_start = time.perf_counter()
+        zai_data["files"] = await upload_images(convert_dict["image_urls"], access_token)
+        IMAGE_UPLOAD_SECONDS.labels(request.model).observe(
+            time.perf_counter() - upload_start
+        )
+    else:
+        zai_data["files"] = []
+
+    PREPARE_DATA_SECONDS.labels(request.model).observe(time.perf_counter() - prepare_start)
+    return zai_data
+
+
+class StreamTranslator(Protocol):
+    """
+    把上游事件直接翻译为某种客户端协议的 SSE 文本
+
+    OpenAI（stream_translator.OpenAIStreamTranslator）、Anthropic Messages（anthropic_api）、
+    Responses（responses_api）共用同一个上游解析器与流式处理流程，各自实现该接口。
+    """
+
+    def translate(self, event: UpstreamEvent) -> Optional[str]: ...
+
+    def finish(self) -> Optional[str]: ...
+
+    def error(self, message: str, code: Optional[int] = None) -> str: ...
+
+
+async def process_streaming_response(
+    request: ChatRequest,
+    access_token: str,
+    translator: Optional[StreamTranslator] = None,
+    aggregator: Optional[CompletionAggregator] = None,
+):
+    """
+    把上游流翻译为客户端协议的 chunk
+
+    传入 aggregator 时同时聚合完整响应，供路由在流正常结束后写入响应缓存
+    """
+
+    metrics = StreamMetrics(request.model)
+    if translator is None:
+        translator = OpenAIStreamTranslator(
+            request.model, int(datetime.now().timestamp()), tool_names(request)
+        )
+    zai_data = await prepare_data(request, access_token)
+    active_streams = ACTIVE_STREAMS.labels(request.model)
+    active_streams.inc()
+    inflight.enter()
+    outcome = "cancelled"
+    try:
+        async with upstream_events(zai_data, access_token, metrics) as events:
+            async for event in events:
+                if aggregator is not None:
+                    aggregator.feed(event)
+                chunk = translator.translate(event)
+                if chunk is not None:
+                    metrics.chunk(event.phase)
+                    yield chunk
+                if event.phase == "done":
+                    break
+        tail = translator.finish()
+        if tail is not None:
+            yield tail
+        outcome = "completed"
+
+    except UpstreamError as e:
+        outcome = "upstream_error"
+        logger.error(f"Upstream request failed: {e}")
+        yield translator.error(str(e), e.status_code)
+    except httpx.HTTPError as e:
+        # 已经向客户端输出了内容，不再重试
+        outcome = "interrupted"
+        metrics.upstream_failed()
+        logger.error(f"Upstream stream interrupted: {type(e).__name__}: {e}")
+        yield translator.error(f"Upstream stream interrupted: {type(e).__name__}")
+    finally:
+        active_streams.dec()
+        inflight.exit()
+        logger.info("Chat stream finished", extra=metrics.summary(outcome))
+
+
+async def process_non_streaming_response(
+    request: ChatRequest,
+    access_token: str,
+    render: Optional[Callable[[CompletionAggregator], Dict[str, Any]]] = None,
+):
+    """
+    把上游流聚合为完整的响应，默认为 chat.completion，其它协议通过 render 生成各自的响应体
+
+    Raises:
+        UpstreamError: 上游请求失败
+    """
+    metrics = StreamMetrics(request.model)
+    zai_data = await prepare_data(request, access_token, False)
+    aggregator = CompletionAggregator(tool_names(request))
+    inflight.enter()
+    outcome = "cancelled"
+    events_count = 0
+    try:
+        async with upstream_events(zai_data, access_token, metrics) as events:
+            async for event in events:
+                events_count += 1
+                aggregator.feed(event)
+                if aggregator.done:
+                    break
+        outcome = "completed"
+    except UpstreamError:
+        outcome = "upstream_error"
+        raise
+    except httpx.HTTPError as e:
+        outcome = "interrupted"
+        metrics.upstream_failed()
+        raise UpstreamError(
+            f"Upstream stream interrupted: {type(e).__name__}", retryable=False
+        ) from e
+    finally:
+        inflight.exit()
+        logger.info(
+            "Chat completion finished",
+            extra={**metrics.summary(outcome), "chunks": events_count},
+        )
+    if render is not None:
+        return render(aggregator)
+    return aggregator.build(request.model)
+
+
+# 合并并发的相同请求（COALESCE_ENABLED 开启时由路由使用）
+single_flight = SingleFlight()
+
+
+def _coalesce_scope(access_token: str) -> Optional[str]:
+    """
+    直传模式下上游令牌来自客户端，只合并同一令牌的请求，
+    否则任意令牌的请求都能加入用别人账号发起的上游流；令牌池模式下不区分
+    """
+    return access_token if get_token_pool() is None else None
+
+
+def coalesced_streaming_response(
+    request: ChatRequest, access_token: str, aggregator: Optional[CompletionAggregator] = None
+) -> AsyncIterator[str]:
+    """
+    相同请求并发到达时只向上游发起一个流
+
+    第一个请求驱动上游流，后续相同请求订阅同一组已翻译好的 chunk；
+    aggregator 只由驱动上游流的第一个请求填充，加入的请求不会得到聚合结果。
+    """
+    key = f"stream:{make_request_key(request, _coalesce_scope(access_token))}"
+    return single_flight.stream(
+        key,
+        lambda: process_streaming_response(request, access_token, aggregator=aggregator),
     )
 
-    t = zai_data["messages"][-1]["content"]
-    signature_data = generate_signature(e, t)
-    params["signature_timestamp"] = str(signature_data["timestamp"])
-    headers = settings.HEADERS
-    headers["Authorization"] = f"Bearer {access_token}"
-    headers["X-Signature"] = signature_data["signature"]
-    return zai_data, params, headers
-
-
-async def process_streaming_response(request: ChatRequest, access_token: str):
-
-    zai_data, params, headers = await prepare_data(request, access_token)
-    async with httpx.AsyncClient() as client:
-        try:
-            async with client.stream(
-                "POST",
-                f"{BASE_URL}/api/chat/completions",
-                headers=headers,
-                params=params,
-                json=zai_data,
-                timeout=300,
-            ) as response:
-                response.raise_for_status()
-                timestamp = int(datetime.now().timestamp())
-                async for line in response.aiter_lines():
-                    if line:
-                        # print(line)
-                        if line.startswith("data:"):
-                            json_str = line[6:]  # 去掉 "data: " 前缀
-                            json_object = json.loads(json_str)
-                            if json_object.get("data", {}).get("phase") == "thinking":
-                                if json_object.get("data").get(
-                                    "delta_content"
-                                ) and "</summary>\n" in json_object.get("data").get(
-                                    "delta_content"
-                                ):
-                                    content = (
-                                        json_object.get("data")
-                                        .get("delta_content", "")
-                                        .split("</summary>\n")[-1]
-                                    )
-                                else:
-                                    content = json_object.get("data").get(
-                                        "delta_content", ""
-                                    )
-                                yield f"data: {json.dumps(create_chat_completion_data(content, request.model, timestamp, 'thinking'))}\n\n"
-                            elif json_object.get("data", {}).get("phase") == "answer":
-                                if json_object.get("data").get(
-                                    "edit_content"
-                                ) and "</summary>\n" in json_object.get("data").get(
-                                    "edit_content"
-                                ):
-                                    content = (
-                                        json_object.get("data")
-                                        .get("edit_content", "")
-                                        .split("</details>")[-1]
-                                    )
-                                elif json_object.get("data").get("delta_content"):
-                                    content = json_object.get("data").get(
-                                        "delta_content"
-                                    )
-                                yield f"data: {json.dumps(create_chat_completion_data(content, request.model, timestamp, 'answer'))}\n\n"
-                            elif json_object.get("data", {}).get("phase") == "other":
-                                usage = json_object.get("data").get("usage", {})
-                                content = json_object.get("data").get(
-                                    "delta_content", ""
-                                )
-                                yield f"data: {json.dumps(create_chat_completion_data(content, request.model, timestamp, 'other', usage, 'stop'))}\n\n"
-                            # elif json_object.get("data", {}).get("phase") == "tool_call":
-                            #     content = json_object.get("data").get(
-                            #         "edit_content", ""
-                            #     )
-                            #     yield f"data: {json.dumps(create_chat_completion_data(content, request.model, timestamp, 'tool_call'))}\n\n"
-                            elif json_object.get("data", {}).get("phase") == "done":
-                                yield "data: [DONE]\n\n"
-                                break
-
-        except httpx.HTTPStatusError as e:
-            logger.error(f"HTTP error occurred: {e}")
-        except httpx.RequestError as e:
-            logger.error(f"Error occurred during request: {e}")
-
-
-async def process_non_streaming_response(request: ChatRequest, access_token: str):
-
-    zai_data, params, headers = await prepare_data(request, access_token, False)
-    full_response = ""
-    usage = {}
-    async with httpx.AsyncClient() as client:
-        async with client.stream(
-            method="POST",
-            url=f"{BASE_URL}/api/chat/completions",
-            headers=headers,
-            params=params,
-            json=zai_data,
-            timeout=300,
-        ) as response:
-            async for line in response.aiter_lines():
-                if line:
-                    if line.startswith("data:"):
-                        json_str = line[6:]  # 去掉 "data: " 前缀
-                        json_object = json.loads(json_str)
-                        if json_object.get("data", {}).get("phase") == "answer":
-                            if json_object.get("data").get("delta_content"):
-                                content = json_object.get("data").get("delta_content")
-                            else:
-                                content = ""
-                            full_response += content
-                        elif json_object.get("data", {}).get("phase") == "other":
-                            usage = json_object.get("data").get("usage", {})
-                            content = json_object.get("data").get("delta_content", "")
-                            full_response += content
-    return {
-        "id": f"chatcmpl-{uuid.uuid4()}",
-        "object": "chat.completion",
-        "created": int(datetime.now().timestamp()),
-        "model": request.model,
-        "choices": [
-            {
-                "index": 0,
-                "message": {"role": "assistant", "content": full_response},
-                "finish_reason": "stop",
-            }
-        ],
-        "usage": usage,
-    }
+
+async def coalesced_non_streaming_response(request: ChatRequest, access_token: str):
+    """相同的非流式请求并发到达时共享同一次上游调用的结果"""
+    key = f"call:{make_request_key(request, _coalesce_scope(access_token))}"
+    return await single_flight.call(
+        key, lambda: process_non_streaming_response(request, access_token)
+    )
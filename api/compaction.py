@@ -0,0 +1,105 @@
+"""
+上下文压缩（COMPACTION_ENABLED 开启时由路由调用）
+
+- 多段内容的消息把文本段合并为一条，保留原始角色（不再拆成多条 user 消息）
+- 用本地近似算法估算 token 数：ASCII 约 4 字符 1 token，其余字符（中日韩等）按 1 字符 1 token
+- 超出模型上下文预算时，从最早的非 system 消息开始丢弃，system 消息与最后一条消息始终保留
+"""
+from typing import Any, Dict, List, NamedTuple, Tuple
+from api import json_codec
+from api.models import ChatRequest, Message
+
+COMPACTION_HEADER = "X-Context-Compaction"
+
+# 每条消息的角色、分隔符等固定开销
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class CompactionReport(NamedTuple):
+    bytes_before: int
+    bytes_after: int
+    tokens_before: int
+    tokens_after: int
+    dropped_messages: int
+
+    def header_value(self) -> str:
+        return (
+            f"bytes={self.bytes_before}->{self.bytes_after}; "
+            f"tokens={self.tokens_before}->{self.tokens_after}; "
+            f"dropped={self.dropped_messages}"
+        )
+
+
+def estimate_tokens(text: str) -> int:
+    """快速估算文本的 token 数（不依赖分词器）"""
+    if text.isascii():
+        return (len(text) + 3) // 4
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def _merge_parts(message: Message) -> Message:
+    """把多段内容中的文本段合并为一段，图片段原样保留"""
+    if not isinstance(message.content, list):
+        return message
+    texts: List[str] = []
+    images: List[Dict[str, Any]] = []
+    for part in message.content:
+        if part.get("type") == "text":
+            texts.append(part.get("text", ""))
+        elif part.get("type") == "image_url":
+            images.append(part)
+    text = "\n".join(texts)
+    if not images:
+        return message.model_copy(update={"content": text})
+    return message.model_copy(update={"content": [{"type": "text", "text": text}, *images]})
+
+
+def _text_of(message: Message) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    if message.content is None:
+        # 只有工具调用的 assistant 消息按参数长度估算
+        return "".join(call.get("function", {}).get("arguments", "") for call in message.tool_calls or ())
+    return "".join(part.get("text", "") for part in message.content if part.get("type") == "text")
+
+
+def _payload_bytes(messages: List[Message]) -> int:
+    return len(json_codec.dumps_bytes([message.model_dump(exclude_none=True) for message in messages]))
+
+
+def compact_request(request: ChatRequest, budget_tokens: int) -> Tuple[ChatRequest, CompactionReport]:
+    """
+    合并多段消息并把历史裁剪到 budget_tokens 以内
+
+    Returns:
+        (压缩后的请求, 压缩前后的大小报告)
+    """
+    merged = [_merge_parts(message) for message in request.messages]
+    costs = [estimate_tokens(_text_of(message)) + _MESSAGE_OVERHEAD_TOKENS for message in merged]
+    tokens_before = sum(costs)
+
+    keep = [True] * len(merged)
+    total = tokens_before
+    last = len(merged) - 1
+    index = 0
+    while total > budget_tokens and index < last:
+        if merged[index].role != "system":
+            keep[index] = False
+            total -= costs[index]
+        index += 1
+    # 裁剪后第一条非 system 消息不应是 assistant 的回答或失去对应调用的工具结果
+    while total < tokens_before and index < last and merged[index].role in ("assistant", "tool"):
+        keep[index] = False
+        total -= costs[index]
+        index += 1
+
+    compacted = [message for message, kept in zip(merged, keep) if kept]
+    report = CompactionReport(
+        bytes_before=_payload_bytes(request.messages),
+        bytes_after=_payload_bytes(compacted),
+        tokens_before=tokens_before,
+        tokens_after=total,
+        dropped_messages=len(merged) - len(compacted),
+    )
+    return request.model_copy(update={"messages": compacted}), report
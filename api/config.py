@@ -1,7 +1,7 @@
 import os
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
-from typing import Dict, List
+from typing import Any, Dict, List
 
 load_dotenv()
 
@@ -13,39 +13,187 @@ class Settings(BaseSettings):
     DEBUG: bool = os.getenv("DEBUG", "False").lower() == "true"
     WORKERS: int = int(os.getenv("WORKERS", "1"))
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    # json 或 text
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json")
+    # 热路径 DEBUG 日志（extra 带 sampled=True）的采样率（0~1），避免淹没输出；其余 DEBUG 日志不采样
+    LOG_DEBUG_SAMPLE_RATE: float = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+    # 日志队列容量，写满后丢弃新日志而不是阻塞事件循环
+    LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    # 事件循环与 HTTP 解析器实现，auto 时已安装 uvloop/httptools 则自动使用
+    UVICORN_LOOP: str = os.getenv("UVICORN_LOOP", "auto")
+    UVICORN_HTTP: str = os.getenv("UVICORN_HTTP", "auto")
+    # 收到退出信号后等待在途流结束的最长时间（秒）
+    SHUTDOWN_GRACE_PERIOD: float = float(os.getenv("SHUTDOWN_GRACE_PERIOD", "120"))
 
     # API settings
     PROXY_URL: str = os.getenv("PROXY_URL", "https://chat.z.ai")
 
+    # Upstream token pool settings
+    # 配置了上游令牌后，客户端使用 APP_SECRET 认证，由代理选择上游令牌；此时必须设置，否则拒绝所有请求
+    APP_SECRET: str = os.getenv("APP_SECRET", "")
+    UPSTREAM_TOKENS: str = os.getenv("UPSTREAM_TOKENS", "")
+    UPSTREAM_TOKENS_FILE: str = os.getenv("UPSTREAM_TOKENS_FILE", "")
+    TOKEN_RATE_LIMIT_COOLDOWN: float = float(os.getenv("TOKEN_RATE_LIMIT_COOLDOWN", "60"))
+    TOKEN_AUTH_FAILURE_COOLDOWN: float = float(
+        os.getenv("TOKEN_AUTH_FAILURE_COOLDOWN", "600")
+    )
+    TOKEN_MAX_IN_FLIGHT: int = int(os.getenv("TOKEN_MAX_IN_FLIGHT", "0"))
+
+    # Upstream connection pool settings (per worker)
+    HTTP2_ENABLED: bool = os.getenv("HTTP2_ENABLED", "True").lower() == "true"
+    POOL_MAX_CONNECTIONS: int = int(os.getenv("POOL_MAX_CONNECTIONS", "100"))
+    # 设置后按 WORKERS 平均分配到每个 worker，覆盖 POOL_MAX_CONNECTIONS
+    POOL_MAX_CONNECTIONS_TOTAL: int = int(os.getenv("POOL_MAX_CONNECTIONS_TOTAL", "0"))
+    POOL_MAX_KEEPALIVE_CONNECTIONS: int = int(
+        os.getenv("POOL_MAX_KEEPALIVE_CONNECTIONS", "20")
+    )
+    POOL_KEEPALIVE_EXPIRY: float = float(os.getenv("POOL_KEEPALIVE_EXPIRY", "60"))
+    POOL_ACQUIRE_TIMEOUT: float = float(os.getenv("POOL_ACQUIRE_TIMEOUT", "10"))
+    UPSTREAM_CONNECT_TIMEOUT: float = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "10"))
+    UPSTREAM_TIMEOUT: float = float(os.getenv("UPSTREAM_TIMEOUT", "300"))
+    # 聊天请求的分阶段超时：发出请求到收到首个事件、两次读取之间的最长间隔
+    UPSTREAM_TTFB_TIMEOUT: float = float(os.getenv("UPSTREAM_TTFB_TIMEOUT", "30"))
+    UPSTREAM_IDLE_TIMEOUT: float = float(os.getenv("UPSTREAM_IDLE_TIMEOUT", "60"))
+    # 首个事件到达前的重试次数与退避（带随机抖动）
+    UPSTREAM_MAX_RETRIES: int = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+    UPSTREAM_RETRY_BACKOFF: float = float(os.getenv("UPSTREAM_RETRY_BACKOFF", "0.5"))
+    UPSTREAM_RETRY_BACKOFF_MAX: float = float(os.getenv("UPSTREAM_RETRY_BACKOFF_MAX", "4"))
+    # 对冲请求：首个事件迟迟未到时再发一个相同请求，先返回者胜出
+    HEDGE_ENABLED: bool = os.getenv("HEDGE_ENABLED", "False").lower() == "true"
+    # 固定对冲延迟（秒）；为 0 时使用最近首字节耗时的 p95
+    HEDGE_DELAY: float = float(os.getenv("HEDGE_DELAY", "0"))
+    HEDGE_MIN_DELAY: float = float(os.getenv("HEDGE_MIN_DELAY", "1"))
+    # 启动时预先建立的上游连接数（0 表示不预热），预热在后台进行，不阻塞启动
+    UPSTREAM_PREWARM_CONNECTIONS: int = int(os.getenv("UPSTREAM_PREWARM_CONNECTIONS", "2"))
+    UPSTREAM_PREWARM_TIMEOUT: float = float(os.getenv("UPSTREAM_PREWARM_TIMEOUT", "5"))
+    IMAGE_UPLOAD_TIMEOUT: float = float(os.getenv("IMAGE_UPLOAD_TIMEOUT", "30"))
+    IMAGE_UPLOAD_CONCURRENCY: int = int(os.getenv("IMAGE_UPLOAD_CONCURRENCY", "4"))
+    IMAGE_UPLOAD_DEADLINE: float = float(os.getenv("IMAGE_UPLOAD_DEADLINE", "45"))
+    IMAGE_MAX_BYTES: int = int(os.getenv("IMAGE_MAX_BYTES", str(20 * 1024 * 1024)))
+
+    # Streaming settings
+    # 上游读取与下游写出之间最多缓冲的 chunk 数
+    STREAM_BUFFER_CHUNKS: int = int(os.getenv("STREAM_BUFFER_CHUNKS", "64"))
+    DISCONNECT_POLL_INTERVAL: float = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+    # Image upload cache settings
+    IMAGE_CACHE_ENABLED: bool = os.getenv("IMAGE_CACHE_ENABLED", "True").lower() == "true"
+    IMAGE_CACHE_MAX_ENTRIES: int = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "1024"))
+    IMAGE_CACHE_TTL: float = float(os.getenv("IMAGE_CACHE_TTL", "3600"))
+    IMAGE_CACHE_SQLITE_PATH: str = os.getenv("IMAGE_CACHE_SQLITE_PATH", "")
+
+    # Response cache settings (opt-in)
+    RESPONSE_CACHE_ENABLED: bool = (
+        os.getenv("RESPONSE_CACHE_ENABLED", "False").lower() == "true"
+    )
+    RESPONSE_CACHE_MAX_ENTRIES: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+    RESPONSE_CACHE_TTL: float = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+
+    # 合并并发的相同请求，只向上游发起一次
+    COALESCE_ENABLED: bool = os.getenv("COALESCE_ENABLED", "False").lower() == "true"
+
+    # Admission control settings (opt-in, per worker)
+    ADMISSION_ENABLED: bool = os.getenv("ADMISSION_ENABLED", "False").lower() == "true"
+    # 同时执行的聊天请求上限，0 表示不限
+    ADMISSION_MAX_CONCURRENT: int = int(os.getenv("ADMISSION_MAX_CONCURRENT", "64"))
+    ADMISSION_MAX_PER_CLIENT: int = int(os.getenv("ADMISSION_MAX_PER_CLIENT", "8"))
+    # 等待队列长度与最长排队时间（秒），超出时返回 429
+    ADMISSION_QUEUE_SIZE: int = int(os.getenv("ADMISSION_QUEUE_SIZE", "128"))
+    ADMISSION_QUEUE_TIMEOUT: float = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+    # 每个客户端每秒允许的请求数与突发量，0 表示不限速
+    ADMISSION_RATE_PER_CLIENT: float = float(os.getenv("ADMISSION_RATE_PER_CLIENT", "0"))
+    ADMISSION_BURST: float = float(os.getenv("ADMISSION_BURST", "10"))
+
+    # Upstream recording / replay settings
+    # 抽样录制原始上游 SSE 行（gzip 压缩、脱敏），用于离线分析与基准测试
+    RECORD_ENABLED: bool = os.getenv("RECORD_ENABLED", "False").lower() == "true"
+    RECORD_SAMPLE_RATE: float = float(os.getenv("RECORD_SAMPLE_RATE", "0.01"))
+    RECORD_DIR: str = os.getenv("RECORD_DIR", "recordings")
+    # 最多保留的录制文件数，超出时删除最早的，0 表示不限
+    RECORD_MAX_FILES: int = int(os.getenv("RECORD_MAX_FILES", "1000"))
+    # 设置后不再请求上游，从录制文件（或目录）回放；REPLAY_SPEED=0 表示尽快回放
+    REPLAY_FILE: str = os.getenv("REPLAY_FILE", "")
+    REPLAY_SPEED: float = float(os.getenv("REPLAY_SPEED", "1"))
+
+    # Batch settings (/v1/batches)
+    BATCH_MAX_ITEMS: int = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+    # 单个批量任务同时执行的请求数
+    BATCH_CONCURRENCY: int = int(os.getenv("BATCH_CONCURRENCY", "8"))
+    # 结果保留的时间（秒）与最多保留的任务数，期间可凭 batch id 续读
+    BATCH_RESULT_TTL: float = float(os.getenv("BATCH_RESULT_TTL", "3600"))
+    BATCH_MAX_JOBS: int = int(os.getenv("BATCH_MAX_JOBS", "100"))
+    # 多 worker 共享结果的 SQLite 文件，留空则结果只保存在执行任务的 worker 内存中
+    BATCH_SQLITE_PATH: str = os.getenv("BATCH_SQLITE_PATH", "")
+    # 续读其它 worker 执行的任务时轮询 SQLite 的间隔（秒）
+    BATCH_POLL_INTERVAL: float = float(os.getenv("BATCH_POLL_INTERVAL", "0.5"))
+
+    # Context compaction settings (opt-in)
+    COMPACTION_ENABLED: bool = os.getenv("COMPACTION_ENABLED", "False").lower() == "true"
+    # 模型声明未指定 context_tokens 时使用的上下文长度
+    COMPACTION_DEFAULT_CONTEXT_TOKENS: int = int(
+        os.getenv("COMPACTION_DEFAULT_CONTEXT_TOKENS", "128000")
+    )
+    # 为模型输出预留的 token 数，历史消息预算 = 上下文长度 - 预留
+    COMPACTION_RESERVE_TOKENS: int = int(os.getenv("COMPACTION_RESERVE_TOKENS", "8192"))
+
     # Headers
+    # 连接复用由连接池负责，不再发送 Connection 头（HTTP/2 禁止该头部）
     HEADERS: Dict[str, str] = {
         "Accept": "*/*",
         "Accept-Language": "zh-CN",
         "Cache-Control": "no-cache",
-        "Connection": "keep-alive",
         "Content-Type": "application/json",
         "Origin": "https://chat.z.ai",
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/140.0.0.0 Safari/537.36",
         "X-FE-Version": "prod-fe-1.0.95",
     }
 
-    ALLOWED_MODELS: List[Dict[str, str]] = [
-        {"id": "glm-4.6", "name": "GLM-4.6"},
-        {"id": "glm-4.5V", "name": "GLM-4.5V"},
-        {"id": "glm-4.5", "name": "GLM-4.5"},
-        {"id": "glm-4.6-search", "name": "GLM-4.6-SEARCH"},
-        {"id": "glm-4.6-advanced-search", "name": "GLM-4.6-ADVANCED-SEARCH"},
-        {"id": "glm-4.6-nothinking", "name": "GLM-4.6-NOTHINKING"},
+    # 模型声明：公开 id、显示名、上游模型、上下文长度，以及在默认 features 之上的覆盖项
+    # 启动时编译为只读请求模板（见 api/model_registry.py）
+    MODELS: List[Dict[str, Any]] = [
+        {
+            "id": "glm-4.6",
+            "name": "GLM-4.6",
+            "upstream": "GLM-4-6-API-V1",
+            "context_tokens": 200000,
+        },
+        {
+            "id": "glm-4.5V",
+            "name": "GLM-4.5V",
+            "upstream": "glm-4.5v",
+            "context_tokens": 64000,
+        },
+        {
+            "id": "glm-4.5",
+            "name": "GLM-4.5",
+            "upstream": "0727-360B-API",
+            "context_tokens": 128000,
+        },
+        {
+            "id": "glm-4.6-search",
+            "name": "GLM-4.6-SEARCH",
+            "upstream": "GLM-4-6-API-V1",
+            "context_tokens": 200000,
+            "features": {"web_search": True, "auto_web_search": True, "preview_mode": True},
+        },
+        {
+            "id": "glm-4.6-advanced-search",
+            "name": "GLM-4.6-ADVANCED-SEARCH",
+            "upstream": "GLM-4-6-API-V1",
+            "context_tokens": 200000,
+            "features": {"web_search": True, "auto_web_search": True, "preview_mode": True},
+            "mcp_servers": ["advanced-search"],
+        },
+        {
+            "id": "glm-4.6-nothinking",
+            "name": "GLM-4.6-NOTHINKING",
+            "upstream": "GLM-4-6-API-V1",
+            "context_tokens": 200000,
+            "features": {"enable_thinking": False},
+        },
     ]
-
-    MODELS_MAPPING: Dict[str, str] = {
-        "glm-4.6": "GLM-4-6-API-V1",
-        "glm-4.6-nothinking": "GLM-4-6-API-V1",
-        "glm-4.6-search": "GLM-4-6-API-V1",
-        "glm-4.6-advanced-search": "GLM-4-6-API-V1",
-        "glm-4.5V": "glm-4.5v",
-        "glm-4.5": "0727-360B-API",
-    }
+    # JSON 文件，格式同 MODELS；id 相同的条目覆盖内置声明，其余追加
+    MODELS_FILE: str = os.getenv("MODELS_FILE", "")
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,44 @@
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional
+from api.config import get_settings
+
+# 上传接口使用的固定请求头
+_UPLOAD_HEADERS: Mapping[str, str] = MappingProxyType(
+    {
+        "Accept": "application/json",
+        "Accept-Language": "zh-CN,zh;q=0.9",
+        "Cache-Control": "no-cache",
+        "Origin": "https://chat.z.ai",
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/140.0.0.0 Safari/537.36",
+    }
+)
+
+_chat_headers: Optional[Mapping[str, str]] = None
+
+
+def get_base_chat_headers() -> Mapping[str, str]:
+    """
+    获取聊天接口的基础请求头
+
+    基于 Settings.HEADERS 计算一次后缓存为只读映射，进程内所有请求共享，
+    任何人都无法修改它。
+    """
+    global _chat_headers
+    if _chat_headers is None:
+        _chat_headers = MappingProxyType(dict(get_settings().HEADERS))
+    return _chat_headers
+
+
+def build_chat_headers(access_token: str, signature: str) -> Dict[str, str]:
+    """基于只读基础请求头，为单个请求叠加认证与签名头"""
+    headers = dict(get_base_chat_headers())
+    headers["Authorization"] = f"Bearer {access_token}"
+    headers["X-Signature"] = signature
+    return headers
+
+
+def build_upload_headers(access_token: str) -> Dict[str, str]:
+    """基于只读上传请求头，为单个请求叠加认证头"""
+    headers = dict(_UPLOAD_HEADERS)
+    headers["authorization"] = f"Bearer {access_token}"
+    return headers
@@ -0,0 +1,140 @@
+import asyncio
+import importlib.util
+from typing import Any, Dict, Optional, Tuple
+import httpx
+from api.config import get_settings
+from api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def per_worker_pool_limits() -> Tuple[int, int]:
+    """
+    计算当前 worker 的连接池大小
+
+    配置了 POOL_MAX_CONNECTIONS_TOTAL 时按 WORKERS 平均分配，否则直接使用
+    POOL_MAX_CONNECTIONS。
+
+    Returns:
+        (最大连接数, 最大保活连接数)
+    """
+    settings = get_settings()
+    max_connections = settings.POOL_MAX_CONNECTIONS
+    if settings.POOL_MAX_CONNECTIONS_TOTAL > 0:
+        workers = max(1, settings.WORKERS)
+        max_connections = max(1, -(-settings.POOL_MAX_CONNECTIONS_TOTAL // workers))
+    return max_connections, min(settings.POOL_MAX_KEEPALIVE_CONNECTIONS, max_connections)
+
+
+def _create_client() -> httpx.AsyncClient:
+    settings = get_settings()
+    max_connections, max_keepalive = per_worker_pool_limits()
+    http2 = settings.HTTP2_ENABLED
+    if http2 and not _http2_available():
+        logger.warning("HTTP2_ENABLED is set but h2 is not installed, falling back to HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=settings.POOL_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        settings.UPSTREAM_TIMEOUT,
+        connect=settings.UPSTREAM_CONNECT_TIMEOUT,
+        pool=settings.POOL_ACQUIRE_TIMEOUT,
+    )
+    logger.info(
+        f"Creating upstream HTTP client (http2={http2}, "
+        f"max_connections={max_connections}, max_keepalive={max_keepalive})"
+    )
+    return httpx.AsyncClient(http2=http2, limits=limits, timeout=timeout)
+
+
+async def init_http_client() -> httpx.AsyncClient:
+    """在应用启动时创建共享连接池"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+
+async def prewarm_http_client(url: str, connections: int, timeout: float) -> int:
+    """
+    预先建立到上游的连接（DNS、TCP、TLS 握手），首个请求不再承担建连耗时
+
+    并发发出 connections 个 HEAD 请求，HTTP/1.1 下会建立同样数量的保活连接，
+    HTTP/2 下复用同一个连接。上游返回任何状态码都算建连成功。
+
+    Returns:
+        成功完成的请求数
+    """
+    client = get_http_client()
+
+    async def warm_one() -> bool:
+        try:
+            await client.head(url, timeout=timeout)
+        except httpx.HTTPError as e:
+            logger.warning(f"Upstream prewarm failed: {type(e).__name__}: {e}")
+            return False
+        return True
+
+    results = await asyncio.gather(*(warm_one() for _ in range(max(0, connections))))
+    return sum(results)
+
+
+async def close_http_client() -> None:
+    """在应用关闭时释放共享连接池"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    获取当前 worker 共享的 httpx.AsyncClient
+
+    正常情况下由 lifespan 创建；在 lifespan 之外（脚本、基准测试）调用时按需创建。
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """统计连接池中活跃与空闲的连接数"""
+    settings = get_settings()
+    max_connections, max_keepalive = per_worker_pool_limits()
+    stats = {
+        "initialized": _client is not None and not _client.is_closed,
+        "http2_enabled": settings.HTTP2_ENABLED,
+        "max_connections": max_connections,
+        "max_keepalive_connections": max_keepalive,
+        "connections": 0,
+        "active": 0,
+        "idle": 0,
+        "http2_connections": 0,
+    }
+    if not stats["initialized"]:
+        return stats
+
+    # httpx 没有公开连接池状态，这里读取底层 httpcore 连接池
+    pool = getattr(_client._transport, "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    stats["connections"] = len(connections)
+    for connection in connections:
+        if connection.is_idle():
+            stats["idle"] += 1
+        elif not connection.is_closed():
+            stats["active"] += 1
+        if "HTTP/2" in connection.info():
+            stats["http2_connections"] += 1
+    return stats
@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from api.config import get_settings
+from api.lru_cache import TTLLRUCache
+from api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def make_cache_key(image_data: bytes, access_token: str) -> str:
+    """
+    根据图片内容和令牌生成缓存键
+
+    上传得到的文件 id 归属于具体账号，所以键中同时包含令牌的摘要。
+    """
+    image_digest = hashlib.sha256(image_data).hexdigest()
+    token_digest = hashlib.sha256(access_token.encode("utf-8")).hexdigest()[:16]
+    return f"{image_digest}:{token_digest}"
+
+
+class SqliteImageCacheBackend:
+    """
+    基于本地 SQLite 文件的共享缓存，供同一台机器上的多个 worker 共享命中
+
+    方法均为阻塞调用，由 ImageUploadCache 放到线程池中执行；
+    读取不更新 last_used（避免每次命中都提交一次写事务），淘汰按写入时间进行，
+    热点图片由各 worker 的进程内 LRU 保留。
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=1.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS image_upload_cache ("
+            "key TEXT PRIMARY KEY, file_id TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_id, expires_at FROM image_upload_cache WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                # 过期项在下一次写入时统一清理
+                return None
+            return row[0], row[1]
+
+    def set(self, key: str, file_id: str, expires_at: float, now: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO image_upload_cache VALUES (?, ?, ?, ?)",
+                (key, file_id, expires_at, now),
+            )
+            # 清理过期项，并按最近使用时间淘汰超出容量的部分
+            self._conn.execute(
+                "DELETE FROM image_upload_cache WHERE expires_at <= ?", (now,)
+            )
+            self._conn.execute(
+                "DELETE FROM image_upload_cache WHERE key IN ("
+                "SELECT key FROM image_upload_cache ORDER BY last_used DESC "
+                "LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ImageUploadCache:
+    """
+    图片上传结果缓存（图片内容 + 令牌 -> 上游文件 id）
+
+    进程内使用 LRU + TTL 的有界字典；配置了 SQLite 路径时作为二级缓存，
+    让多个 worker 共享命中。
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        sqlite_path: Optional[str] = None,
+    ):
+        self.ttl = ttl
+        self._memory: TTLLRUCache[str] = TTLLRUCache(max_entries, ttl)
+        self.shared: Optional[SqliteImageCacheBackend] = None
+        if sqlite_path:
+            try:
+                self.shared = SqliteImageCacheBackend(sqlite_path, max_entries)
+            except sqlite3.Error as e:
+                logger.warning(f"Image cache SQLite backend disabled: {e}")
+
+    async def get(self, key: str) -> Optional[str]:
+        file_id = self._memory.get(key, count=False)
+        if file_id is not None:
+            self._memory.hits += 1
+            return file_id
+
+        if self.shared is not None:
+            try:
+                shared_entry = await asyncio.to_thread(self.shared.get, key, time.time())
+            except sqlite3.Error as e:
+                logger.warning(f"Image cache SQLite lookup failed: {e}")
+                shared_entry = None
+            if shared_entry is not None:
+                self._memory.set(key, shared_entry[0], shared_entry[1])
+                self._memory.hits += 1
+                return shared_entry[0]
+
+        self._memory.misses += 1
+        return None
+
+    async def set(self, key: str, file_id: str) -> None:
+        now = time.time()
+        expires_at = now + self.ttl
+        self._memory.set(key, file_id, expires_at)
+        if self.shared is not None:
+            try:
+                await asyncio.to_thread(self.shared.set, key, file_id, expires_at, now)
+            except sqlite3.Error as e:
+                logger.warning(f"Image cache SQLite write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._memory.stats(),
+            "shared_backend": self.shared.path if self.shared is not None else None,
+        }
+
+
+_cache: Optional[ImageUploadCache] = None
+
+
+def get_image_cache() -> Optional[ImageUploadCache]:
+    """获取图片上传缓存，未启用时返回 None"""
+    global _cache
+    settings = get_settings()
+    if not settings.IMAGE_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = ImageUploadCache(
+            max_entries=settings.IMAGE_CACHE_MAX_ENTRIES,
+            ttl=settings.IMAGE_CACHE_TTL,
+            sqlite_path=settings.IMAGE_CACHE_SQLITE_PATH or None,
+        )
+    return _cache
@@ -1,15 +1,80 @@
 import base64
-import io
+import binascii
+import time
 import httpx
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Tuple, Union
 from api.config import get_settings
+from api.headers import build_upload_headers
+from api.image_cache import get_image_cache, make_cache_key
+from api.http_client import get_http_client
 from api.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+ImageData = Union[bytes, memoryview]
+
+_MIME_EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/bmp": "bmp",
+    "image/avif": "avif",
+    "image/heic": "heic",
+}
+
+
+class ImageTooLargeError(Exception):
+    """图片超过 IMAGE_MAX_BYTES 限制"""
+
+
+def detect_image_mime(
+    image_data: ImageData, fallback: Optional[str] = None
+) -> str:
+    """
+    根据文件头识别图片的 MIME 类型
+
+    Args:
+        image_data: 图片内容
+        fallback: 无法识别时使用的类型（例如 data URL 或响应头中声明的类型）
+
+    Returns:
+        MIME 类型，都无法确定时返回 image/png
+    """
+    head = bytes(image_data[:16])
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(b"BM"):
+        return "image/bmp"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in (b"avif", b"avis"):
+            return "image/avif"
+        if brand in (b"heic", b"heix", b"mif1"):
+            return "image/heic"
+    if fallback and fallback.startswith("image/"):
+        return fallback
+    return "image/png"
+
+
+def _as_bytes(image_data: ImageData) -> bytes:
+    """memoryview 指向完整 bytes 对象时直接取回原对象，避免复制"""
+    if isinstance(image_data, memoryview):
+        obj = image_data.obj
+        if isinstance(obj, bytes) and image_data.nbytes == len(obj):
+            return obj
+        return image_data.tobytes()
+    return image_data
+
 
 class ImageUploader:
-    """图片上传工具类，支持 base64 图片上传"""
+    """图片上传工具类，支持 bytes、data URL、base64 与远程 URL 图片上传"""
 
     def __init__(self, access_token: str):
         """
@@ -24,71 +89,75 @@ class ImageUploader:
 
     def _get_headers(self) -> Dict[str, str]:
         """获取请求头"""
-        headers = {
-            "Accept": "application/json",
-            "Accept-Language": "zh-CN,zh;q=0.9",
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Origin": "https://chat.z.ai",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/140.0.0.0 Safari/537.36",
-            "authorization": f"Bearer {self.access_token}",
-        }
-        return headers
+        return build_upload_headers(self.access_token)
 
-    async def upload_base64_image(
-        self, base64_data: str, filename: Optional[str] = None
+    async def upload_image_bytes(
+        self,
+        image_data: ImageData,
+        filename: Optional[str] = None,
+        content_type: Optional[str] = None,
     ) -> Optional[str]:
         """
-        上传 base64 编码的图片
+        上传图片内容
 
         Args:
-            base64_data: base64 编码的图片数据（不包含 data:image/...;base64, 前缀）
+            image_data: 图片内容，bytes 或 memoryview，全程不做额外复制
             filename: 可选的文件名，如果不提供将自动生成
+            content_type: 来源声明的 MIME 类型，仅在无法从文件头识别时使用
 
         Returns:
-            上传成功返回图片 URL，失败返回 None
+            上传成功返回图片 id，失败返回 None
         """
         try:
-            # 如果没有提供文件名，生成一个默认文件名
-            if not filename:
-                import time
+            if len(image_data) > self.settings.IMAGE_MAX_BYTES:
+                logger.error(
+                    f"图片大小 {len(image_data)} 超过上限 {self.settings.IMAGE_MAX_BYTES}"
+                )
+                return None
 
-                filename = f"pasted_image_{int(time.time() * 1000)}.png"
+            mime_type = detect_image_mime(image_data, content_type)
 
-            # 解码 base64 数据
-            try:
-                image_data = base64.b64decode(base64_data)
-            except Exception as e:
-                logger.error(f"Base64 解码失败: {e}")
-                return None
+            # 如果没有提供文件名，生成一个默认文件名
+            if not filename:
+                extension = _MIME_EXTENSIONS.get(mime_type, "png")
+                filename = f"pasted_image_{int(time.time() * 1000)}.{extension}"
 
-            # 创建文件对象
-            file_obj = io.BytesIO(image_data)
+            # 相同图片（同一账号）直接复用之前上传得到的文件 id
+            cache = get_image_cache()
+            cache_key = None
+            if cache is not None:
+                cache_key = make_cache_key(image_data, self.access_token)
+                cached_id = await cache.get(cache_key)
+                if cached_id:
+                    logger.info(f"图片缓存命中: {filename}")
+                    return cached_id
 
             # 准备 multipart/form-data
-            files = {"file": (filename, file_obj, "image/png")}
-
-            # 发送请求
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.upload_url,
-                    headers=self._get_headers(),
-                    files=files,
-                    timeout=30.0,
-                )
-                response.raise_for_status()
+            files = {"file": (filename, _as_bytes(image_data), mime_type)}
 
-                result = response.json()
+            # 发送请求（复用共享连接池）
+            client = get_http_client()
+            response = await client.post(
+                self.upload_url,
+                headers=self._get_headers(),
+                files=files,
+                timeout=self.settings.IMAGE_UPLOAD_TIMEOUT,
+            )
+            response.raise_for_status()
 
-                # 提取 图片id
-                cdn_url = result.get("meta", {}).get("cdn_url")
-                pic_id = result.get("id")
-                if cdn_url:
-                    logger.info(f"图片上传成功: {filename}")
-                    return pic_id
-                else:
-                    logger.error("上传响应中未找到 CDN URL")
-                    return None
+            result = response.json()
+
+            # 提取 图片id
+            cdn_url = result.get("meta", {}).get("cdn_url")
+            pic_id = result.get("id")
+            if cdn_url:
+                logger.info(f"图片上传成功: {filename}")
+                if cache_key is not None and pic_id:
+                    await cache.set(cache_key, pic_id)
+                return pic_id
+            else:
+                logger.error("上传响应中未找到 CDN URL")
+                return None
 
         except httpx.HTTPStatusError as e:
             logger.error(f"HTTP 错误: {e.response.status_code} - {e.response.text}")
@@ -97,6 +166,78 @@ class ImageUploader:
             logger.error(f"图片上传失败: {e}")
             return None
 
+    async def upload_data_url(self, data_url: str) -> Optional[str]:
+        """
+        上传 data URL 形式的图片（data:image/...;base64,...）
+
+        Args:
+            data_url: 完整的 data URL
+
+        Returns:
+            上传成功返回图片 id，失败返回 None
+        """
+        header, _, payload = data_url.partition(",")
+        declared_type = header[5:].split(";")[0] if header.startswith("data:") else None
+        return await self.upload_base64_image(payload, content_type=declared_type)
+
+    async def upload_base64_image(
+        self,
+        base64_data: str,
+        filename: Optional[str] = None,
+        content_type: Optional[str] = None,
+    ) -> Optional[str]:
+        """
+        上传 base64 编码的图片
+
+        Args:
+            base64_data: base64 编码的图片数据（不包含 data:image/...;base64, 前缀）
+            filename: 可选的文件名，如果不提供将自动生成
+            content_type: 来源声明的 MIME 类型
+
+        Returns:
+            上传成功返回图片 id，失败返回 None
+        """
+        # 解码前按 base64 长度估算大小，超限的数据不必解码
+        if len(base64_data) // 4 * 3 > self.settings.IMAGE_MAX_BYTES:
+            logger.error(f"图片大小超过上限 {self.settings.IMAGE_MAX_BYTES}")
+            return None
+
+        # 只解码一次，后续哈希、识别类型与上传都基于同一块内存
+        try:
+            image_data = memoryview(base64.b64decode(base64_data))
+        except (binascii.Error, ValueError) as e:
+            logger.error(f"Base64 解码失败: {e}")
+            return None
+
+        return await self.upload_image_bytes(image_data, filename, content_type)
+
+    async def _download_image(self, image_url: str) -> Tuple[bytes, Optional[str]]:
+        """
+        流式下载图片，超过 IMAGE_MAX_BYTES 立即中止
+
+        Returns:
+            (图片内容, 响应声明的 Content-Type)
+        """
+        max_bytes = self.settings.IMAGE_MAX_BYTES
+        client = get_http_client()
+        async with client.stream(
+            "GET", image_url, timeout=self.settings.IMAGE_UPLOAD_TIMEOUT
+        ) as response:
+            response.raise_for_status()
+            content_length = response.headers.get("Content-Length")
+            if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                raise ImageTooLargeError(f"Content-Length {content_length} > {max_bytes}")
+
+            chunks = []
+            received = 0
+            async for chunk in response.aiter_bytes():
+                received += len(chunk)
+                if received > max_bytes:
+                    raise ImageTooLargeError(f"download exceeded {max_bytes} bytes")
+                chunks.append(chunk)
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+        return b"".join(chunks), content_type or None
+
     async def upload_image_from_url(self, image_url: str) -> Optional[str]:
         """
         从 URL 下载图片并上传
@@ -105,26 +246,21 @@ class ImageUploader:
             image_url: 图片 URL
 
         Returns:
-            上传成功返回新的图片 URL，失败返回 None
+            上传成功返回图片 id，失败返回 None
         """
         try:
-            # 下载图片
-            async with httpx.AsyncClient() as client:
-                response = await client.get(image_url, timeout=30.0)
-                response.raise_for_status()
+            image_data, content_type = await self._download_image(image_url)
 
-                # 获取文件名
-                filename = image_url.split("/")[-1]
-                if not filename or "." not in filename:
-                    import time
-
-                    filename = f"downloaded_image_{int(time.time() * 1000)}.png"
-
-                # 编码为 base64
-                base64_data = base64.b64encode(response.content).decode("utf-8")
+            # 获取文件名
+            filename = image_url.split("?")[0].split("/")[-1]
+            if not filename or "." not in filename:
+                extension = _MIME_EXTENSIONS.get(
+                    detect_image_mime(image_data, content_type), "png"
+                )
+                filename = f"downloaded_image_{int(time.time() * 1000)}.{extension}"
 
-                # 上传图片
-                return await self.upload_base64_image(base64_data, filename)
+            # 上传图片
+            return await self.upload_image_bytes(image_data, filename, content_type)
 
         except Exception as e:
             logger.error(f"从 URL 上传图片失败: {e}")
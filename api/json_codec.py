@@ -0,0 +1,53 @@
+"""
+JSON 编解码
+
+优先使用 orjson，其次 msgspec，都未安装时回退到标准库 json。
+所有实现都输出紧凑、不转义非 ASCII 字符的 str；dumps_bytes 直接输出 UTF-8 字节。
+"""
+from typing import Any
+
+try:
+    import orjson
+
+    BACKEND = "orjson"
+    DecodeError = (orjson.JSONDecodeError,)
+
+    def loads(data: Any) -> Any:
+        return orjson.loads(data)
+
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+
+    def dumps_bytes(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+except ImportError:
+    try:
+        import msgspec
+
+        BACKEND = "msgspec"
+        DecodeError = (msgspec.DecodeError,)
+        _decoder = msgspec.json.Decoder()
+        _encoder = msgspec.json.Encoder()
+
+        def loads(data: Any) -> Any:
+            return _decoder.decode(data)
+
+        def dumps(obj: Any) -> str:
+            return _encoder.encode(obj).decode("utf-8")
+
+        def dumps_bytes(obj: Any) -> bytes:
+            return _encoder.encode(obj)
+
+    except ImportError:
+        import json
+
+        BACKEND = "json"
+        DecodeError = (json.JSONDecodeError,)
+        _std_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+        loads = json.loads
+        dumps = _std_encoder.encode
+
+        def dumps_bytes(obj: Any) -> bytes:
+            return _std_encoder.encode(obj).encode("utf-8")
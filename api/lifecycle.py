@@ -0,0 +1,105 @@
+import asyncio
+import os
+import signal
+import threading
+import time
+from typing import Optional
+from api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class InflightTracker:
+    """记录当前 worker 正在处理的上游请求数，供优雅退出时等待"""
+
+    def __init__(self):
+        self.count = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def enter(self) -> None:
+        self.count += 1
+        self._idle.clear()
+
+    def exit(self) -> None:
+        self.count = max(0, self.count - 1)
+        if self.count == 0:
+            self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """
+        等待所有在途请求结束
+
+        Returns:
+            在超时前全部结束返回 True
+        """
+        if self.count == 0:
+            return True
+        logger.info(f"Draining {self.count} in-flight upstream requests (up to {timeout}s)")
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Drain deadline reached with {self.count} requests still in flight")
+            return False
+        logger.info(f"Drained in {time.monotonic() - start:.1f}s")
+        return True
+
+
+inflight = InflightTracker()
+
+# 收到退出信号的时间（time.monotonic()），未收到时为 None
+_shutdown_started: Optional[float] = None
+
+
+def watch_shutdown_signals() -> None:
+    """
+    在 uvicorn 的退出信号处理函数之前记录收到信号的时间
+
+    uvicorn 用 signal.signal 安装处理函数，这里串联在其之前，不改变原有行为；
+    只能在主线程中设置信号处理函数，其它情况跳过。
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        previous = signal.getsignal(sig)
+        if not callable(previous):
+            continue
+
+        def handler(signum, frame, previous=previous):
+            global _shutdown_started
+            if _shutdown_started is None:
+                _shutdown_started = time.monotonic()
+            previous(signum, frame)
+
+        signal.signal(sig, handler)
+
+
+def remaining_grace(grace: float) -> float:
+    """
+    退出宽限期还剩多少秒
+
+    uvicorn 先用 timeout_graceful_shutdown 等待连接结束，lifespan 关闭阶段只能使用剩下的时间，
+    否则实际的退出期限会变成配置值的两倍。
+    """
+    if _shutdown_started is None:
+        return grace
+    return max(0.0, grace - (time.monotonic() - _shutdown_started))
+
+
+def process_uptime() -> Optional[float]:
+    """
+    当前进程从创建到现在的秒数（包括解释器启动与模块导入），用于衡量冷启动耗时
+
+    只在 Linux 上可用（读取 /proc），其它平台返回 None。
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # 进程名可能包含空格，从最后一个 ")" 之后开始按字段切分
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            system_uptime = float(f.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    start_ticks = int(fields[19])
+    return system_uptime - start_ticks / os.sysconf("SC_CLK_TCK")
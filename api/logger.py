@@ -1,20 +1,227 @@
+"""
+日志
+
+各模块的日志记录只在调用线程中放入有界队列，由后台 QueueListener 线程负责格式化与写出，
+事件循环不会阻塞在 stderr 上。
+
+- LOG_FORMAT=json 时每条日志输出一行 JSON，包含 request_id 以及通过 extra 传入的字段
+  （model、latency_ms、chunks 等）；LOG_FORMAT=text 保持原来的文本格式
+- 写出前统一脱敏 Bearer 令牌与 JWT
+- 热路径上的 DEBUG 日志以 extra={"sampled": True} 标记，按 LOG_DEBUG_SAMPLE_RATE 采样；
+  其余 DEBUG 日志全部输出，运行时可通过 set_log_level() 切换级别
+"""
+import atexit
 import logging
+import logging.handlers
+import queue
+import random
+import re
+import time
+from contextvars import ContextVar
+from typing import Optional
+from api.config import get_settings
+from api.ids import uuid4_str
+from api import json_codec
+
+# 当前请求的 id，由 RequestIdMiddleware 设置，日志记录时读取
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+_ROOT = "api"
+_TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_REDACTIONS = (
+    (re.compile(r"(?i)(bearer\s+)[\w.~+/=-]+"), r"\1***"),
+    (re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]+"), "***"),
+)
+
+# LogRecord 自带的属性，其余属性视为 extra 字段写入 JSON
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+    "request_id",
+    # uvicorn 附带的终端着色版本
+    "color_message",
+    # 采样标记，只供过滤器使用
+    "sampled",
+}
+
+_handler: Optional["_DroppingQueueHandler"] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+_base_level = logging.INFO
+
+
+def redact(text: str) -> str:
+    """替换文本中的 Bearer 令牌与 JWT"""
+    for pattern, replacement in _REDACTIONS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": redact(record.getMessage()),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        try:
+            return json_codec.dumps(entry)
+        except TypeError:
+            return json_codec.dumps({k: str(v) for k, v in entry.items()})
+
+
+class RedactingFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return redact(super().format(record))
+
+
+class _ContextFilter(logging.Filter):
+    """在调用线程中记下 request_id，并对标记为 sampled 的 DEBUG 日志采样"""
+
+    def __init__(self, debug_sample_rate: float):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if (
+            record.levelno <= logging.DEBUG
+            and getattr(record, "sampled", False)
+            and random.random() >= self.debug_sample_rate
+        ):
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列写满时丢弃日志并计数，不阻塞调用方"""
+
+    dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _configure() -> "_DroppingQueueHandler":
+    global _handler, _listener, _base_level
+    settings = get_settings()
+    _base_level = logging.getLevelName(settings.LOG_LEVEL.upper())
+    if not isinstance(_base_level, int):
+        _base_level = logging.INFO
+
+    output = logging.StreamHandler()
+    if settings.LOG_FORMAT.lower() == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(RedactingFormatter(_TEXT_FORMAT))
+
+    _handler = _DroppingQueueHandler(queue.Queue(maxsize=max(1, settings.LOG_QUEUE_SIZE)))
+    _handler.addFilter(_ContextFilter(settings.LOG_DEBUG_SAMPLE_RATE))
+    _listener = logging.handlers.QueueListener(_handler.queue, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger(_ROOT)
+    root.setLevel(_base_level)
+    root.addHandler(_handler)
+    root.propagate = False
+    # uvicorn 自己的日志也走同一条管道
+    for name in ("uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = [_handler]
+        uvicorn_logger.propagate = False
+    return _handler
+
 
 def setup_logger(name):
+    handler = _handler or _configure()
     logger = logging.getLogger(name)
-    if not logger.handlers:
-        logger.setLevel(logging.INFO)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        
-        # 控制台处理器
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
-        
-        # 文件处理器 - 错误级别
-        # error_file_handler = logging.FileHandler('error.log')
-        # error_file_handler.setFormatter(formatter)
-        # error_file_handler.setLevel(logging.ERROR)
-        # logger.addHandler(error_file_handler)
-    
-    return logger
\ No newline at end of file
+    if name != _ROOT and not name.startswith(_ROOT + ".") and not logger.handlers:
+        # 不在 api 层级下的模块（如 __main__）单独挂载队列处理器
+        logger.setLevel(_base_level)
+        logger.addHandler(handler)
+        logger.propagate = False
+    return logger
+
+
+def get_log_level() -> str:
+    return logging.getLevelName(logging.getLogger(_ROOT).getEffectiveLevel())
+
+
+def set_log_level(level: str) -> str:
+    """
+    运行时切换当前 worker 的日志级别，无需重启
+
+    Raises:
+        ValueError: 未知的日志级别
+    """
+    value = logging.getLevelName(level.upper())
+    if not isinstance(value, int):
+        raise ValueError(f"Unknown log level: {level}")
+    logging.getLogger(_ROOT).setLevel(value)
+    # 不在 api 层级下、单独挂载了队列处理器的模块
+    for logger in list(logging.Logger.manager.loggerDict.values()):
+        if (
+            isinstance(logger, logging.Logger)
+            and _handler in logger.handlers
+            and not logger.name.startswith("uvicorn.")
+        ):
+            logger.setLevel(value)
+    return get_log_level()
+
+
+def toggle_debug() -> str:
+    """在 DEBUG 与 LOG_LEVEL 之间切换（SIGUSR1）"""
+    if logging.getLogger(_ROOT).getEffectiveLevel() == logging.DEBUG:
+        return set_log_level(logging.getLevelName(_base_level))
+    return set_log_level("DEBUG")
+
+
+def dropped_records() -> int:
+    return _handler.dropped if _handler is not None else 0
+
+
+class RequestIdMiddleware:
+    """
+    为每个 HTTP 请求分配 request_id（沿用客户端的 X-Request-ID），
+    写入日志上下文并在响应头中返回
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for key, value in scope.get("headers", ()):
+            if key == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        if not request_id:
+            request_id = uuid4_str()
+        header = (b"x-request-id", request_id.encode("latin-1"))
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), header]
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
@@ -0,0 +1,184 @@
+"""
+Prometheus 指标
+
+所有指标都以模型注册表中的公开模型 id 作为 model 标签。
+流式热路径上使用 StreamMetrics 预先绑定好标签，每个 chunk 只做一次 observe/inc。
+多 worker 部署时设置 PROMETHEUS_MULTIPROC_DIR，/metrics 会汇总所有 worker 的数据。
+"""
+import os
+import time
+from typing import Dict, Optional
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# 不经过 main.py 启动（如 uvicorn main:app）时目录可能还不存在，须在定义指标前创建
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_GAP_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+PREPARE_DATA_SECONDS = Histogram(
+    "zai_prepare_data_seconds",
+    "Time spent building the upstream request in prepare_data",
+    ["model"],
+    buckets=_LATENCY_BUCKETS,
+)
+IMAGE_UPLOAD_SECONDS = Histogram(
+    "zai_image_upload_seconds",
+    "Time spent uploading all images of a request",
+    ["model"],
+    buckets=_LATENCY_BUCKETS,
+)
+UPSTREAM_CONNECT_SECONDS = Histogram(
+    "zai_upstream_connect_seconds",
+    "Time from sending the upstream request to receiving response headers",
+    ["model"],
+    buckets=_LATENCY_BUCKETS,
+)
+UPSTREAM_FIRST_EVENT_SECONDS = Histogram(
+    "zai_upstream_first_event_seconds",
+    "Time from sending an upstream attempt to receiving its first event",
+    ["model"],
+    buckets=_LATENCY_BUCKETS,
+)
+UPSTREAM_RETRIES_TOTAL = Counter(
+    "zai_upstream_retries_total",
+    "Upstream attempts retried before the first event, by failure reason",
+    ["model", "reason"],
+)
+HEDGED_REQUESTS_TOTAL = Counter(
+    "zai_hedged_requests_total",
+    "Hedged upstream requests, by which attempt delivered the first event",
+    ["model", "winner"],
+)
+TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    "zai_time_to_first_token_seconds",
+    "Time from request start to the first chunk sent to the client",
+    ["model"],
+    buckets=_LATENCY_BUCKETS,
+)
+INTER_CHUNK_GAP_SECONDS = Histogram(
+    "zai_inter_chunk_gap_seconds",
+    "Time between consecutive chunks sent to the client",
+    ["model"],
+    buckets=_GAP_BUCKETS,
+)
+STREAM_CHUNKS_TOTAL = Counter(
+    "zai_stream_chunks_total",
+    "Upstream chunks translated, by phase",
+    ["model", "phase"],
+)
+UPSTREAM_RESPONSES_TOTAL = Counter(
+    "zai_upstream_responses_total",
+    "Upstream chat responses by status code ('error' for transport failures)",
+    ["model", "status"],
+)
+CANCELLED_STREAMS_TOTAL = Counter(
+    "zai_cancelled_streams_total",
+    "Requests whose upstream call was cancelled because the client disconnected",
+    ["model"],
+)
+ACTIVE_STREAMS = Gauge(
+    "zai_active_streams",
+    "Streaming responses currently in progress",
+    ["model"],
+    multiprocess_mode="livesum",
+)
+
+ADMISSION_ACTIVE = Gauge(
+    "zai_admission_active_requests",
+    "Chat requests currently holding an admission slot",
+    multiprocess_mode="livesum",
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "zai_admission_queue_depth",
+    "Chat requests waiting for an admission slot, by priority",
+    ["priority"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "zai_admission_wait_seconds",
+    "Time chat requests spent waiting for an admission slot, by priority",
+    ["priority"],
+    buckets=_LATENCY_BUCKETS,
+)
+ADMISSION_REJECTED_TOTAL = Counter(
+    "zai_admission_rejected_total",
+    "Chat requests rejected with 429 by admission control, by reason",
+    ["reason"],
+)
+
+BATCH_ITEMS_TOTAL = Counter(
+    "zai_batch_items_total",
+    "Requests executed through /v1/batches, by outcome",
+    ["outcome"],
+)
+
+
+class StreamMetrics:
+    """单个流的指标记录器，标签在创建时绑定一次"""
+
+    def __init__(self, model: str, start: Optional[float] = None):
+        self.model = model
+        self.start = start if start is not None else time.perf_counter()
+        self._ttft = TIME_TO_FIRST_TOKEN_SECONDS.labels(model)
+        self._gap = INTER_CHUNK_GAP_SECONDS.labels(model)
+        self._phase_counters: Dict[str, Counter] = {}
+        self._last_chunk: Optional[float] = None
+        self.chunks = 0
+        self.ttft: Optional[float] = None
+
+    def upstream_connected(self, connect_start: float, status_code: int) -> None:
+        UPSTREAM_CONNECT_SECONDS.labels(self.model).observe(
+            time.perf_counter() - connect_start
+        )
+        UPSTREAM_RESPONSES_TOTAL.labels(self.model, str(status_code)).inc()
+
+    def upstream_failed(self) -> None:
+        UPSTREAM_RESPONSES_TOTAL.labels(self.model, "error").inc()
+
+    def summary(self, outcome: str) -> Dict[str, object]:
+        """结构化日志使用的请求摘要"""
+        return {
+            "model": self.model,
+            "outcome": outcome,
+            "latency_ms": round((time.perf_counter() - self.start) * 1000, 1),
+            "ttft_ms": round(self.ttft * 1000, 1) if self.ttft is not None else None,
+            "chunks": self.chunks,
+        }
+
+    def chunk(self, phase: str) -> None:
+        now = time.perf_counter()
+        if self._last_chunk is None:
+            self.ttft = now - self.start
+            self._ttft.observe(self.ttft)
+        else:
+            self._gap.observe(now - self._last_chunk)
+        self._last_chunk = now
+        self.chunks += 1
+
+        counter = self._phase_counters.get(phase)
+        if counter is None:
+            counter = STREAM_CHUNKS_TOTAL.labels(self.model, phase)
+            self._phase_counters[phase] = counter
+        counter.inc()
+
+
+def render_metrics() -> bytes:
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
@@ -0,0 +1,136 @@
+"""
+模型注册表
+
+启动时把 Settings.MODELS（以及 MODELS_FILE）编译为每个 (公开模型, 是否流式) 一份的
+只读请求模板，请求路径上只做一次字典查找，不再逐个 if 判断模型、拼装 features。
+"""
+import json
+import os
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, List, Mapping, Optional, Tuple
+from api.config import get_settings
+from api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# 流式请求的默认 features，模型声明中的 features 在此基础上覆盖
+_STREAM_FEATURES: Mapping[str, Any] = MappingProxyType(
+    {
+        "image_generation": False,
+        "web_search": False,
+        "auto_web_search": False,
+        "preview_mode": False,
+        "flags": (),
+        "enable_thinking": True,
+    }
+)
+# 非流式请求不开启思考、搜索与 MCP，可用 non_stream_features 覆盖
+_NON_STREAM_FEATURES: Mapping[str, Any] = MappingProxyType(
+    {**_STREAM_FEATURES, "enable_thinking": False}
+)
+
+
+@dataclass(frozen=True)
+class RequestTemplate:
+    """某个公开模型在某种模式下的上游请求模板"""
+
+    model: str
+    upstream_model: str
+    features: Mapping[str, Any]
+    mcp_servers: Tuple[str, ...]
+
+    def payload(self) -> Dict[str, Any]:
+        """生成本次请求可自由修改的上游请求体骨架"""
+        payload = {
+            "stream": True,
+            "model": self.upstream_model,
+            "features": dict(self.features),
+        }
+        if self.mcp_servers:
+            payload["mcp_servers"] = list(self.mcp_servers)
+        return payload
+
+
+def _freeze_features(base: Mapping[str, Any], overrides: Optional[Dict[str, Any]]) -> Mapping[str, Any]:
+    features = dict(base)
+    for key, value in (overrides or {}).items():
+        features[key] = tuple(value) if isinstance(value, list) else value
+    return MappingProxyType(features)
+
+
+class ModelRegistry:
+    """公开模型 id 到请求模板的只读映射"""
+
+    def __init__(self, specs: List[Dict[str, Any]]):
+        settings = get_settings()
+        templates: Dict[Tuple[str, bool], RequestTemplate] = {}
+        budgets: Dict[str, int] = {}
+        public: List[Dict[str, str]] = []
+        for spec in specs:
+            model_id = spec["id"]
+            upstream_model = spec.get("upstream") or model_id
+            templates[(model_id, True)] = RequestTemplate(
+                model_id,
+                upstream_model,
+                _freeze_features(_STREAM_FEATURES, spec.get("features")),
+                tuple(spec.get("mcp_servers") or ()),
+            )
+            templates[(model_id, False)] = RequestTemplate(
+                model_id,
+                upstream_model,
+                _freeze_features(_NON_STREAM_FEATURES, spec.get("non_stream_features")),
+                (),
+            )
+            context_tokens = spec.get("context_tokens") or settings.COMPACTION_DEFAULT_CONTEXT_TOKENS
+            budgets[model_id] = max(1, context_tokens - settings.COMPACTION_RESERVE_TOKENS)
+            public.append({"id": model_id, "name": spec.get("name") or model_id})
+        self._templates: Mapping[Tuple[str, bool], RequestTemplate] = MappingProxyType(templates)
+        self._budgets: Mapping[str, int] = MappingProxyType(budgets)
+        self.ids: FrozenSet[str] = frozenset(model["id"] for model in public)
+        self.public_models: Tuple[Dict[str, str], ...] = tuple(public)
+
+    def __contains__(self, model: str) -> bool:
+        return model in self.ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def template(self, model: str, streaming: bool) -> RequestTemplate:
+        """
+        Raises:
+            KeyError: 模型未注册
+        """
+        return self._templates[(model, streaming)]
+
+    def context_budget(self, model: str) -> int:
+        """历史消息可用的 token 预算（上下文长度减去为输出预留的部分）"""
+        return self._budgets[model]
+
+
+def load_model_specs() -> List[Dict[str, Any]]:
+    """合并 Settings.MODELS 与 MODELS_FILE 中的模型声明，保持声明顺序"""
+    settings = get_settings()
+    specs: Dict[str, Dict[str, Any]] = {spec["id"]: spec for spec in settings.MODELS}
+    if settings.MODELS_FILE:
+        if os.path.exists(settings.MODELS_FILE):
+            with open(settings.MODELS_FILE, encoding="utf-8") as f:
+                for spec in json.load(f):
+                    if spec["id"] in specs:
+                        logger.info(f"MODELS_FILE overrides model {spec['id']}")
+                    specs[spec["id"]] = spec
+        else:
+            logger.warning(f"MODELS_FILE not found: {settings.MODELS_FILE}")
+    return list(specs.values())
+
+
+_registry: Optional[ModelRegistry] = None
+
+
+def get_model_registry() -> ModelRegistry:
+    """获取进程内共享的模型注册表，首次调用时编译"""
+    global _registry
+    if _registry is None:
+        _registry = ModelRegistry(load_model_specs())
+        logger.info(f"Model registry compiled with {len(_registry)} models")
+    return _registry
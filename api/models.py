@@ -1,10 +1,14 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel
 
 
 class Message(BaseModel):
     role: str
-    content: str | list
+    # 只携带 tool_calls 的 assistant 消息可以没有 content
+    content: str | list | None = None
+    tool_calls: Optional[List[Dict[str, Any]]] = None
+    tool_call_id: Optional[str] = None
+    name: Optional[str] = None
 
 
 class ChatRequest(BaseModel):
@@ -14,3 +18,35 @@ class ChatRequest(BaseModel):
     temperature: Optional[float] = 0.7
     top_p: Optional[float] = 0.9
     max_tokens: Optional[int] = 8192
+    tools: Optional[List[Dict[str, Any]]] = None
+    tool_choice: Optional[str | Dict[str, Any]] = None
+
+
+class AnthropicRequest(BaseModel):
+    """Anthropic Messages API 请求（/v1/messages）"""
+
+    model: str
+    messages: List[Dict[str, Any]]
+    system: Optional[str | List[Dict[str, Any]]] = None
+    max_tokens: Optional[int] = 8192
+    stream: Optional[bool] = False
+    temperature: Optional[float] = 0.7
+    top_p: Optional[float] = 0.9
+    tools: Optional[List[Dict[str, Any]]] = None
+    tool_choice: Optional[Dict[str, Any]] = None
+    thinking: Optional[Dict[str, Any]] = None
+
+
+class ResponsesRequest(BaseModel):
+    """OpenAI Responses API 请求（/v1/responses）"""
+
+    model: str
+    input: str | List[Dict[str, Any]]
+    instructions: Optional[str] = None
+    stream: Optional[bool] = False
+    temperature: Optional[float] = 0.7
+    top_p: Optional[float] = 0.9
+    max_output_tokens: Optional[int] = 8192
+    tools: Optional[List[Dict[str, Any]]] = None
+    tool_choice: Optional[str | Dict[str, Any]] = None
+    reasoning: Optional[Dict[str, Any]] = None
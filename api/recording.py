@@ -0,0 +1,151 @@
+"""
+上游流录制与回放
+
+录制（RECORD_ENABLED）：按 RECORD_SAMPLE_RATE 抽样，把上游返回的原始 SSE 行连同到达时间
+（相对请求发出的秒数）写入 RECORD_DIR 下的 gzip 压缩 NDJSON 文件。写入前脱敏 Bearer 令牌与 JWT；
+流进行中只在内存中追加，结束后在线程池中压缩写盘，不阻塞事件循环。
+
+文件格式：第一行为头部 {"version", "model", "recorded_at"}，之后每行 {"t": 秒, "line": 原始行}。
+
+回放（REPLAY_FILE）：上游请求不再发往 chat.z.ai，而是读取录制文件（或目录下的所有录制文件，
+轮流使用）产出事件。REPLAY_SPEED=1 按原始时间间隔回放，2 为两倍速，0 为不等待、尽快回放。
+"""
+import asyncio
+import glob
+import gzip
+import itertools
+import os
+import random
+import re
+import time
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from api import json_codec
+from api.config import get_settings
+from api.ids import uuid4_str
+from api.logger import redact, request_id_var, setup_logger
+from api.stream_translator import UpstreamEvent, parse_upstream_line
+
+logger = setup_logger(__name__)
+
+RECORDING_VERSION = 1
+RECORDING_SUFFIX = ".ndjson.gz"
+
+# 录制行：(相对请求发出的秒数, 原始行)
+RecordedLine = Tuple[float, str]
+
+# 文件名中的模型 id 与请求 id（可由客户端通过 X-Request-ID 指定）只保留安全字符
+_UNSAFE_NAME_CHARS = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def _safe_name_part(value: str) -> str:
+    return _UNSAFE_NAME_CHARS.sub("_", value)[:64]
+
+
+class StreamRecorder:
+    """一次上游流的录制缓冲，结束时调用 save() 写盘"""
+
+    def __init__(self, model: str, started: float):
+        self.model = model
+        self.started = started
+        self.recorded_at = time.time()
+        self.lines: List[RecordedLine] = []
+
+    def add(self, line: str, arrived: Optional[float] = None) -> None:
+        if line:
+            self.lines.append(((arrived or time.perf_counter()) - self.started, line))
+
+    async def save(self) -> None:
+        if not self.lines:
+            return
+        settings = get_settings()
+        request_id = _safe_name_part(request_id_var.get() or "") or uuid4_str()
+        name = (
+            time.strftime("%Y%m%dT%H%M%S", time.gmtime(self.recorded_at))
+            + f"-{_safe_name_part(self.model)}-{request_id}{RECORDING_SUFFIX}"
+        )
+        path = os.path.join(settings.RECORD_DIR, name)
+        try:
+            await asyncio.to_thread(self._write, settings.RECORD_DIR, name, settings.RECORD_MAX_FILES)
+        except OSError as e:
+            logger.warning(f"Failed to write upstream recording {path}: {e}")
+            return
+        logger.debug("Upstream stream recorded", extra={"path": path, "lines": len(self.lines)})
+
+    def _write(self, record_dir: str, name: str, max_files: int) -> None:
+        os.makedirs(record_dir, exist_ok=True)
+        directory = os.path.realpath(record_dir)
+        path = os.path.realpath(os.path.join(directory, name))
+        if os.path.dirname(path) != directory:
+            raise OSError(f"Recording path escapes RECORD_DIR: {name!r}")
+        header = {"version": RECORDING_VERSION, "model": self.model, "recorded_at": self.recorded_at}
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write(json_codec.dumps(header) + "\n")
+            for offset, line in self.lines:
+                f.write(json_codec.dumps({"t": round(offset, 4), "line": redact(line)}) + "\n")
+        if max_files > 0:
+            # 文件名以录制时间开头，按名称排序即按时间排序
+            recordings = sorted(glob.glob(os.path.join(directory, "*" + RECORDING_SUFFIX)))
+            for stale in recordings[: max(0, len(recordings) - max_files)]:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+
+def maybe_recorder(model: str, started: float) -> Optional[StreamRecorder]:
+    """按采样率决定是否录制本次上游流"""
+    settings = get_settings()
+    if not settings.RECORD_ENABLED or random.random() >= settings.RECORD_SAMPLE_RATE:
+        return None
+    return StreamRecorder(model, started)
+
+
+def load_recording(path: str) -> List[RecordedLine]:
+    """读取录制文件，返回 [(相对时间, 原始行)]"""
+    lines: List[RecordedLine] = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json_codec.loads(f.readline())
+        if header.get("version") != RECORDING_VERSION:
+            raise ValueError(f"Unsupported recording version in {path}: {header.get('version')}")
+        for raw in f:
+            if raw.strip():
+                entry = json_codec.loads(raw)
+                lines.append((entry["t"], entry["line"]))
+    return lines
+
+
+# 回放时已加载的录制文件，回放模式只用于本地分析，录制文件数量有限
+_loaded: Dict[str, List[RecordedLine]] = {}
+_replay_paths: Optional[Iterator[str]] = None
+
+
+def _next_replay_path() -> str:
+    global _replay_paths
+    if _replay_paths is None:
+        source = get_settings().REPLAY_FILE
+        if os.path.isdir(source):
+            paths = sorted(glob.glob(os.path.join(source, "*" + RECORDING_SUFFIX)))
+            if not paths:
+                raise FileNotFoundError(f"No recordings found in {source}")
+        else:
+            paths = [source]
+        _replay_paths = itertools.cycle(paths)
+    return next(_replay_paths)
+
+
+async def replay_events() -> AsyncIterator[UpstreamEvent]:
+    """按 REPLAY_SPEED 回放一份录制，产出与真实上游相同的事件"""
+    path = _next_replay_path()
+    lines = _loaded.get(path)
+    if lines is None:
+        lines = _loaded[path] = await asyncio.to_thread(load_recording, path)
+    speed = get_settings().REPLAY_SPEED
+    start = time.perf_counter()
+    for offset, line in lines:
+        if speed > 0:
+            delay = start + offset / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        event = parse_upstream_line(line)
+        if event is not None:
+            yield event
@@ -0,0 +1,105 @@
+import hashlib
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Optional
+from api import json_codec
+from api.config import get_settings
+from api.lru_cache import TTLLRUCache
+from api.model_registry import get_model_registry
+from api.models import ChatRequest
+from api.stream_translator import DONE_CHUNK, OpenAIChunkEncoder
+
+CACHE_HEADER = "X-Cache"
+
+
+def make_request_key(request: ChatRequest, access_token: Optional[str] = None) -> str:
+    """
+    根据规范化后的请求生成缓存键
+
+    只有 model、messages、temperature、工具声明以及本次请求使用的上游模板会影响结果；
+    序列化时对键排序，保证字段顺序不同但内容相同的请求得到同一个键。
+    流式与非流式模板的 features 不同（如非流式关闭思考与搜索）时得到不同的键。
+
+    Args:
+        access_token: 直传模式下传入客户端的上游令牌，结果只在同一账号内共享
+    """
+    template = get_model_registry().template(request.model, bool(request.stream))
+    normalized = {
+        "model": request.model,
+        "messages": [message.model_dump(exclude_none=True) for message in request.messages],
+        "temperature": request.temperature,
+        "template": {
+            "upstream_model": template.upstream_model,
+            "features": dict(template.features),
+            "mcp_servers": list(template.mcp_servers),
+        },
+    }
+    if request.tools:
+        normalized["tools"] = request.tools
+        normalized["tool_choice"] = request.tool_choice
+    if access_token:
+        normalized["token"] = hashlib.sha256(access_token.encode("utf-8")).hexdigest()[:16]
+    payload = json_codec.dumps(_sort_keys(normalized))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _sort_keys(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _sort_keys(value[key]) for key in sorted(value)}
+    if isinstance(value, list):
+        return [_sort_keys(item) for item in value]
+    return value
+
+
+def is_cacheable(response: Dict[str, Any]) -> bool:
+    """只缓存拿到了实际内容的响应，上游失败得到的空响应不缓存"""
+    choices = response.get("choices") or []
+    return bool(choices and choices[0].get("message", {}).get("content"))
+
+
+def fresh_copy(response: Dict[str, Any]) -> Dict[str, Any]:
+    """返回带新 id 与时间戳的缓存响应"""
+    return {
+        **response,
+        "id": f"chatcmpl-{uuid.uuid4()}",
+        "created": int(time.time()),
+    }
+
+
+async def replay_as_stream(response: Dict[str, Any]) -> AsyncIterator[str]:
+    """把缓存的非流式响应合成为 OpenAI 流式 SSE"""
+    encoder = OpenAIChunkEncoder(response["model"], int(time.time()))
+    message = response["choices"][0]["message"]
+    if message.get("reasoning_content"):
+        yield encoder.reasoning(message["reasoning_content"])
+    yield encoder.content(message.get("content") or "")
+    if message.get("tool_calls"):
+        yield encoder.chunk(
+            {
+                "tool_calls": [{"index": i, **call} for i, call in enumerate(message["tool_calls"])],
+                "role": "assistant",
+            }
+        )
+    yield encoder.chunk(
+        {"content": "", "role": "assistant"},
+        finish_reason=response["choices"][0].get("finish_reason", "stop"),
+        usage=response.get("usage"),
+    )
+    yield DONE_CHUNK
+
+
+_cache: Optional[TTLLRUCache[Dict[str, Any]]] = None
+
+
+def get_response_cache() -> Optional[TTLLRUCache[Dict[str, Any]]]:
+    """获取响应缓存，未启用（默认）时返回 None"""
+    global _cache
+    settings = get_settings()
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = TTLLRUCache(
+            max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+            ttl=settings.RESPONSE_CACHE_TTL,
+        )
+    return _cache
@@ -0,0 +1,414 @@
+"""
+OpenAI Responses API（/v1/responses）
+
+请求转换为内部的 ChatRequest 后走与 /v1/chat/completions 相同的上游路径；
+响应直接由解析后的上游事件生成 Responses 流式事件
+（response.created → output_item / content_part / *.delta → response.completed），
+思考内容在请求带 reasoning 时以 reasoning 输出项的 summary 输出。
+"""
+import io
+import time
+import uuid
+from typing import Any, Dict, FrozenSet, List, Optional
+from api import json_codec
+from api.models import ChatRequest, Message, ResponsesRequest
+from api.stream_translator import (
+    CompletionAggregator,
+    ToolCallAssembler,
+    UpstreamEvent,
+    normalize_usage,
+)
+
+
+def _item_id(prefix: str) -> str:
+    return f"{prefix}_{uuid.uuid4().hex}"
+
+
+def error_body(message: str, status_code: Optional[int] = None) -> Dict[str, Any]:
+    return {"error": {"message": message, "type": "upstream_error", "code": status_code}}
+
+
+def _content_parts(content: Any) -> Any:
+    """Responses 的 input_text / output_text / input_image 转换为 chat 的内容片段"""
+    if isinstance(content, str):
+        return content
+    parts: List[Dict[str, Any]] = []
+    for part in content or ():
+        part_type = part.get("type")
+        if part_type in ("input_text", "output_text", "text"):
+            parts.append({"type": "text", "text": part.get("text", "")})
+        elif part_type == "input_image" and part.get("image_url"):
+            parts.append({"type": "image_url", "image_url": {"url": part["image_url"]}})
+    if len(parts) == 1 and parts[0]["type"] == "text":
+        return parts[0]["text"]
+    return parts
+
+
+def to_chat_request(request: ResponsesRequest) -> ChatRequest:
+    """把 Responses 请求转换为内部的 ChatRequest"""
+    messages: List[Message] = []
+    if request.instructions:
+        messages.append(Message(role="system", content=request.instructions))
+
+    items = [{"role": "user", "content": request.input}] if isinstance(request.input, str) else request.input
+    for item in items:
+        item_type = item.get("type", "message")
+        if item_type == "message":
+            role = item.get("role", "user")
+            messages.append(
+                Message(role="system" if role == "developer" else role, content=_content_parts(item.get("content")))
+            )
+        elif item_type == "function_call":
+            call = {
+                "id": item.get("call_id"),
+                "type": "function",
+                "function": {"name": item.get("name"), "arguments": item.get("arguments", "")},
+            }
+            # 连续的函数调用合并到同一条 assistant 消息
+            last = messages[-1] if messages else None
+            if last is not None and last.role == "assistant" and last.tool_calls and not last.content:
+                last.tool_calls.append(call)
+            else:
+                messages.append(Message(role="assistant", content=None, tool_calls=[call]))
+        elif item_type == "function_call_output":
+            output = item.get("output", "")
+            messages.append(
+                Message(
+                    role="tool",
+                    tool_call_id=item.get("call_id"),
+                    content=output if isinstance(output, str) else json_codec.dumps(output),
+                )
+            )
+
+    tools = None
+    if request.tools:
+        # 只转换函数工具，内置工具（web_search 等）没有对应实现
+        tools = [
+            {
+                "type": "function",
+                "function": {
+                    "name": tool["name"],
+                    "description": tool.get("description", ""),
+                    "parameters": tool.get("parameters") or {"type": "object"},
+                },
+            }
+            for tool in request.tools
+            if tool.get("type") == "function" and tool.get("name")
+        ]
+
+    tool_choice = request.tool_choice
+    if isinstance(tool_choice, dict) and tool_choice.get("type") == "function":
+        tool_choice = {"type": "function", "function": {"name": tool_choice.get("name")}}
+
+    return ChatRequest(
+        model=request.model,
+        messages=messages,
+        stream=request.stream,
+        temperature=request.temperature,
+        top_p=request.top_p,
+        max_tokens=request.max_output_tokens,
+        tools=tools or None,
+        tool_choice=tool_choice,
+    )
+
+
+def reasoning_requested(request: ResponsesRequest) -> bool:
+    """只有请求带 reasoning 参数时才输出 reasoning 项"""
+    return request.reasoning is not None
+
+
+def _usage(usage: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    usage = normalize_usage(usage)
+    return {
+        "input_tokens": usage["prompt_tokens"],
+        "output_tokens": usage["completion_tokens"],
+        "total_tokens": usage["total_tokens"],
+    }
+
+
+def _reasoning_item(item_id: str, text: str) -> Dict[str, Any]:
+    return {"id": item_id, "type": "reasoning", "summary": [{"type": "summary_text", "text": text}]}
+
+
+def _message_item(item_id: str, text: str, status: str = "completed") -> Dict[str, Any]:
+    return {
+        "id": item_id,
+        "type": "message",
+        "status": status,
+        "role": "assistant",
+        "content": [{"type": "output_text", "text": text, "annotations": []}] if status == "completed" else [],
+    }
+
+
+def _function_call_item(item_id: str, call: Dict[str, Any], status: str = "completed") -> Dict[str, Any]:
+    return {
+        "id": item_id,
+        "type": "function_call",
+        "status": status,
+        "call_id": call["id"],
+        "name": call["function"]["name"],
+        "arguments": call["function"]["arguments"] if status == "completed" else "",
+    }
+
+
+def _response(
+    response_id: str,
+    model: str,
+    created_at: int,
+    status: str,
+    output: List[Dict[str, Any]],
+    usage: Optional[Dict[str, int]] = None,
+    error: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    return {
+        "id": response_id,
+        "object": "response",
+        "created_at": created_at,
+        "status": status,
+        "model": model,
+        "output": output,
+        "usage": usage,
+        "error": error,
+        "incomplete_details": None,
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+    }
+
+
+class _OutputItem:
+    """流式输出中的一个输出项，文本写入 StringIO 缓冲区"""
+
+    def __init__(self, kind: str, item_id: str, output_index: int, call: Optional[Dict[str, Any]] = None):
+        self.kind = kind
+        self.id = item_id
+        self.output_index = output_index
+        self.call = call
+        self.text = io.StringIO()
+
+    def done_item(self) -> Dict[str, Any]:
+        if self.kind == "reasoning":
+            return _reasoning_item(self.id, self.text.getvalue())
+        if self.kind == "message":
+            return _message_item(self.id, self.text.getvalue())
+        return _function_call_item(self.id, self.call)
+
+
+class ResponsesStreamTranslator:
+    """把上游事件翻译为 Responses API 流式事件"""
+
+    def __init__(self, model: str, tool_names: FrozenSet[str], include_reasoning: bool):
+        self.model = model
+        self.response_id = _item_id("resp")
+        self.created_at = int(time.time())
+        self.include_reasoning = include_reasoning
+        self.tools = ToolCallAssembler(tool_names) if tool_names else None
+        self.usage: Optional[Dict[str, Any]] = None
+        self.output: List[Dict[str, Any]] = []
+        self._sequence = 0
+        self._started = False
+        self._closed = False
+        self._current: Optional[_OutputItem] = None
+        # 工具调用 index 到输出项的映射
+        self._calls: Dict[int, _OutputItem] = {}
+
+    def _event(self, event_type: str, **payload: Any) -> str:
+        payload = {"type": event_type, "sequence_number": self._sequence, **payload}
+        self._sequence += 1
+        return f"event: {event_type}\ndata: {json_codec.dumps(payload)}\n\n"
+
+    def _snapshot(self, status: str, **extra: Any) -> Dict[str, Any]:
+        # 未结束的输出项在 output 中只有占位
+        output = [item for item in self.output if item]
+        return _response(self.response_id, self.model, self.created_at, status, output, **extra)
+
+    def _start(self) -> str:
+        self._started = True
+        return self._event("response.created", response=self._snapshot("in_progress")) + self._event(
+            "response.in_progress", response=self._snapshot("in_progress")
+        )
+
+    def _open(self, kind: str, call: Optional[Dict[str, Any]] = None) -> str:
+        out = self._close_item()
+        prefix = {"reasoning": "rs", "message": "msg", "function_call": "fc"}[kind]
+        item = self._current = _OutputItem(kind, _item_id(prefix), len(self.output), call)
+        # 占位，结束时替换为完整的输出项
+        self.output.append({})
+        if kind == "reasoning":
+            out += self._event(
+                "response.output_item.added",
+                output_index=item.output_index,
+                item={"id": item.id, "type": "reasoning", "summary": []},
+            )
+            out += self._event(
+                "response.reasoning_summary_part.added",
+                item_id=item.id,
+                output_index=item.output_index,
+                summary_index=0,
+                part={"type": "summary_text", "text": ""},
+            )
+        elif kind == "message":
+            out += self._event(
+                "response.output_item.added",
+                output_index=item.output_index,
+                item=_message_item(item.id, "", status="in_progress"),
+            )
+            out += self._event(
+                "response.content_part.added",
+                item_id=item.id,
+                output_index=item.output_index,
+                content_index=0,
+                part={"type": "output_text", "text": "", "annotations": []},
+            )
+        else:
+            out += self._event(
+                "response.output_item.added",
+                output_index=item.output_index,
+                item=_function_call_item(item.id, call, status="in_progress"),
+            )
+        return out
+
+    def _close_item(self) -> str:
+        item = self._current
+        if item is None:
+            return ""
+        self._current = None
+        text = item.text.getvalue()
+        out = ""
+        if item.kind == "reasoning":
+            out += self._event(
+                "response.reasoning_summary_text.done",
+                item_id=item.id,
+                output_index=item.output_index,
+                summary_index=0,
+                text=text,
+            )
+            out += self._event(
+                "response.reasoning_summary_part.done",
+                item_id=item.id,
+                output_index=item.output_index,
+                summary_index=0,
+                part={"type": "summary_text", "text": text},
+            )
+        elif item.kind == "message":
+            out += self._event(
+                "response.output_text.done",
+                item_id=item.id,
+                output_index=item.output_index,
+                content_index=0,
+                text=text,
+            )
+            out += self._event(
+                "response.content_part.done",
+                item_id=item.id,
+                output_index=item.output_index,
+                content_index=0,
+                part={"type": "output_text", "text": text, "annotations": []},
+            )
+        else:
+            out += self._event(
+                "response.function_call_arguments.done",
+                item_id=item.id,
+                output_index=item.output_index,
+                arguments=item.call["function"]["arguments"],
+            )
+        done = self.output[item.output_index] = item.done_item()
+        return out + self._event("response.output_item.done", output_index=item.output_index, item=done)
+
+    def _text(self, kind: str, content: str) -> str:
+        out = "" if self._current is not None and self._current.kind == kind else self._open(kind)
+        item = self._current
+        item.text.write(content)
+        if kind == "reasoning":
+            return out + self._event(
+                "response.reasoning_summary_text.delta",
+                item_id=item.id,
+                output_index=item.output_index,
+                summary_index=0,
+                delta=content,
+            )
+        return out + self._event(
+            "response.output_text.delta",
+            item_id=item.id,
+            output_index=item.output_index,
+            content_index=0,
+            delta=content,
+        )
+
+    def _tool_deltas(self, event: UpstreamEvent) -> str:
+        out = []
+        for delta in self.tools.feed(event):
+            if "id" in delta:
+                # 组装器中的调用对象随后续片段更新，结束时直接取完整的 arguments
+                out.append(self._open("function_call", self.tools.calls[delta["index"]]))
+                self._calls[delta["index"]] = self._current
+            item = self._calls[delta["index"]]
+            arguments = delta["function"].get("arguments") or ""
+            if arguments:
+                out.append(
+                    self._event(
+                        "response.function_call_arguments.delta",
+                        item_id=item.id,
+                        output_index=item.output_index,
+                        delta=arguments,
+                    )
+                )
+        return "".join(out)
+
+    def _close(self) -> str:
+        self._closed = True
+        out = self._close_item()
+        return out + self._event(
+            "response.completed", response=self._snapshot("completed", usage=_usage(self.usage))
+        )
+
+    def translate(self, event: UpstreamEvent) -> Optional[str]:
+        out = "" if self._started else self._start()
+        phase = event.phase
+        if phase == "thinking":
+            if self.include_reasoning and event.content:
+                out += self._text("reasoning", event.content)
+        elif phase in ("answer", "other"):
+            if event.content:
+                out += self._text("message", event.content)
+            if phase == "other" and event.usage:
+                self.usage = event.usage
+        elif phase == "tool_call" and self.tools is not None:
+            out += self._tool_deltas(event)
+        elif phase == "done":
+            out += self._close()
+        return out or None
+
+    def finish(self) -> Optional[str]:
+        """上游没有发送 done 就结束时，补齐结束事件"""
+        if self._closed:
+            return None
+        return ("" if self._started else self._start()) + self._close()
+
+    def error(self, message: str, code: Optional[int] = None) -> str:
+        out = "" if self._started else self._start()
+        self._closed = True
+        return (
+            out
+            + self._event("error", code=str(code) if code else "upstream_error", message=message, param=None)
+            + self._event(
+                "response.failed",
+                response=self._snapshot("failed", error={"code": "upstream_error", "message": message}),
+            )
+        )
+
+
+def render_response(
+    aggregator: CompletionAggregator, model: str, include_reasoning: bool
+) -> Dict[str, Any]:
+    """由聚合结果生成非流式的 response 对象"""
+    output: List[Dict[str, Any]] = []
+    if include_reasoning and aggregator.reasoning:
+        output.append(_reasoning_item(_item_id("rs"), aggregator.reasoning))
+    if aggregator.content:
+        output.append(_message_item(_item_id("msg"), aggregator.content))
+    for call in aggregator.tool_calls:
+        output.append(_function_call_item(_item_id("fc"), call))
+    return _response(
+        _item_id("resp"), model, int(time.time()), "completed", output, usage=_usage(aggregator.usage)
+    )
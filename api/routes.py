@@ -1,16 +1,227 @@
+import hmac
 import json
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
 from fastapi import APIRouter, HTTPException, Request, Response
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from api.admission import (
+    BATCH,
+    AdmissionRejected,
+    AdmissionTicket,
+    client_key,
+    get_admission_controller,
+    request_priority,
+)
+from api.batches import (
+    BATCH_ID_HEADER,
+    NDJSON_MEDIA_TYPE,
+    BatchItemError,
+    BatchRejected,
+    get_batch_store,
+    parse_batch_items,
+)
 from api.config import get_settings
-from api.models import ChatRequest
-from api.chat_service import process_non_streaming_response, process_streaming_response
+from api.models import AnthropicRequest, ChatRequest, ResponsesRequest
+from api import anthropic_api, responses_api
+from api.chat_service import (
+    StreamTranslator,
+    coalesced_non_streaming_response,
+    coalesced_streaming_response,
+    process_non_streaming_response,
+    process_streaming_response,
+    tool_names,
+)
+from api.compaction import COMPACTION_HEADER, compact_request
 from api.logger import setup_logger
+from api.lru_cache import TTLLRUCache
+from api.model_registry import get_model_registry
+from api.response_cache import (
+    CACHE_HEADER,
+    fresh_copy,
+    get_response_cache,
+    is_cacheable,
+    make_request_key,
+    replay_as_stream,
+)
+from api.stream_guard import ClientDisconnected, cancel_on_disconnect, guard_stream
+from api.stream_translator import CompletionAggregator
+from api.token_pool import TokenState, get_token_pool
+from api.upstream import UpstreamError
 
 logger = setup_logger(__name__)
 
 router = APIRouter()
 
-ALLOWED_MODELS = get_settings().ALLOWED_MODELS
+settings = get_settings()
+# 启动时编译模型注册表，请求路径上只做集合查找
+model_registry = get_model_registry()
+
+STREAM_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "Transfer-Encoding": "chunked",
+}
+
+# (状态码, 错误信息, 响应头) -> 错误响应；各协议的错误体格式不同
+ErrorResponse = Callable[[int, str, Optional[Dict[str, str]]], Response]
+
+
+def _noop() -> None:
+    pass
+
+
+def _unauthorized(message: str) -> Response:
+    return Response(
+        status_code=401,
+        content=json.dumps({"message": message}),
+        media_type="application/json",
+    )
+
+
+def _authenticate(request: Request) -> Tuple[Optional[str], Optional[Response]]:
+    """
+    Returns:
+        (客户端令牌, 认证失败时的 401 响应)
+    """
+    ## 获取header中的Authorization，Anthropic 客户端使用 x-api-key
+    client_token = (
+        request.headers.get("Authorization").split(" ")[-1]
+        if request.headers.get("Authorization")
+        else request.headers.get("x-api-key")
+    )
+    if get_token_pool() is None:
+        # 直传模式：客户端令牌即上游令牌
+        if not client_token:
+            logger.info("No Access Token provided")
+            return client_token, _unauthorized("Unauthorized: Access token is missing")
+    elif not settings.APP_SECRET:
+        # 令牌池模式必须配置 APP_SECRET，否则任何客户端都能使用池中的账号
+        logger.error("Token pool enabled without APP_SECRET, request rejected")
+        return client_token, _json_error(503, "Server misconfigured: APP_SECRET is required")
+    elif not (client_token and hmac.compare_digest(client_token, settings.APP_SECRET)):
+        logger.info("Invalid APP_SECRET provided")
+        return client_token, _unauthorized("Unauthorized: Invalid API key")
+    return client_token, None
+
+
+def _cache_scope(client_token: Optional[str]) -> Optional[str]:
+    """直传模式下客户端令牌即上游账号，缓存结果只在同一令牌内共享；令牌池模式下全局共享"""
+    return client_token if get_token_pool() is None else None
+
+
+def _model_not_allowed(model: str) -> str:
+    return f"Model {model} is not allowed. Allowed models are: {', '.join(m['id'] for m in model_registry.public_models)}"
+
+
+class _ReleasingStreamingResponse(StreamingResponse):
+    """
+    响应结束后归还上游令牌的在途名额与准入名额
+
+    在 ASGI 调用外层释放而不是在生成器的 finally 中释放：客户端在响应开始前断开时
+    生成器从未被迭代，finally 不会执行。
+    """
+
+    def __init__(self, content: AsyncIterator[str], release: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+
+async def _cache_when_complete(
+    stream: AsyncIterator[str],
+    aggregator: CompletionAggregator,
+    cache: TTLLRUCache[Dict[str, Any]],
+    cache_key: str,
+    model: str,
+) -> AsyncIterator[str]:
+    """流完整结束后把聚合出的响应写入缓存，命中时由 replay_as_stream 重放"""
+    async for chunk in stream:
+        yield chunk
+    if aggregator.done:
+        response = aggregator.build(model)
+        if is_cacheable(response):
+            cache.set(cache_key, response)
+
+
+def _upstream_status(e: UpstreamError) -> int:
+    """上游 4xx（如令牌失效、限流）原样返回，其余统一为 502"""
+    return e.status_code if e.status_code and e.status_code < 500 else 502
+
+
+def _json_error(status_code: int, message: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(
+        status_code=status_code,
+        content=json.dumps({"message": message}),
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+def _client(request: Request, client_token: Optional[str]) -> str:
+    return client_key(request, client_token, pooled=get_token_pool() is not None)
+
+
+async def _acquire_upstream(
+    client: str,
+    priority: str,
+    model: str,
+    client_token: Optional[str],
+    error_response: ErrorResponse = _json_error,
+) -> Tuple[Optional[str], Callable[[], None], Optional[Response]]:
+    """
+    依次获取准入名额与上游令牌
+
+    Returns:
+        (上游令牌, 归还名额的函数, 无法受理时的 429/503 响应)
+    """
+    pool = get_token_pool()
+    ticket: Optional[AdmissionTicket] = None
+    admission = get_admission_controller()
+    if admission is not None:
+        try:
+            ticket = await admission.acquire(client, priority)
+        except AdmissionRejected as rejected:
+            logger.info(
+                "Request rejected by admission control",
+                extra={"model": model, "reason": rejected.reason},
+            )
+            return None, _noop, error_response(
+                429, f"Too many requests: {rejected.reason}", {"Retry-After": rejected.retry_after_header}
+            )
+
+    lease: Optional[TokenState] = None
+    access_token = client_token
+    if pool is not None:
+        lease = pool.acquire()
+        if lease is None:
+            logger.warning("No upstream token available")
+            if ticket is not None:
+                ticket.release()
+            return None, _noop, error_response(
+                503,
+                "No upstream token available",
+                {"Retry-After": str(int(settings.TOKEN_RATE_LIMIT_COOLDOWN))},
+            )
+        access_token = lease.token
+
+    released = False
+
+    def release() -> None:
+        # 可能在多个清理路径上被调用，只归还一次
+        nonlocal released
+        if released:
+            return
+        released = True
+        if lease is not None:
+            pool.release(lease)
+        if ticket is not None:
+            ticket.release()
+
+    return access_token, release, None
 
 
 @router.options("/chat/completions")
@@ -27,47 +238,303 @@ async def chat_completions_options():
 
 @router.get("/models")
 async def list_models():
-    return {"object": "list", "data": ALLOWED_MODELS, "success": True}
+    return {"object": "list", "data": model_registry.public_models, "success": True}
 
 
 @router.post("/chat/completions")
 async def chat_completions(request: Request, chat_request: ChatRequest):
-    logger.info("Entering chat_completions route")
     # logger.info(f"Received request: {chat_request}")
-    ## 获取header中的Authorization
-    access_token = (
-        request.headers.get("Authorization").split(" ")[-1]
-        if request.headers.get("Authorization")
-        else None
+    client_token, denied = _authenticate(request)
+    if denied is not None:
+        return denied
+    logger.debug(
+        "Received chat completion request",
+        extra={"model": chat_request.model, "stream": bool(chat_request.stream), "sampled": True},
     )
-    if access_token:
-        logger.info(f"Access Token: {access_token}")
-    else:
-        logger.info("No Access Token provided")
-        return Response(
-            status_code=401,
-            content=json.dumps({"message": "Unauthorized: Access token is missing"}),
-            media_type="application/json",
-        )
-    logger.info(f"Received chat completion request for model: {chat_request.model}")
 
-    if chat_request.model not in [model["id"] for model in ALLOWED_MODELS]:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Model {chat_request.model} is not allowed. Allowed models are: {', '.join(model['id'] for model in ALLOWED_MODELS)}",
+    if chat_request.model not in model_registry:
+        raise HTTPException(status_code=400, detail=_model_not_allowed(chat_request.model))
+
+    # 响应缓存（需显式开启）；客户端可用 Cache-Control: no-cache 跳过查找
+    cache = get_response_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = make_request_key(chat_request, _cache_scope(client_token))
+        if "no-cache" not in request.headers.get("Cache-Control", ""):
+            cached = cache.get(cache_key)
+            if cached is not None:
+                logger.info("Response cache hit", extra={"model": chat_request.model})
+                if chat_request.stream:
+                    return StreamingResponse(
+                        replay_as_stream(cached),
+                        media_type="text/event-stream",
+                        headers={**STREAM_HEADERS, CACHE_HEADER: "HIT"},
+                    )
+                return JSONResponse(fresh_copy(cached), headers={CACHE_HEADER: "HIT"})
+
+    response_headers: Dict[str, str] = {CACHE_HEADER: "MISS"} if cache is not None else {}
+    if settings.COMPACTION_ENABLED:
+        chat_request, report = compact_request(
+            chat_request, model_registry.context_budget(chat_request.model)
         )
+        response_headers[COMPACTION_HEADER] = report.header_value()
+        if report.dropped_messages:
+            logger.info("Context compacted", extra={"model": chat_request.model, **report._asdict()})
+
+    # 准入控制（需显式开启）：缓存命中不占用名额
+    access_token, release, denied = await _acquire_upstream(
+        _client(request, client_token), request_priority(request), chat_request.model, client_token
+    )
+    if denied is not None:
+        return denied
 
     if chat_request.stream:
-        logger.info("Streaming response")
-        return StreamingResponse(
-            process_streaming_response(chat_request, access_token),
+        # 开启缓存时同时聚合完整响应，流正常结束后写入流式请求自己的缓存键
+        aggregator = CompletionAggregator(tool_names(chat_request)) if cache is not None else None
+        if settings.COALESCE_ENABLED:
+            stream = coalesced_streaming_response(chat_request, access_token, aggregator)
+        else:
+            stream = process_streaming_response(chat_request, access_token, aggregator=aggregator)
+        if aggregator is not None:
+            stream = _cache_when_complete(stream, aggregator, cache, cache_key, chat_request.model)
+        stream = guard_stream(request, stream, chat_request.model)
+        return _ReleasingStreamingResponse(
+            stream,
+            release,
             media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Transfer-Encoding": "chunked",
-            },
+            headers={**STREAM_HEADERS, **response_headers},
         )
     else:
-        logger.info("Non-streaming response")
-        return await process_non_streaming_response(chat_request, access_token)
+        if settings.COALESCE_ENABLED:
+            upstream_call = coalesced_non_streaming_response(chat_request, access_token)
+        else:
+            upstream_call = process_non_streaming_response(chat_request, access_token)
+        try:
+            response = await cancel_on_disconnect(
+                request, upstream_call, chat_request.model
+            )
+        except ClientDisconnected:
+            # 客户端已经断开，响应不会被读取
+            return Response(status_code=499)
+        except UpstreamError as e:
+            logger.error(f"Upstream request failed: {e}")
+            return _json_error(_upstream_status(e), str(e))
+        finally:
+            release()
+        if cache is not None and is_cacheable(response):
+            cache.set(cache_key, response)
+        if not response_headers:
+            return response
+        return JSONResponse(response, headers=response_headers)
+
+
+async def _protocol_completion(
+    request: Request,
+    chat_request: ChatRequest,
+    client_token: Optional[str],
+    translator: StreamTranslator,
+    render: Callable[[CompletionAggregator], Dict[str, Any]],
+    error_response: ErrorResponse,
+) -> Response:
+    """
+    /messages 与 /responses 共用的处理流程
+
+    与 /chat/completions 共用上下文压缩、准入控制、令牌池与上游事件解析，
+    流式响应由 translator 直接生成各协议的事件，非流式响应由 render 生成响应体。
+    响应缓存与请求合并保存的是 chat.completion 格式，这两个入口不使用。
+    """
+    if chat_request.model not in model_registry:
+        return error_response(400, _model_not_allowed(chat_request.model), None)
+
+    response_headers: Dict[str, str] = {}
+    if settings.COMPACTION_ENABLED:
+        chat_request, report = compact_request(
+            chat_request, model_registry.context_budget(chat_request.model)
+        )
+        response_headers[COMPACTION_HEADER] = report.header_value()
+
+    access_token, release, denied = await _acquire_upstream(
+        _client(request, client_token),
+        request_priority(request),
+        chat_request.model,
+        client_token,
+        error_response,
+    )
+    if denied is not None:
+        return denied
+
+    if chat_request.stream:
+        stream = process_streaming_response(chat_request, access_token, translator)
+        stream = guard_stream(request, stream, chat_request.model)
+        return _ReleasingStreamingResponse(
+            stream,
+            release,
+            media_type="text/event-stream",
+            headers={**STREAM_HEADERS, **response_headers},
+        )
+    try:
+        response = await cancel_on_disconnect(
+            request,
+            process_non_streaming_response(chat_request, access_token, render),
+            chat_request.model,
+        )
+    except ClientDisconnected:
+        return Response(status_code=499)
+    except UpstreamError as e:
+        logger.error(f"Upstream request failed: {e}")
+        return error_response(_upstream_status(e), str(e), None)
+    finally:
+        release()
+    return JSONResponse(response, headers=response_headers)
+
+
+def _anthropic_error(status_code: int, message: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    return JSONResponse(
+        status_code=status_code,
+        content=anthropic_api.error_body(message, status_code),
+        headers=headers,
+    )
+
+
+def _responses_error(status_code: int, message: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    return JSONResponse(
+        status_code=status_code,
+        content=responses_api.error_body(message, status_code),
+        headers=headers,
+    )
+
+
+@router.post("/messages")
+async def create_message(request: Request, body: AnthropicRequest):
+    """Anthropic Messages API"""
+    client_token, denied = _authenticate(request)
+    if denied is not None:
+        return denied
+    chat_request = anthropic_api.to_chat_request(body)
+    include_thinking = anthropic_api.thinking_requested(body)
+    return await _protocol_completion(
+        request,
+        chat_request,
+        client_token,
+        anthropic_api.AnthropicStreamTranslator(
+            body.model, tool_names(chat_request), include_thinking
+        ),
+        lambda aggregator: anthropic_api.render_message(aggregator, body.model, include_thinking),
+        _anthropic_error,
+    )
+
+
+@router.post("/responses")
+async def create_response(request: Request, body: ResponsesRequest):
+    """OpenAI Responses API"""
+    client_token, denied = _authenticate(request)
+    if denied is not None:
+        return denied
+    chat_request = responses_api.to_chat_request(body)
+    include_reasoning = responses_api.reasoning_requested(body)
+    return await _protocol_completion(
+        request,
+        chat_request,
+        client_token,
+        responses_api.ResponsesStreamTranslator(
+            body.model, tool_names(chat_request), include_reasoning
+        ),
+        lambda aggregator: responses_api.render_response(aggregator, body.model, include_reasoning),
+        _responses_error,
+    )
+
+
+def _batch_item_error(status_code: int, message: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    """批量任务中无法受理的请求记录到该请求的结果行，不返回响应"""
+    raise BatchItemError(status_code, message)
+
+
+async def _execute_batch_item(
+    chat_request: ChatRequest, client_token: Optional[str], client: str
+) -> Dict[str, Any]:
+    """
+    以非流式方式执行批量任务中的一个请求，与 /chat/completions 共用缓存、压缩、准入与令牌池
+
+    Raises:
+        BatchItemError: 该请求失败
+    """
+    if chat_request.model not in model_registry:
+        raise BatchItemError(400, _model_not_allowed(chat_request.model))
+
+    cache = get_response_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = make_request_key(chat_request, _cache_scope(client_token))
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return fresh_copy(cached)
+
+    if settings.COMPACTION_ENABLED:
+        chat_request, _ = compact_request(
+            chat_request, model_registry.context_budget(chat_request.model)
+        )
+
+    # 批量请求以 batch 优先级排队，让位于交互请求
+    access_token, release, _ = await _acquire_upstream(
+        client, BATCH, chat_request.model, client_token, _batch_item_error
+    )
+    try:
+        if settings.COALESCE_ENABLED:
+            response = await coalesced_non_streaming_response(chat_request, access_token)
+        else:
+            response = await process_non_streaming_response(chat_request, access_token)
+    except UpstreamError as e:
+        raise BatchItemError(_upstream_status(e), str(e)) from e
+    finally:
+        release()
+
+    if cache is not None and is_cacheable(response):
+        cache.set(cache_key, response)
+    return response
+
+
+@router.post("/batches")
+async def create_batch(request: Request):
+    """
+    提交批量请求，请求体为 NDJSON/JSONL 或 JSON 数组 / {"requests": [...]}
+
+    响应为 NDJSON：每完成一个请求输出一行结果（按完成顺序，带 index 与 custom_id），
+    最后一行为任务摘要；batch id 通过 X-Batch-ID 响应头返回。
+    """
+    client_token, denied = _authenticate(request)
+    if denied is not None:
+        return denied
+    try:
+        items = parse_batch_items(await request.body(), request.headers.get("Content-Type", ""))
+    except BatchRejected as e:
+        return JSONResponse(status_code=e.status_code, content={"message": str(e)})
+
+    owner = _client(request, client_token)
+    job = await get_batch_store().create(owner, len(items))
+    job.start(
+        items,
+        lambda chat_request: _execute_batch_item(chat_request, client_token, owner),
+        settings.BATCH_CONCURRENCY,
+    )
+    logger.info("Batch created", extra={"batch_id": job.id, "total": job.total})
+    return StreamingResponse(
+        job.results(),
+        media_type=NDJSON_MEDIA_TYPE,
+        headers={BATCH_ID_HEADER: job.id, "Cache-Control": "no-cache"},
+    )
+
+
+@router.get("/batches/{batch_id}")
+async def read_batch(request: Request, batch_id: str, offset: int = 0):
+    """续读批量任务的结果：跳过已经收到的 offset 行，之后的结果实时输出直到任务结束"""
+    client_token, denied = _authenticate(request)
+    if denied is not None:
+        return denied
+    job = await get_batch_store().get(batch_id, _client(request, client_token))
+    if job is None:
+        return JSONResponse(status_code=404, content={"message": f"Batch {batch_id} not found"})
+    return StreamingResponse(
+        job.results(offset),
+        media_type=NDJSON_MEDIA_TYPE,
+        headers={BATCH_ID_HEADER: job.id, "Cache-Control": "no-cache"},
+    )
@@ -1,41 +1,113 @@
 import time
 import hmac
 import hashlib
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Union
+from api.logger import setup_logger
 
+logger = setup_logger(__name__)
 
-def generate_signature(e: str, t: str) -> dict:
+# 签名窗口长度（毫秒），中间密钥只取决于时间戳所在的窗口
+WINDOW_MS = 5 * 60 * 1000
+
+_KEY1 = "junjie".encode("utf-8")
+
+# 大段文本分片编码后送入 HMAC，避免一次性复制整个提示词
+_ENCODE_CHUNK_CHARS = 64 * 1024
+
+# 缓存最近两个窗口的中间密钥：窗口边界附近的并发请求、时钟回拨都不会反复重算
+_window_keys: Dict[int, bytes] = {}
+
+# 本地时钟相对上游的偏移（毫秒），由 observe_server_date 根据上游 Date 头估计
+_clock_offset_ms = 0
+# 偏差小于该值时不修正：Date 头只有秒级精度，还包含网络延迟
+_CLOCK_SKEW_TOLERANCE_MS = 2000
+_CLOCK_SYNC_INTERVAL = 60.0
+_last_clock_sync = 0.0
+
+
+def now_ms() -> int:
+    """当前毫秒时间戳，已按上游时钟偏移修正"""
+    return int(time.time() * 1000) + _clock_offset_ms
+
+
+def observe_server_date(date_header: Optional[str]) -> None:
+    """
+    根据上游响应的 Date 头估计时钟偏移，每分钟最多计算一次
+
+    本机时钟偏差超过 2 秒时，后续签名使用修正后的时间戳，
+    避免在窗口边界附近因两端所在窗口不同而签名失效。
+    """
+    global _clock_offset_ms, _last_clock_sync
+    if not date_header:
+        return
+    monotonic = time.monotonic()
+    if monotonic - _last_clock_sync < _CLOCK_SYNC_INTERVAL:
+        return
+    _last_clock_sync = monotonic
+    try:
+        server_ms = int(parsedate_to_datetime(date_header).timestamp() * 1000)
+    except (TypeError, ValueError):
+        return
+    skew = server_ms - int(time.time() * 1000)
+    offset = skew if abs(skew) > _CLOCK_SKEW_TOLERANCE_MS else 0
+    if offset != _clock_offset_ms:
+        logger.warning(f"Upstream clock skew is {skew} ms, signing with offset {offset} ms")
+        _clock_offset_ms = offset
+
+
+def window_key(timestamp_ms: int) -> bytes:
+    """获取时间戳所在窗口的中间密钥 o = HMAC-SHA256("junjie", n)，按窗口缓存"""
+    n = timestamp_ms // WINDOW_MS
+    key = _window_keys.get(n)
+    if key is None:
+        key = hmac.new(_KEY1, str(n).encode("utf-8"), hashlib.sha256).hexdigest().encode("utf-8")
+        # 只保留当前与上一个窗口
+        for stale in [window for window in _window_keys if window < n - 1]:
+            _window_keys.pop(stale, None)
+        _window_keys[n] = key
+    return key
+
+
+def _update_text(mac: "hmac.HMAC", t: Union[str, bytes, bytearray, memoryview]) -> None:
+    if isinstance(t, str):
+        if len(t) <= _ENCODE_CHUNK_CHARS:
+            mac.update(t.encode("utf-8"))
+        else:
+            # 按码点切片，每片单独编码的结果与整体编码相同
+            for start in range(0, len(t), _ENCODE_CHUNK_CHARS):
+                mac.update(t[start:start + _ENCODE_CHUNK_CHARS].encode("utf-8"))
+    else:
+        mac.update(t)
+
+
+def generate_signature(
+    e: str,
+    t: Union[str, bytes, bytearray, memoryview],
+    timestamp_ms: Optional[int] = None,
+) -> dict:
     """
     根据输入参数 e 和 t 生成签名和时间戳。
 
+    签名为 HMAC-SHA256(o, "{e}|{t}|{timestamp}")，其中中间密钥 o 只取决于时间戳所在的
+    5 分钟窗口，按窗口缓存。消息以增量方式送入 HMAC，不拼接完整字符串。
+
     Args:
         e: 第一个输入参数。
-        t: 第二个输入参数。
+        t: 第二个输入参数（通常是最后一条消息），可以是 str 或已编码的 UTF-8 字节。
+        timestamp_ms: 签名使用的毫秒时间戳，默认取 now_ms()。
 
     Returns:
         一个包含 'signature' 和 'timestamp' 的字典。
     """
-    # 1. 获取当前时间的毫秒级时间戳
-    timestamp_ms = int(time.time() * 1000)
-    # timestamp_ms = 1759746422192
-
-    # 2. 拼接字符串
-    message_string = f"{e}|{t}|{timestamp_ms}"
-
-    # 3. 计算 n
-    n = timestamp_ms // (5 * 60 * 1000)
-
-    # 4. 计算中间密钥 o (HMAC-SHA256)
-    key1 = "junjie".encode("utf-8")
-    msg1 = str(n).encode("utf-8")
-    intermediate_key = hmac.new(key1, msg1, hashlib.sha256).hexdigest()
-
-    # 5. 计算最终签名 (HMAC-SHA256)
-    key2 = intermediate_key.encode("utf-8")
-    msg2 = message_string.encode("utf-8")
-    final_signature = hmac.new(key2, msg2, hashlib.sha256).hexdigest()
+    if timestamp_ms is None:
+        timestamp_ms = now_ms()
 
-    # 6. 返回结果
-    return {"signature": final_signature, "timestamp": timestamp_ms}
+    mac = hmac.new(window_key(timestamp_ms), digestmod=hashlib.sha256)
+    mac.update(f"{e}|".encode("utf-8"))
+    _update_text(mac, t)
+    mac.update(f"|{timestamp_ms}".encode("utf-8"))
+    return {"signature": mac.hexdigest(), "timestamp": timestamp_ms}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,144 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class StreamBroadcast:
+    """
+    把一个上游流广播给多个订阅者
+
+    首个请求创建的后台任务驱动上游流，所有 chunk 追加到共享缓冲区；
+    每个订阅者维护自己的读取位置，互不影响（慢订阅者不会拖慢其它订阅者或上游），
+    中途加入的订阅者先追读已缓冲的前缀再跟上实时数据。
+    所有订阅者都离开后取消上游请求。
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks: List[str] = []
+        self.done = False
+        self.subscribers = 0
+        self._changed = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, source: AsyncIterator[str], on_finish: Callable[[], None]) -> None:
+        self._task = asyncio.create_task(self._drive(source, on_finish))
+
+    async def _drive(self, source: AsyncIterator[str], on_finish: Callable[[], None]) -> None:
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                async with self._changed:
+                    self._changed.notify_all()
+        except asyncio.CancelledError:
+            logger.info(f"Coalesced stream {self.key[-12:]} cancelled, no subscribers left")
+        except Exception as e:
+            logger.error(f"Coalesced stream {self.key[-12:]} failed: {e}")
+        finally:
+            self.done = True
+            on_finish()
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                    index += 1
+                    yield chunk
+                    continue
+                if self.done:
+                    return
+                async with self._changed:
+                    await self._changed.wait_for(
+                        lambda: index < len(self.chunks) or self.done
+                    )
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and self._task is not None and not self._task.done():
+                self._task.cancel()
+
+
+class SharedCall:
+    """一次被多个调用方共享的非流式上游调用"""
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """按请求键合并并发的相同请求"""
+
+    def __init__(self):
+        self._streams: Dict[str, StreamBroadcast] = {}
+        self._calls: Dict[str, SharedCall] = {}
+        self.coalesced = 0
+
+    def stream(self, key: str, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        订阅 key 对应的流；不存在时用 factory 创建并由后台任务驱动
+
+        Returns:
+            该订阅者独立的 chunk 迭代器
+        """
+        broadcast = self._streams.get(key)
+        if broadcast is None or broadcast.done:
+            broadcast = StreamBroadcast(key)
+            self._streams[key] = broadcast
+
+            def on_finish() -> None:
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+
+            broadcast.start(factory(), on_finish)
+        else:
+            self.coalesced += 1
+            logger.info(f"Joined in-flight stream {key[-12:]} at chunk {len(broadcast.chunks)}")
+        return broadcast.subscribe()
+
+    async def call(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        合并并发的相同非流式调用，所有调用方得到同一个结果
+
+        上游调用运行在独立任务中，单个调用方断开不会影响其它调用方；
+        与 StreamBroadcast 相同，所有调用方都离开后取消上游调用。
+        """
+        shared = self._calls.get(key)
+        if shared is None:
+            shared = SharedCall(asyncio.ensure_future(factory()))
+            self._calls[key] = shared
+
+            def on_done(finished: asyncio.Future) -> None:
+                if self._calls.get(key) is shared:
+                    del self._calls[key]
+                # 所有调用方都已离开时也要取走异常，避免 "never retrieved" 警告
+                if not finished.cancelled():
+                    finished.exception()
+
+            shared.task.add_done_callback(on_done)
+        else:
+            self.coalesced += 1
+        shared.waiters += 1
+        try:
+            return await asyncio.shield(shared.task)
+        finally:
+            shared.waiters -= 1
+            if shared.waiters == 0 and not shared.task.done():
+                logger.info(f"Coalesced call {key[-12:]} cancelled, no callers left")
+                # 取消完成前到达的相同请求应发起新的调用，而不是加入正在取消的任务
+                if self._calls.get(key) is shared:
+                    del self._calls[key]
+                shared.task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight_streams": len(self._streams),
+            "in_flight_calls": len(self._calls),
+            "coalesced": self.coalesced,
+        }
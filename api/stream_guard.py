@@ -0,0 +1,131 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Optional
+from fastapi import Request
+from api.config import get_settings
+from api.logger import setup_logger
+from api.metrics import CANCELLED_STREAMS_TOTAL
+
+logger = setup_logger(__name__)
+
+settings = get_settings()
+
+_END = object()
+
+
+class ClientDisconnected(Exception):
+    """客户端在响应完成前断开了连接"""
+
+
+async def _aclose(iterator: AsyncIterator[Any]) -> None:
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+async def _watch_disconnect(request: Request, stopped: asyncio.Event) -> bool:
+    """
+    每隔 DISCONNECT_POLL_INTERVAL 秒检查一次客户端连接
+
+    request.is_disconnected() 内部使用 anyio CancelScope，任务恰好在其中被 cancel()
+    时取消会被吞掉，因此另用 stopped 事件结束轮询，不能只依赖 task.cancel()。
+
+    Returns:
+        客户端断开返回 True；stopped 被设置返回 False
+    """
+    while not stopped.is_set():
+        if await request.is_disconnected():
+            return True
+        try:
+            await asyncio.wait_for(stopped.wait(), timeout=settings.DISCONNECT_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+    return False
+
+
+async def guard_stream(
+    request: Request, source: AsyncIterator[str], model: str
+) -> AsyncIterator[str]:
+    """
+    在上游读取与下游写出之间加入有界缓冲，并在客户端断开时立即取消上游
+
+    - 上游由独立任务读取并放入容量为 STREAM_BUFFER_CHUNKS 的队列；
+      客户端读得慢时队列写满，读取任务随之暂停，不再从上游拉取数据，内存占用有上限。
+    - 另一个任务每隔 DISCONNECT_POLL_INTERVAL 秒检查客户端连接，
+      断开后立即取消读取任务，关闭上游请求。
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, settings.STREAM_BUFFER_CHUNKS))
+    stopped = asyncio.Event()
+    pump_error: Optional[BaseException] = None
+
+    async def pump() -> None:
+        nonlocal pump_error
+        try:
+            async for chunk in source:
+                await queue.put(chunk)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            pump_error = e
+        finally:
+            await _aclose(source)
+        await queue.put(_END)
+
+    async def watch() -> None:
+        if not await _watch_disconnect(request, stopped):
+            return
+        pump_task.cancel()
+        # 唤醒正在等待队列的消费者
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(ClientDisconnected())
+
+    pump_task = asyncio.create_task(pump())
+    watch_task = asyncio.create_task(watch())
+    completed = False
+    try:
+        while True:
+            item = await queue.get()
+            if item is _END:
+                completed = True
+                if pump_error is not None:
+                    raise pump_error
+                return
+            if isinstance(item, ClientDisconnected):
+                return
+            yield item
+    finally:
+        stopped.set()
+        for task in (pump_task, watch_task):
+            task.cancel()
+        if not completed:
+            CANCELLED_STREAMS_TOTAL.labels(model).inc()
+            logger.info("Client disconnected, upstream stream cancelled")
+        await asyncio.gather(pump_task, watch_task, return_exceptions=True)
+
+
+async def cancel_on_disconnect(request: Request, awaitable: Awaitable[Any], model: str) -> Any:
+    """
+    等待非流式请求完成；客户端提前断开时立即取消上游请求
+
+    Raises:
+        ClientDisconnected: 客户端已断开
+    """
+    task = asyncio.ensure_future(awaitable)
+    stopped = asyncio.Event()
+    watch_task = asyncio.create_task(_watch_disconnect(request, stopped))
+    try:
+        done, _ = await asyncio.wait(
+            {task, watch_task}, return_when=asyncio.FIRST_COMPLETED
+        )
+        if task in done:
+            return task.result()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        CANCELLED_STREAMS_TOTAL.labels(model).inc()
+        logger.info("Client disconnected, upstream request cancelled")
+        raise ClientDisconnected()
+    finally:
+        stopped.set()
+        watch_task.cancel()
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,355 @@
+import io
+import re
+import time
+import uuid
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional
+from api import json_codec
+from api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+DONE_CHUNK = "data: [DONE]\n\n"
+
+# tool_call 阶段以 <glm_block> 包裹的 JSON 描述一次工具调用
+_GLM_BLOCK_RE = re.compile(r"<glm_block[^>]*>(.*?)</glm_block>", re.S)
+_GLM_BLOCK_OPEN = "<glm_block"
+
+
+class UpstreamEvent(NamedTuple):
+    """一条解析后的上游 SSE 事件"""
+
+    phase: str
+    content: str
+    usage: Optional[Dict[str, Any]]
+    data: Dict[str, Any]
+
+
+def parse_upstream_line(line: str) -> Optional[UpstreamEvent]:
+    """
+    解析一行上游 SSE 数据，每行只做一次 JSON 解码
+
+    Args:
+        line: 上游返回的原始行，形如 'data: {"data": {...}}'
+
+    Returns:
+        解析出的事件；空行、非 data 行或无法解析的行返回 None
+    """
+    if not line or not line.startswith("data:"):
+        return None
+    try:
+        json_object = json_codec.loads(line[5:])
+    except json_codec.DecodeError:
+        logger.warning(f"Skipping malformed upstream line: {line[:200]}")
+        return None
+
+    data = json_object.get("data") if isinstance(json_object, dict) else None
+    if not isinstance(data, dict):
+        return None
+    phase = data.get("phase")
+    if not phase:
+        return None
+
+    usage = None
+    if phase == "thinking":
+        # 思考内容首段包含 <details><summary> 包裹，只保留正文
+        content = data.get("delta_content") or ""
+        if "</summary>\n" in content:
+            content = content.split("</summary>\n")[-1]
+    elif phase == "answer":
+        # 回答首段通过 edit_content 携带完整思考块，截取 </details> 之后的正文
+        edit_content = data.get("edit_content")
+        if edit_content and "</summary>\n" in edit_content:
+            content = edit_content.split("</details>")[-1]
+        else:
+            content = data.get("delta_content") or ""
+    elif phase == "other":
+        content = data.get("delta_content") or ""
+        usage = data.get("usage", {})
+    elif phase == "tool_call":
+        # 工具调用块通过 edit_content 下发
+        content = data.get("edit_content") or data.get("delta_content") or ""
+    else:
+        content = data.get("delta_content") or ""
+    return UpstreamEvent(phase, content, usage, data)
+
+
+class OpenAIChunkEncoder:
+    """
+    OpenAI chat.completion.chunk 序列化器
+
+    同一个流复用一个 completion id，chunk 的固定部分预先序列化为模板，
+    每个 chunk 只需要序列化变化的 delta 内容。
+    """
+
+    def __init__(
+        self,
+        model: str,
+        created: int,
+        completion_id: Optional[str] = None,
+    ):
+        self.model = model
+        self.created = created
+        self.completion_id = completion_id or f"chatcmpl-{uuid.uuid4()}"
+        head = json_codec.dumps(
+            {
+                "id": self.completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+            }
+        )
+        # 去掉结尾的 "}"，后续直接拼接 choices
+        self._prefix = f'data: {head[:-1]},"choices":[{{"index":0,"delta":'
+        self._content_prefix = self._prefix + '{"content":'
+        self._reasoning_prefix = self._prefix + '{"reasoning_content":'
+        self._open_suffix = ',"role":"assistant"},"finish_reason":null}],"usage":null}\n\n'
+
+    def content(self, content: str) -> str:
+        return self._content_prefix + json_codec.dumps(content) + self._open_suffix
+
+    def reasoning(self, content: str) -> str:
+        return self._reasoning_prefix + json_codec.dumps(content) + self._open_suffix
+
+    def chunk(
+        self,
+        delta: Dict[str, Any],
+        finish_reason: Optional[str] = None,
+        usage: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        return (
+            f"{self._prefix}{json_codec.dumps(delta)},"
+            f'"finish_reason":{json_codec.dumps(finish_reason)}}}],'
+            f'"usage":{json_codec.dumps(usage)}}}\n\n'
+        )
+
+
+class ToolCallAssembler:
+    """
+    把 tool_call 阶段的上游事件组装为 OpenAI tool_calls
+
+    支持两种上游形式：
+    - data.tool_calls 为 OpenAI 增量格式，arguments 分片到达，按 index 逐段拼接并原样转发
+    - edit_content 中的 <glm_block> JSON（data.metadata 含 id/name/arguments），
+      块闭合后整体输出；未闭合的部分留在缓冲区等待后续片段
+
+    只输出客户端在 tools 中声明过的函数，上游自行执行的 MCP 工具（如联网搜索）被忽略。
+    """
+
+    def __init__(self, tool_names: FrozenSet[str]):
+        self.tool_names = tool_names
+        self.calls: List[Dict[str, Any]] = []
+        # 上游 index 或调用 id 到输出 index 的映射；被忽略的调用映射为 None
+        self._indexes: Dict[Any, Optional[int]] = {}
+        self._pending = ""
+
+    def feed(self, event: UpstreamEvent) -> List[Dict[str, Any]]:
+        """
+        处理一条 tool_call 事件
+
+        Returns:
+            本次新增的 delta.tool_calls 条目，可能为空
+        """
+        structured = event.data.get("tool_calls")
+        if isinstance(structured, list):
+            return [delta for item in structured if (delta := self._feed_delta(item)) is not None]
+        return self._feed_blocks(event.content)
+
+    def _start(self, key: Any, call_id: Optional[str], name: Optional[str]) -> Optional[int]:
+        if name not in self.tool_names:
+            self._indexes[key] = None
+            return None
+        index = len(self.calls)
+        self._indexes[key] = index
+        self.calls.append(
+            {
+                "id": call_id or f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {"name": name, "arguments": ""},
+            }
+        )
+        return index
+
+    def _feed_delta(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        function = item.get("function") or {}
+        key = ("index", item.get("index", 0))
+        fragment = function.get("arguments") or ""
+        if key not in self._indexes:
+            index = self._start(key, item.get("id"), function.get("name"))
+            if index is None:
+                return None
+            call = self.calls[index]
+            call["function"]["arguments"] = fragment
+            return {"index": index, **call, "function": {**call["function"]}}
+        index = self._indexes[key]
+        if index is None or not fragment:
+            return None
+        self.calls[index]["function"]["arguments"] += fragment
+        return {"index": index, "function": {"arguments": fragment}}
+
+    def _feed_blocks(self, content: str) -> List[Dict[str, Any]]:
+        buffer = self._pending + content
+        deltas: List[Dict[str, Any]] = []
+        end = 0
+        for match in _GLM_BLOCK_RE.finditer(buffer):
+            end = match.end()
+            delta = self._parse_block(match.group(1))
+            if delta is not None:
+                deltas.append(delta)
+        # 只保留尚未闭合的块
+        start = buffer.find(_GLM_BLOCK_OPEN, end)
+        self._pending = buffer[start:] if start >= 0 else ""
+        return deltas
+
+    def _parse_block(self, text: str) -> Optional[Dict[str, Any]]:
+        try:
+            block = json_codec.loads(text)
+        except json_codec.DecodeError:
+            logger.warning(f"Skipping malformed tool call block: {text[:200]}")
+            return None
+        data = block.get("data") if isinstance(block, dict) else None
+        metadata = data.get("metadata") if isinstance(data, dict) else None
+        if not isinstance(metadata, dict):
+            return None
+        call_id = metadata.get("id")
+        key = ("id", call_id)
+        # 同一个块可能随 edit_content 重复下发
+        if call_id and key in self._indexes:
+            return None
+        index = self._start(key, call_id, metadata.get("name"))
+        if index is None:
+            return None
+        arguments = metadata.get("arguments")
+        if not isinstance(arguments, str):
+            arguments = json_codec.dumps(arguments if arguments is not None else {})
+        call = self.calls[index]
+        call["function"]["arguments"] = arguments
+        return {"index": index, **call, "function": {**call["function"]}}
+
+
+class OpenAIStreamTranslator:
+    """把上游事件翻译为 OpenAI 流式 chunk"""
+
+    def __init__(self, model: str, created: int, tool_names: FrozenSet[str] = frozenset()):
+        self.encoder = OpenAIChunkEncoder(model, created)
+        self.tools = ToolCallAssembler(tool_names) if tool_names else None
+
+    def translate(self, event: UpstreamEvent) -> Optional[str]:
+        """
+        翻译一条上游事件
+
+        Returns:
+            序列化好的 SSE chunk；done 返回 DONE_CHUNK；不需要输出的事件返回 None
+        """
+        phase = event.phase
+        if phase == "answer":
+            return self.encoder.content(event.content)
+        if phase == "thinking":
+            return self.encoder.reasoning(event.content)
+        if phase == "other":
+            return self.encoder.chunk(
+                {"content": event.content, "role": "assistant"},
+                finish_reason="tool_calls" if self.tools and self.tools.calls else "stop",
+                usage=event.usage,
+            )
+        if phase == "done":
+            return DONE_CHUNK
+        if phase == "tool_call" and self.tools is not None:
+            deltas = self.tools.feed(event)
+            if deltas:
+                return self.encoder.chunk({"tool_calls": deltas, "role": "assistant"})
+        return None
+
+    def finish(self) -> Optional[str]:
+        """上游流结束后需要补发的内容；OpenAI 格式以 done 阶段的 [DONE] 结束，无需补发"""
+        return None
+
+    def error(self, message: str, code: Optional[int] = None) -> str:
+        return error_chunk(message, code) + DONE_CHUNK
+
+
+def error_chunk(message: str, code: Optional[int] = None) -> str:
+    """流已经开始后无法再改状态码，以 OpenAI 流式错误对象的形式告知客户端"""
+    error = {"message": message, "type": "upstream_error", "code": code}
+    return f"data: {json_codec.dumps({'error': error})}\n\n"
+
+
+def normalize_usage(usage: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """补齐 OpenAI usage 的三个计数字段，保留上游返回的其它字段"""
+    usage = dict(usage or {})
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    completion_tokens = usage.get("completion_tokens") or 0
+    usage["prompt_tokens"] = prompt_tokens
+    usage["completion_tokens"] = completion_tokens
+    usage.setdefault("total_tokens", prompt_tokens + completion_tokens)
+    return usage
+
+
+class CompletionAggregator:
+    """
+    非流式响应聚合器
+
+    各阶段的片段写入 io.StringIO 的增长缓冲区，结束时一次取出，避免逐段拼接字符串
+    带来的 O(n²) 复制，也不必像列表那样保留每个片段对象；
+    思考内容单独保存为 reasoning_content，工具调用组装为 tool_calls。
+    """
+
+    def __init__(self, tool_names: FrozenSet[str] = frozenset()):
+        self._content = io.StringIO()
+        self._reasoning = io.StringIO()
+        self._has_reasoning = False
+        self.tools = ToolCallAssembler(tool_names) if tool_names else None
+        self.usage: Optional[Dict[str, Any]] = None
+        self.done = False
+
+    def feed(self, event: UpstreamEvent) -> None:
+        phase = event.phase
+        if phase == "answer":
+            self._content.write(event.content)
+        elif phase == "thinking":
+            if event.content:
+                self._reasoning.write(event.content)
+                self._has_reasoning = True
+        elif phase == "other":
+            self._content.write(event.content)
+            if event.usage:
+                self.usage = event.usage
+        elif phase == "tool_call" and self.tools is not None:
+            self.tools.feed(event)
+        elif phase == "done":
+            self.done = True
+
+    @property
+    def content(self) -> str:
+        return self._content.getvalue()
+
+    @property
+    def reasoning(self) -> Optional[str]:
+        return self._reasoning.getvalue() if self._has_reasoning else None
+
+    @property
+    def tool_calls(self) -> List[Dict[str, Any]]:
+        return self.tools.calls if self.tools is not None else []
+
+    def build(self, model: str) -> Dict[str, Any]:
+        message: Dict[str, Any] = {"role": "assistant", "content": self.content}
+        if self._has_reasoning:
+            message["reasoning_content"] = self.reasoning
+        finish_reason = "stop"
+        if self.tool_calls:
+            message["tool_calls"] = self.tool_calls
+            message["content"] = message["content"] or None
+            finish_reason = "tool_calls"
+        return {
+            "id": f"chatcmpl-{uuid.uuid4()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": finish_reason,
+                }
+            ],
+            "usage": normalize_usage(self.usage),
+        }
@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from api.config import get_settings
+from api.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# 健康分采用指数滑动平均，越接近 1 越健康
+_HEALTH_DECAY = 0.8
+
+
+@dataclass
+class TokenState:
+    """单个上游令牌的运行状态"""
+
+    token: str
+    in_flight: int = 0
+    health: float = 1.0
+    cooldown_until: float = 0.0
+    last_acquired: float = 0.0
+    total_requests: int = 0
+    failures: int = 0
+    last_status: Optional[int] = None
+
+    @property
+    def masked(self) -> str:
+        return f"{self.token[:6]}...{self.token[-4:]}" if len(self.token) > 12 else "***"
+
+
+class TokenPool:
+    """
+    上游令牌池
+
+    每次选择处于可用状态、在途请求最少且健康分最高的令牌（再按最久未使用轮转）；
+    上游返回 429 或 401/403 时令牌进入冷却期，冷却期内不参与调度。
+    """
+
+    def __init__(
+        self,
+        tokens: List[str],
+        rate_limit_cooldown: float,
+        auth_failure_cooldown: float,
+        max_in_flight: int = 0,
+    ):
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.auth_failure_cooldown = auth_failure_cooldown
+        self.max_in_flight = max_in_flight
+        self._states: Dict[str, TokenState] = {}
+        for token in tokens:
+            if token and token not in self._states:
+                self._states[token] = TokenState(token)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def acquire(self) -> Optional[TokenState]:
+        """
+        选出一个令牌并占用一个在途名额
+
+        Returns:
+            令牌状态；全部处于冷却期或达到并发上限时返回 None
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                state
+                for state in self._states.values()
+                if state.cooldown_until <= now
+                and (self.max_in_flight <= 0 or state.in_flight < self.max_in_flight)
+            ]
+            if not candidates:
+                return None
+            # 在途数与健康分相同时选最久未使用的令牌，避免总压在同一个账号上
+            state = min(
+                candidates, key=lambda s: (s.in_flight, -s.health, s.last_acquired)
+            )
+            state.last_acquired = now
+            state.in_flight += 1
+            state.total_requests += 1
+            return state
+
+    def release(self, state: TokenState) -> None:
+        """归还在途名额"""
+        with self._lock:
+            state.in_flight = max(0, state.in_flight - 1)
+
+    def report_status(self, token: str, status_code: int) -> None:
+        """
+        记录上游响应状态，更新健康分与冷却期
+
+        不属于令牌池的令牌（例如客户端直传的令牌）会被忽略。
+        """
+        state = self._states.get(token)
+        if state is None:
+            return
+        with self._lock:
+            state.last_status = status_code
+            ok = status_code < 400
+            state.health = state.health * _HEALTH_DECAY + (1.0 - _HEALTH_DECAY) * (1.0 if ok else 0.0)
+            if ok:
+                return
+            state.failures += 1
+            if status_code == 429:
+                cooldown = self.rate_limit_cooldown
+            elif status_code in (401, 403):
+                cooldown = self.auth_failure_cooldown
+            else:
+                return
+            state.cooldown_until = time.monotonic() + cooldown
+        logger.warning(
+            f"Upstream token {state.masked} got {status_code}, cooling down for {cooldown}s"
+        )
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "token": state.masked,
+                    "in_flight": state.in_flight,
+                    "health": round(state.health, 3),
+                    "cooldown_remaining": max(0.0, round(state.cooldown_until - now, 1)),
+                    "total_requests": state.total_requests,
+                    "failures": state.failures,
+                    "last_status": state.last_status,
+                }
+                for state in self._states.values()
+            ]
+
+
+def load_upstream_tokens() -> List[str]:
+    """从 UPSTREAM_TOKENS（逗号分隔）与 UPSTREAM_TOKENS_FILE（每行一个）读取令牌"""
+    settings = get_settings()
+    tokens = [token.strip() for token in settings.UPSTREAM_TOKENS.split(",")]
+    if settings.UPSTREAM_TOKENS_FILE:
+        if os.path.exists(settings.UPSTREAM_TOKENS_FILE):
+            with open(settings.UPSTREAM_TOKENS_FILE, encoding="utf-8") as f:
+                tokens.extend(
+                    line.strip() for line in f if line.strip() and not line.startswith("#")
+                )
+        else:
+            logger.warning(f"UPSTREAM_TOKENS_FILE not found: {settings.UPSTREAM_TOKENS_FILE}")
+    return [token for token in tokens if token]
+
+
+_pool: Optional[TokenPool] = None
+_pool_loaded = False
+
+
+def get_token_pool() -> Optional[TokenPool]:
+    """获取上游令牌池，未配置令牌时返回 None（客户端令牌直传模式）"""
+    global _pool, _pool_loaded
+    if not _pool_loaded:
+        _pool_loaded = True
+        tokens = load_upstream_tokens()
+        if not tokens:
+            return None
+        settings = get_settings()
+        _pool = TokenPool(
+            tokens,
+            rate_limit_cooldown=settings.TOKEN_RATE_LIMIT_COOLDOWN,
+            auth_failure_cooldown=settings.TOKEN_AUTH_FAILURE_COOLDOWN,
+            max_in_flight=settings.TOKEN_MAX_IN_FLIGHT,
+        )
+        logger.info(f"Upstream token pool enabled with {len(_pool)} tokens")
+        if not settings.APP_SECRET:
+            logger.error("Token pool enabled without APP_SECRET, all requests will be rejected")
+    return _pool
+
+
+def report_upstream_status(token: str, status_code: int) -> None:
+    """把上游响应状态反馈给令牌池（未启用令牌池时不做任何事）"""
+    pool = get_token_pool()
+    if pool is not None:
+        pool.report_status(token, status_code)
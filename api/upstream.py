@@ -0,0 +1,305 @@
+"""
+上游聊天请求
+
+- 分阶段超时：连接（UPSTREAM_CONNECT_TIMEOUT）、首个事件（UPSTREAM_TTFB_TIMEOUT）、
+  两次读取之间（UPSTREAM_IDLE_TIMEOUT）。
+- 首个事件到达之前失败（连接错误、5xx、首字节超时、空响应）按带抖动的指数退避重试，
+  每次尝试都重新签名；首个事件之后不再重试，避免向客户端输出重复内容。
+- 开启 HEDGE_ENABLED 后，首个事件超过 p95 耗时仍未到达时再发一个相同请求，
+  先收到首个事件的一方胜出，另一方立即取消。
+- 开启 RECORD_ENABLED 后抽样录制原始上游行；设置 REPLAY_FILE 时从录制文件回放（见 api/recording.py）。
+"""
+import asyncio
+import random
+import time
+from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Iterable, List, Optional, Tuple
+import httpx
+from api.config import get_settings
+from api.headers import build_chat_headers
+from api.http_client import get_http_client
+from api.ids import uuid4_str
+from api.logger import setup_logger
+from api.metrics import (
+    HEDGED_REQUESTS_TOTAL,
+    UPSTREAM_FIRST_EVENT_SECONDS,
+    UPSTREAM_RETRIES_TOTAL,
+    StreamMetrics,
+)
+from api.recording import RecordedLine, StreamRecorder, maybe_recorder, replay_events
+from api.signature_generator import generate_signature, now_ms, observe_server_date
+from api.stream_translator import UpstreamEvent, parse_upstream_line
+from api.token_pool import report_upstream_status
+
+logger = setup_logger(__name__)
+
+settings = get_settings()
+
+# 计算 p95 对冲延迟所需的最少样本数，样本不足时不对冲
+_HEDGE_MIN_SAMPLES = 20
+
+_first_event_samples: Deque[float] = deque(maxlen=256)
+
+
+class UpstreamError(Exception):
+    """在收到首个事件之前失败的上游请求"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retryable: bool = True):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+
+
+def sign_request(zai_data: Dict[str, Any], access_token: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    为一次上游尝试生成查询参数与签名请求头
+
+    签名带有时间戳，每次尝试（包括重试与对冲）都需要重新生成。
+
+    Returns:
+        (params, headers)
+    """
+    # 查询参数与签名使用同一个时间戳，避免两次取时跨过签名窗口边界
+    timestamp_ms = now_ms()
+    params = {
+        "requestId": uuid4_str(),
+        "timestamp": str(timestamp_ms),
+        "user_id": uuid4_str(),
+    }
+
+    e = "requestId,{request_id},timestamp,{timestamp},user_id,{user_id}".format(
+        request_id=params["requestId"],
+        timestamp=int(params["timestamp"]),
+        user_id=params["user_id"],
+    )
+
+    t = zai_data["messages"][-1].get("content") or ""
+    signature_data = generate_signature(e, t, timestamp_ms)
+    params["signature_timestamp"] = str(signature_data["timestamp"])
+    headers = build_chat_headers(access_token, signature_data["signature"])
+    return params, headers
+
+
+def hedge_delay() -> Optional[float]:
+    """当前的对冲延迟；未开启或样本不足时返回 None"""
+    if not settings.HEDGE_ENABLED:
+        return None
+    if settings.HEDGE_DELAY > 0:
+        return settings.HEDGE_DELAY
+    if len(_first_event_samples) < _HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(_first_event_samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return max(settings.HEDGE_MIN_DELAY, p95)
+
+
+def _backoff(attempt: int) -> float:
+    """第 attempt 次重试前的等待时间（full jitter）"""
+    ceiling = min(
+        settings.UPSTREAM_RETRY_BACKOFF_MAX,
+        settings.UPSTREAM_RETRY_BACKOFF * (2 ** (attempt - 1)),
+    )
+    return random.uniform(0, ceiling)
+
+
+def _request_timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        settings.UPSTREAM_IDLE_TIMEOUT,
+        connect=settings.UPSTREAM_CONNECT_TIMEOUT,
+        pool=settings.POOL_ACQUIRE_TIMEOUT,
+    )
+
+
+class UpstreamStream:
+    """已经收到首个事件的上游流"""
+
+    def __init__(
+        self,
+        stack: AsyncExitStack,
+        lines: AsyncIterator[str],
+        first_event: UpstreamEvent,
+        started: float,
+        head: List[RecordedLine],
+    ):
+        self._stack = stack
+        self._lines = lines
+        self.first_event = first_event
+        # 请求发出的时间与首个事件之前（含）读到的原始行及其到达时间，供录制使用
+        self.started = started
+        self._head = head
+
+    async def events(self, recorder: Optional[StreamRecorder] = None) -> AsyncIterator[UpstreamEvent]:
+        if recorder is not None:
+            for arrived, line in self._head:
+                recorder.add(line, arrived)
+        yield self.first_event
+        async for line in self._lines:
+            if recorder is not None:
+                recorder.add(line)
+            event = parse_upstream_line(line)
+            if event is not None:
+                yield event
+
+    async def aclose(self) -> None:
+        await self._stack.aclose()
+
+
+async def _open_attempt(
+    zai_data: Dict[str, Any], access_token: str, metrics: StreamMetrics
+) -> UpstreamStream:
+    """发起一次上游请求并读到首个事件"""
+    params, headers = sign_request(zai_data, access_token)
+    stack = AsyncExitStack()
+    start = time.perf_counter()
+    try:
+        try:
+            response = await stack.enter_async_context(
+                get_http_client().stream(
+                    "POST",
+                    f"{settings.PROXY_URL}/api/chat/completions",
+                    headers=headers,
+                    params=params,
+                    json=zai_data,
+                    timeout=_request_timeout(),
+                )
+            )
+            metrics.upstream_connected(start, response.status_code)
+            report_upstream_status(access_token, response.status_code)
+            observe_server_date(response.headers.get("date"))
+            if response.status_code >= 400:
+                raise UpstreamError(
+                    f"Upstream returned HTTP {response.status_code}",
+                    status_code=response.status_code,
+                    retryable=response.status_code >= 500,
+                )
+            lines = response.aiter_lines()
+            stack.push_async_callback(lines.aclose)
+            head: List[RecordedLine] = []
+            async for line in lines:
+                head.append((time.perf_counter(), line))
+                event = parse_upstream_line(line)
+                if event is not None:
+                    break
+            else:
+                raise UpstreamError("Upstream closed the stream without any event")
+        except httpx.HTTPError as e:
+            metrics.upstream_failed()
+            raise UpstreamError(f"{type(e).__name__}: {e}") from e
+    except BaseException:
+        await stack.aclose()
+        raise
+
+    elapsed = time.perf_counter() - start
+    UPSTREAM_FIRST_EVENT_SECONDS.labels(metrics.model).observe(elapsed)
+    _first_event_samples.append(elapsed)
+    return UpstreamStream(stack, lines, event, start, head)
+
+
+async def _open_with_deadline(
+    zai_data: Dict[str, Any], access_token: str, metrics: StreamMetrics
+) -> UpstreamStream:
+    try:
+        return await asyncio.wait_for(
+            _open_attempt(zai_data, access_token, metrics),
+            timeout=settings.UPSTREAM_TTFB_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        raise UpstreamError(
+            f"No upstream event within {settings.UPSTREAM_TTFB_TIMEOUT}s"
+        ) from None
+
+
+async def _discard(tasks: Iterable["asyncio.Task[UpstreamStream]"]) -> None:
+    """取消落败的尝试；已经打开的流直接关闭"""
+    tasks = list(tasks)
+    for task in tasks:
+        task.cancel()
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, UpstreamStream):
+            await result.aclose()
+
+
+async def _open_hedged(
+    zai_data: Dict[str, Any], access_token: str, metrics: StreamMetrics
+) -> UpstreamStream:
+    delay = hedge_delay()
+    if delay is None:
+        return await _open_with_deadline(zai_data, access_token, metrics)
+
+    primary = asyncio.create_task(_open_with_deadline(zai_data, access_token, metrics))
+    pending = {primary}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return primary.result()
+
+        logger.info(f"No upstream event after {delay:.2f}s, sending hedged request")
+        hedge = asyncio.create_task(_open_with_deadline(zai_data, access_token, metrics))
+        pending.add(hedge)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                winner = "hedge" if task is hedge else "primary"
+                HEDGED_REQUESTS_TOTAL.labels(metrics.model, winner).inc()
+                # 同一轮完成的另一方也已经打开了流，需要一并关闭
+                pending |= done - {task}
+                return task.result()
+        raise error
+    finally:
+        if pending:
+            await _discard(pending)
+
+
+async def open_upstream_stream(
+    zai_data: Dict[str, Any], access_token: str, metrics: StreamMetrics
+) -> UpstreamStream:
+    """
+    打开上游流，在首个事件到达前按需重试与对冲
+
+    Raises:
+        UpstreamError: 所有尝试都失败，或遇到不可重试的错误（如 4xx）
+    """
+    attempts = max(1, settings.UPSTREAM_MAX_RETRIES + 1)
+    attempt = 0
+    while True:
+        try:
+            return await _open_hedged(zai_data, access_token, metrics)
+        except UpstreamError as e:
+            attempt += 1
+            if not e.retryable or attempt >= attempts:
+                raise
+            reason = str(e.status_code) if e.status_code else "transport"
+            UPSTREAM_RETRIES_TOTAL.labels(metrics.model, reason).inc()
+            logger.warning(f"Upstream attempt {attempt}/{attempts} failed, retrying: {e}")
+        await asyncio.sleep(_backoff(attempt))
+
+
+@asynccontextmanager
+async def upstream_events(
+    zai_data: Dict[str, Any], access_token: str, metrics: StreamMetrics
+) -> AsyncIterator[AsyncIterator[UpstreamEvent]]:
+    """
+    打开上游流并产出解析后的事件，退出时关闭上游连接
+
+    用法:
+        async with upstream_events(zai_data, token, metrics) as events:
+            async for event in events:
+                ...
+    """
+    if settings.REPLAY_FILE:
+        yield replay_events()
+        return
+
+    stream = await open_upstream_stream(zai_data, access_token, metrics)
+    recorder = maybe_recorder(metrics.model, stream.started)
+    try:
+        yield stream.events(recorder)
+    finally:
+        await stream.aclose()
+        if recorder is not None:
+            await recorder.save()
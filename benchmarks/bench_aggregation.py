@@ -0,0 +1,82 @@
+"""
+非流式聚合基准
+
+在约 5 万 token 的转录上对比旧的 full_response += content 循环
+与 api.stream_translator.CompletionAggregator 的耗时和峰值内存。
+
+用法:
+    python -m benchmarks.bench_aggregation [--transcript FILE] [--chunks 50000]
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from api.stream_translator import CompletionAggregator, parse_upstream_line
+from benchmarks.transcripts import load_transcript, synthesize_transcript
+
+
+def legacy_aggregate(lines):
+    """旧版 process_non_streaming_response 循环体的等价实现"""
+    full_response = ""
+    usage = {}
+    for line in lines:
+        if line.startswith("data:"):
+            json_object = json.loads(line[6:])
+            if json_object.get("data", {}).get("phase") == "answer":
+                if json_object.get("data").get("delta_content"):
+                    content = json_object.get("data").get("delta_content")
+                else:
+                    content = ""
+                full_response += content
+            elif json_object.get("data", {}).get("phase") == "other":
+                usage = json_object.get("data").get("usage", {})
+                content = json_object.get("data").get("delta_content", "")
+                full_response += content
+    return {"content": full_response, "usage": usage}
+
+
+def aggregate(lines):
+    aggregator = CompletionAggregator()
+    for line in lines:
+        event = parse_upstream_line(line)
+        if event is None:
+            continue
+        aggregator.feed(event)
+        if aggregator.done:
+            break
+    return aggregator.build("glm-4.6")
+
+
+def measure(name, fn, lines, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn(lines)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn(lines)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<11} {best * 1000:9.2f} ms  peak {peak / 1024 / 1024:8.2f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transcript", help="录制的上游转录文件，不指定则合成")
+    parser.add_argument("--chunks", type=int, default=50000, help="合成转录的 answer chunk 数")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.transcript:
+        lines = load_transcript(args.transcript)
+    else:
+        lines = synthesize_transcript(thinking_chunks=0, answer_chunks=args.chunks)
+    print(f"upstream lines: {len(lines)}")
+    measure("legacy +=", legacy_aggregate, lines, args.rounds)
+    measure("aggregator", aggregate, lines, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
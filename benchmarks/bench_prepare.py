@@ -0,0 +1,142 @@
+"""
+请求骨架构建微基准
+
+对比旧的 模型列表遍历校验 + getfeatures 逐个 if 判断 + MODELS_MAPPING 查找 + 4 次 uuid.uuid4()
+与 api.model_registry 预编译模板 + 集合校验 + uuid4_str 的单次请求开销（不含消息转换、图片上传）。
+运行前会先校验两种实现对所有模型、两种模式生成的请求体完全一致。
+
+用法:
+    python -m benchmarks.bench_prepare [--iterations N] [--rounds N]
+"""
+import argparse
+import json
+import time
+import uuid
+
+from api.config import get_settings
+from api.ids import uuid4_str
+from api.model_registry import get_model_registry
+
+_LEGACY_MODELS_MAPPING = {
+    "glm-4.6": "GLM-4-6-API-V1",
+    "glm-4.6-nothinking": "GLM-4-6-API-V1",
+    "glm-4.6-search": "GLM-4-6-API-V1",
+    "glm-4.6-advanced-search": "GLM-4-6-API-V1",
+    "glm-4.5V": "glm-4.5v",
+    "glm-4.5": "0727-360B-API",
+}
+
+
+def legacy_getfeatures(model, streaming):
+    """旧版 chat_service.getfeatures"""
+    dict = {}
+    if streaming:
+        features = {
+            "image_generation": False,
+            "web_search": False,
+            "auto_web_search": False,
+            "preview_mode": False,
+            "flags": [],
+            "enable_thinking": True,
+        }
+
+        mcp_servers = []
+        if model in ["glm-4.6-search", "glm-4.6-advanced-search"]:
+            features["web_search"] = True
+            features["auto_web_search"] = True
+            features["preview_mode"] = True
+        if model == "glm-4.6-nothinking":
+            features["enable_thinking"] = False
+        if model == "glm-4.6-advanced-search":
+            mcp_servers = [
+                "advanced-search",
+            ]
+
+        dict["features"] = features
+        dict["mcp_servers"] = mcp_servers
+    else:
+        features = {
+            "image_generation": False,
+            "web_search": False,
+            "auto_web_search": False,
+            "preview_mode": False,
+            "flags": [],
+            "enable_thinking": False,
+        }
+        mcp_servers = []
+        dict["features"] = features
+        dict["mcp_servers"] = mcp_servers
+    return dict
+
+
+def legacy_prepare(model, streaming, allowed_models):
+    if model not in [m["id"] for m in allowed_models]:
+        raise ValueError(model)
+    zai_data = {
+        "stream": True,
+        "model": _LEGACY_MODELS_MAPPING.get(model),
+        "messages": [],
+        "chat_id": str(uuid.uuid4()),
+        "id": str(uuid.uuid4()),
+    }
+    features_dict = legacy_getfeatures(model, streaming)
+    zai_data["features"] = features_dict["features"]
+    if len(features_dict["mcp_servers"]) > 0:
+        zai_data["mcp_servers"] = features_dict["mcp_servers"]
+    params = {"requestId": str(uuid.uuid4()), "user_id": str(uuid.uuid4())}
+    return zai_data, params
+
+
+def registry_prepare(model, streaming, registry):
+    if model not in registry:
+        raise ValueError(model)
+    zai_data = registry.template(model, streaming).payload()
+    zai_data["messages"] = []
+    zai_data["chat_id"] = uuid4_str()
+    zai_data["id"] = uuid4_str()
+    params = {"requestId": uuid4_str(), "user_id": uuid4_str()}
+    return zai_data, params
+
+
+def check_equivalent(registry, allowed_models):
+    """忽略随机 id 后，两种实现序列化出的请求体必须一致"""
+    for model in _LEGACY_MODELS_MAPPING:
+        for streaming in (True, False):
+            legacy, _ = legacy_prepare(model, streaming, allowed_models)
+            fast, _ = registry_prepare(model, streaming, registry)
+            for data in (legacy, fast):
+                data.pop("chat_id")
+                data.pop("id")
+            if json.dumps(legacy, sort_keys=True) != json.dumps(fast, sort_keys=True):
+                raise AssertionError(f"payload mismatch for {model} (stream={streaming})")
+
+
+def run(name, fn, state, models, iterations, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for i in range(iterations):
+            fn(models[i % len(models)], i & 1 == 0, state)
+        best = min(best, time.perf_counter() - start)
+    per_call = best / iterations * 1e6
+    print(f"{name:<8} {per_call:8.2f} us/request")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    registry = get_model_registry()
+    allowed_models = list(registry.public_models)
+    check_equivalent(registry, allowed_models)
+    models = [m["id"] for m in get_settings().MODELS]
+    legacy = run("legacy", legacy_prepare, allowed_models, models, args.iterations, args.rounds)
+    fast = run("registry", registry_prepare, registry, models, args.iterations, args.rounds)
+    print(f"speedup: {legacy / fast:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
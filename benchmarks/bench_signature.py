@@ -0,0 +1,87 @@
+"""
+签名微基准
+
+对比旧版 generate_signature（每次重算窗口密钥、拼接完整消息串后再编码）
+与 api.signature_generator 当前实现在不同提示词大小下的 signatures/sec，
+并先校验两者在相同时间戳下生成的签名一致。
+
+用法:
+    python -m benchmarks.bench_signature [--sizes 100,10000,1000000,8000000] [--seconds 1]
+"""
+import argparse
+import hashlib
+import hmac
+import time
+
+from api.signature_generator import WINDOW_MS, generate_signature
+
+E_VALUE = (
+    "requestId,7c30e6d9-e1fc-4970-9fc6-e27363415dda,timestamp,1759746406495,"
+    "user_id,21ea9ec3-e492-4dbb-b522-fc0eaf64f0f6"
+)
+
+
+def legacy_signature(e, t, timestamp_ms):
+    """旧版 generate_signature，时间戳改为参数传入以便比对"""
+    message_string = f"{e}|{t}|{timestamp_ms}"
+    n = timestamp_ms // WINDOW_MS
+    intermediate_key = hmac.new(
+        "junjie".encode("utf-8"), str(n).encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+    final_signature = hmac.new(
+        intermediate_key.encode("utf-8"), message_string.encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+    return {"signature": final_signature, "timestamp": timestamp_ms}
+
+
+def make_prompt(size):
+    # 混入多字节字符，覆盖 UTF-8 分片编码
+    unit = "写一个 hello world 程序。"
+    return (unit * (size // len(unit) + 1))[:size]
+
+
+def check_equivalent(prompts):
+    now = int(time.time() * 1000)
+    # 包含窗口边界前后的时间戳
+    boundary = (now // WINDOW_MS + 1) * WINDOW_MS
+    for timestamp_ms in (now, boundary - 1, boundary, boundary + 1):
+        for prompt in prompts:
+            expected = legacy_signature(E_VALUE, prompt, timestamp_ms)
+            if generate_signature(E_VALUE, prompt, timestamp_ms) != expected:
+                raise AssertionError(f"signature mismatch (len={len(prompt)}, ts={timestamp_ms})")
+            if generate_signature(E_VALUE, prompt.encode("utf-8"), timestamp_ms) != expected:
+                raise AssertionError(f"bytes signature mismatch (len={len(prompt)})")
+
+
+def rate(fn, prompt, seconds):
+    timestamp_ms = int(time.time() * 1000)
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while True:
+        fn(E_VALUE, prompt, timestamp_ms)
+        count += 1
+        now = time.perf_counter()
+        if now >= deadline:
+            return count / (now - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,10000,1000000,8000000", help="提示词字符数，逗号分隔")
+    parser.add_argument("--seconds", type=float, default=1.0, help="每项测量时长")
+    args = parser.parse_args()
+
+    prompts = [make_prompt(int(size)) for size in args.sizes.split(",")]
+    check_equivalent(prompts)
+    print(f"{'chars':>10} {'legacy/s':>12} {'str/s':>12} {'bytes/s':>12} {'speedup':>8}")
+    for prompt in prompts:
+        encoded = prompt.encode("utf-8")
+        legacy = rate(legacy_signature, prompt, args.seconds)
+        fast = rate(generate_signature, prompt, args.seconds)
+        fast_bytes = rate(generate_signature, encoded, args.seconds)
+        print(f"{len(prompt):>10} {legacy:>12.0f} {fast:>12.0f} {fast_bytes:>12.0f} {fast / legacy:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+SSE 翻译微基准
+
+对比旧的逐行 json.loads + 多次 dict.get + 每 chunk 生成 uuid 的实现
+与 api.stream_translator 的吞吐（chunks/sec）。
+
+用法:
+    python -m benchmarks.bench_translator [--transcript FILE] [--rounds N]
+"""
+import argparse
+import json
+import time
+import uuid
+
+from api import json_codec
+from api.stream_translator import OpenAIStreamTranslator, parse_upstream_line
+from benchmarks.transcripts import load_transcript, synthesize_transcript
+
+
+def _legacy_chunk(content, model, timestamp, phase, usage=None, finish_reason=None):
+    if phase == "thinking":
+        delta = {"reasoning_content": content, "role": "assistant"}
+    else:
+        delta = {"content": content, "role": "assistant"}
+    return {
+        "id": f"chatcmpl-{uuid.uuid4()}",
+        "object": "chat.completion.chunk",
+        "created": timestamp,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        "usage": usage,
+    }
+
+
+def legacy_translate(lines, model, timestamp):
+    """旧版 process_streaming_response 循环体的等价实现"""
+    out = []
+    for line in lines:
+        if not line.startswith("data:"):
+            continue
+        json_object = json.loads(line[6:])
+        phase = json_object.get("data", {}).get("phase")
+        if phase == "thinking":
+            content = json_object.get("data").get("delta_content", "")
+            if "</summary>\n" in content:
+                content = content.split("</summary>\n")[-1]
+            out.append(f"data: {json.dumps(_legacy_chunk(content, model, timestamp, 'thinking'))}\n\n")
+        elif phase == "answer":
+            edit = json_object.get("data").get("edit_content")
+            if edit and "</summary>\n" in edit:
+                content = edit.split("</details>")[-1]
+            else:
+                content = json_object.get("data").get("delta_content", "")
+            out.append(f"data: {json.dumps(_legacy_chunk(content, model, timestamp, 'answer'))}\n\n")
+        elif phase == "other":
+            usage = json_object.get("data").get("usage", {})
+            content = json_object.get("data").get("delta_content", "")
+            out.append(f"data: {json.dumps(_legacy_chunk(content, model, timestamp, 'other', usage, 'stop'))}\n\n")
+        elif phase == "done":
+            out.append("data: [DONE]\n\n")
+            break
+    return out
+
+
+def fast_translate(lines, model, timestamp):
+    translator = OpenAIStreamTranslator(model, timestamp)
+    out = []
+    for line in lines:
+        event = parse_upstream_line(line)
+        if event is None:
+            continue
+        chunk = translator.translate(event)
+        if chunk is not None:
+            out.append(chunk)
+        if event.phase == "done":
+            break
+    return out
+
+
+def run(name, fn, lines, rounds):
+    best = float("inf")
+    chunks = 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        chunks = len(fn(lines, "glm-4.6", int(time.time())))
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<8} {chunks:>7} chunks  {best * 1000:8.2f} ms  {chunks / best:12.0f} chunks/sec")
+    return chunks / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transcript", help="录制的上游转录文件，不指定则合成")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    lines = load_transcript(args.transcript) if args.transcript else synthesize_transcript()
+    print(f"json backend: {json_codec.BACKEND}, upstream lines: {len(lines)}")
+    legacy = run("legacy", legacy_translate, lines, args.rounds)
+    fast = run("fast", fast_translate, lines, args.rounds)
+    print(f"speedup: {fast / legacy:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
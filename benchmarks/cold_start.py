@@ -0,0 +1,178 @@
+"""
+冷启动测量
+
+serve（默认）：启动 benchmarks.mock_upstream，然后多次以 `python main.py` 冷启动代理，
+测量从创建进程到首个 /health 200、到首个 chat completion 返回的耗时，输出中位数与最小值。
+设置 --target-health-ms / --target-completion-ms 后，中位数超出目标时以非 0 状态退出，可用于 CI。
+
+imports：以 `python -X importtime` 导入 api.app，按累计耗时与自身耗时列出最慢的模块，
+用于定位拖慢冷启动的导入。
+
+用法:
+    python -m benchmarks.cold_start --runs 5 --target-health-ms 1500 --target-completion-ms 2000
+    python -m benchmarks.cold_start --no-prewarm
+    python -m benchmarks.cold_start imports --top 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from statistics import median
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.load_test import _free_port, _spawn, _wait_for
+
+
+def profile_imports(module: str) -> List[Tuple[str, int, int]]:
+    """
+    Returns:
+        [(模块名, 自身耗时 us, 累计耗时 us)]
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env={**os.environ, "LOG_LEVEL": "WARNING"},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def print_import_profile(module: str, top: int) -> None:
+    rows = profile_imports(module)
+    total = next((cumulative for name, _, cumulative in rows if name == module), 0)
+    print(f"import {module}: {total / 1000:.1f} ms total\n")
+
+    print(f"top {top} by cumulative time")
+    for name, _, cumulative in sorted(rows, key=lambda row: -row[2])[:top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    print(f"\ntop {top} by self time")
+    for name, self_us, _ in sorted(rows, key=lambda row: -row[1])[:top]:
+        print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+    own = sorted((row for row in rows if row[0].split(".")[0] == "api"), key=lambda row: -row[1])
+    print(f"\napi modules (self time, {sum(row[1] for row in own) / 1000:.1f} ms total)")
+    for name, self_us, _ in own:
+        print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+
+def _poll_health(url: str, deadline: float) -> None:
+    while time.perf_counter() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.005)
+    raise TimeoutError(f"{url} did not become healthy")
+
+
+def measure_once(mock_url: str, model: str, prewarm: bool) -> Dict[str, float]:
+    port = _free_port()
+    env = dict(os.environ)
+    env.update(
+        {
+            "PROXY_URL": mock_url,
+            "HOST": "127.0.0.1",
+            "PORT": str(port),
+            "WORKERS": "1",
+            "DEBUG": "False",
+            "LOG_LEVEL": "WARNING",
+        }
+    )
+    if not prewarm:
+        env["UPSTREAM_PREWARM_CONNECTIONS"] = "0"
+    proxy_url = f"http://127.0.0.1:{port}"
+
+    start = time.perf_counter()
+    process = _spawn(["main.py"], env)
+    try:
+        _poll_health(f"{proxy_url}/health", start + 30)
+        health = time.perf_counter()
+        response = httpx.post(
+            f"{proxy_url}/v1/chat/completions",
+            json={"model": model, "stream": False, "messages": [{"role": "user", "content": "hi"}]},
+            headers={"Authorization": "Bearer cold-start"},
+            timeout=30,
+        )
+        response.raise_for_status()
+        completion = time.perf_counter()
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return {
+        "health_ms": (health - start) * 1000,
+        "completion_ms": (completion - start) * 1000,
+        "first_request_ms": (completion - health) * 1000,
+    }
+
+
+def run_serve(args: argparse.Namespace) -> int:
+    mock_port = _free_port()
+    mock = _spawn(
+        ["-m", "benchmarks.mock_upstream", "--port", str(mock_port), "--answer-chunks", "20", "--thinking-chunks", "0"],
+        dict(os.environ),
+    )
+    try:
+        _wait_for(f"http://127.0.0.1:{mock_port}/docs")
+        runs = [
+            measure_once(f"http://127.0.0.1:{mock_port}", args.model, not args.no_prewarm)
+            for _ in range(args.runs)
+        ]
+    finally:
+        mock.terminate()
+        mock.wait(timeout=10)
+
+    print(f"{args.runs} cold starts (prewarm={'off' if args.no_prewarm else 'on'})")
+    for key in ("health_ms", "completion_ms", "first_request_ms"):
+        values = [run[key] for run in runs]
+        print(f"  {key:<17} median {median(values):8.1f}   min {min(values):8.1f}")
+
+    failed = False
+    targets: List[Tuple[str, Optional[float]]] = [
+        ("health_ms", args.target_health_ms),
+        ("completion_ms", args.target_completion_ms),
+    ]
+    for key, target in targets:
+        if target is not None and median(run[key] for run in runs) > target:
+            print(f"  {key} exceeds target {target} ms")
+            failed = True
+    return 1 if failed else 0
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", nargs="?", choices=("serve", "imports"), default="serve")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--model", default="glm-4.6")
+    parser.add_argument("--no-prewarm", action="store_true", help="关闭启动时的上游连接预热")
+    parser.add_argument("--target-health-ms", type=float)
+    parser.add_argument("--target-completion-ms", type=float)
+    parser.add_argument("--module", default="api.app", help="imports 模式下导入的模块")
+    parser.add_argument("--top", type=int, default=15)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.mode == "imports":
+        print_import_profile(args.module, args.top)
+        return
+    sys.exit(run_serve(args))
+
+
+if __name__ == "__main__":
+    main()
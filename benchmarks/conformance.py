@@ -0,0 +1,417 @@
+"""
+协议一致性检查
+
+在子进程中启动 benchmarks.mock_upstream 与指向它的代理，对 /v1/messages（Anthropic Messages）、
+/v1/responses（OpenAI Responses）与 /v1/chat/completions 发送流式与非流式、带与不带工具的请求，
+校验事件名称与顺序、内容块/输出项的生命周期、增量拼接结果与最终响应的一致性。
+任一检查失败时以非零状态退出。
+
+用法:
+    python -m benchmarks.conformance
+    python -m benchmarks.conformance --proxy-url http://127.0.0.1:8001 --token sk-xxx
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.load_test import _free_port, _spawn, _wait_for
+
+# (事件名, 数据)
+SSEEvent = Tuple[Optional[str], Any]
+
+WEATHER_TOOL = {
+    "name": "get_weather",
+    "description": "Get the weather for a city",
+    "parameters": {"type": "object", "properties": {"query": {"type": "string"}}},
+}
+
+
+def _parse_sse(lines) -> List[SSEEvent]:
+    events: List[SSEEvent] = []
+    name: Optional[str] = None
+    data: List[str] = []
+    for line in lines:
+        if line == "":
+            if data:
+                payload = "\n".join(data)
+                events.append((name, payload if payload == "[DONE]" else json.loads(payload)))
+            name, data = None, []
+        elif line.startswith("event:"):
+            name = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+    if data:
+        payload = "\n".join(data)
+        events.append((name, payload if payload == "[DONE]" else json.loads(payload)))
+    return events
+
+
+def _check(condition: bool, message: str) -> None:
+    if not condition:
+        raise AssertionError(message)
+
+
+class Conformance:
+    def __init__(self, client: httpx.Client, model: str):
+        self.client = client
+        self.model = model
+
+    def _stream(self, path: str, body: dict) -> List[SSEEvent]:
+        with self.client.stream("POST", path, json={**body, "stream": True}) as response:
+            _check(response.status_code == 200, f"status {response.status_code}: {response.read()[:200]!r}")
+            _check(
+                response.headers.get("content-type", "").startswith("text/event-stream"),
+                f"content-type {response.headers.get('content-type')}",
+            )
+            return _parse_sse(response.iter_lines())
+
+    def _post(self, path: str, body: dict) -> httpx.Response:
+        return self.client.post(path, json={**body, "stream": False})
+
+    # ---------------- Anthropic Messages ----------------
+
+    def _anthropic_body(self, tools: bool = False, thinking: bool = False) -> dict:
+        body: Dict[str, Any] = {
+            "model": self.model,
+            "max_tokens": 256,
+            "system": "You are terse.",
+            "messages": [{"role": "user", "content": [{"type": "text", "text": "weather in Paris?"}]}],
+        }
+        if tools:
+            body["tools"] = [
+                {
+                    "name": WEATHER_TOOL["name"],
+                    "description": WEATHER_TOOL["description"],
+                    "input_schema": WEATHER_TOOL["parameters"],
+                }
+            ]
+        if thinking:
+            body["thinking"] = {"type": "enabled", "budget_tokens": 1024}
+        return body
+
+    def _check_anthropic_stream(self, events: List[SSEEvent]) -> Dict[str, Any]:
+        """校验事件顺序与内容块生命周期，返回按块拼接后的内容与 stop_reason"""
+        for name, data in events:
+            _check(name == data.get("type"), f"event name {name} != data.type {data.get('type')}")
+        types = [name for name, _ in events]
+        _check(types[0] == "message_start", f"first event is {types[0]}")
+        _check(types[-2:] == ["message_delta", "message_stop"], f"last events are {types[-2:]}")
+        _check(types.count("message_start") == 1 and types.count("message_stop") == 1, "duplicate message events")
+        message = events[0][1]["message"]
+        _check(message["role"] == "assistant" and message["content"] == [], "message_start.message shape")
+
+        expected_delta = {"text": "text_delta", "thinking": "thinking_delta", "tool_use": "input_json_delta"}
+        blocks: List[Dict[str, Any]] = []
+        open_index: Optional[int] = None
+        for name, data in events[1:-2]:
+            if name == "content_block_start":
+                _check(open_index is None, f"block {data['index']} started while {open_index} is open")
+                _check(data["index"] == len(blocks), f"block index {data['index']} != {len(blocks)}")
+                block = dict(data["content_block"])
+                block["_deltas"] = []
+                blocks.append(block)
+                open_index = data["index"]
+            elif name == "content_block_delta":
+                _check(data["index"] == open_index, f"delta for block {data['index']}, open is {open_index}")
+                block = blocks[data["index"]]
+                _check(
+                    data["delta"]["type"] == expected_delta[block["type"]],
+                    f"{data['delta']['type']} in {block['type']} block",
+                )
+                delta = data["delta"]
+                block["_deltas"].append(delta.get("text") or delta.get("thinking") or delta.get("partial_json") or "")
+            elif name == "content_block_stop":
+                _check(data["index"] == open_index, f"stop for block {data['index']}, open is {open_index}")
+                open_index = None
+            elif name != "ping":
+                raise AssertionError(f"unexpected event {name} inside message")
+        _check(open_index is None, f"block {open_index} never stopped")
+
+        final = events[-2][1]
+        _check(isinstance(final["usage"].get("output_tokens"), int), "message_delta.usage.output_tokens")
+        for block in blocks:
+            block["_joined"] = "".join(block.pop("_deltas"))
+            if block["type"] == "tool_use":
+                block["input"] = json.loads(block["_joined"])
+        return {"blocks": blocks, "stop_reason": final["delta"]["stop_reason"]}
+
+    def anthropic_stream_text(self) -> None:
+        result = self._check_anthropic_stream(self._stream("/v1/messages", self._anthropic_body()))
+        types = [block["type"] for block in result["blocks"]]
+        _check(types == ["text"], f"blocks {types}")
+        _check(result["blocks"][0]["_joined"], "empty text")
+        _check(result["stop_reason"] == "end_turn", f"stop_reason {result['stop_reason']}")
+
+    def anthropic_stream_thinking(self) -> None:
+        body = self._anthropic_body(thinking=True)
+        result = self._check_anthropic_stream(self._stream("/v1/messages", body))
+        types = [block["type"] for block in result["blocks"]]
+        _check(types == ["thinking", "text"], f"blocks {types}")
+        _check("signature" in result["blocks"][0], "thinking block without signature")
+
+    def anthropic_stream_tools(self) -> None:
+        result = self._check_anthropic_stream(self._stream("/v1/messages", self._anthropic_body(tools=True)))
+        tool_blocks = [block for block in result["blocks"] if block["type"] == "tool_use"]
+        _check(len(tool_blocks) == 1, f"{len(tool_blocks)} tool_use blocks")
+        _check(tool_blocks[0]["name"] == WEATHER_TOOL["name"], f"tool name {tool_blocks[0]['name']}")
+        _check(tool_blocks[0]["id"], "tool_use without id")
+        _check(isinstance(tool_blocks[0]["input"], dict), "tool input is not an object")
+        _check(result["stop_reason"] == "tool_use", f"stop_reason {result['stop_reason']}")
+
+    def anthropic_tool_result_turn(self) -> None:
+        body = self._anthropic_body(tools=True)
+        body["messages"] += [
+            {
+                "role": "assistant",
+                "content": [{"type": "tool_use", "id": "toolu_1", "name": "get_weather", "input": {"query": "Paris"}}],
+            },
+            {
+                "role": "user",
+                "content": [{"type": "tool_result", "tool_use_id": "toolu_1", "content": "sunny"}],
+            },
+        ]
+        result = self._check_anthropic_stream(self._stream("/v1/messages", body))
+        _check(result["stop_reason"] == "end_turn", f"stop_reason {result['stop_reason']}")
+
+    def anthropic_non_stream(self) -> None:
+        response = self._post("/v1/messages", self._anthropic_body(tools=True, thinking=True))
+        _check(response.status_code == 200, f"status {response.status_code}: {response.text[:200]}")
+        message = response.json()
+        _check(message["type"] == "message" and message["role"] == "assistant", "message shape")
+        # 非流式请求的上游模板关闭了思考，不会有 thinking 块
+        types = [block["type"] for block in message["content"]]
+        _check(types == ["text", "tool_use"], f"blocks {types}")
+        _check(isinstance(message["content"][1]["input"], dict), "tool input is not an object")
+        _check(message["stop_reason"] == "tool_use", f"stop_reason {message['stop_reason']}")
+        _check(set(message["usage"]) >= {"input_tokens", "output_tokens"}, f"usage {message['usage']}")
+
+    def anthropic_error(self) -> None:
+        response = self._post("/v1/messages", {**self._anthropic_body(), "model": "no-such-model"})
+        _check(response.status_code == 400, f"status {response.status_code}")
+        body = response.json()
+        _check(body.get("type") == "error" and body["error"]["type"] == "invalid_request_error", f"body {body}")
+
+    # ---------------- OpenAI Responses ----------------
+
+    def _responses_body(self, tools: bool = False, reasoning: bool = False) -> dict:
+        body: Dict[str, Any] = {
+            "model": self.model,
+            "instructions": "You are terse.",
+            "input": [{"role": "user", "content": [{"type": "input_text", "text": "weather in Paris?"}]}],
+        }
+        if tools:
+            body["tools"] = [{"type": "function", **WEATHER_TOOL}]
+        if reasoning:
+            body["reasoning"] = {"effort": "medium", "summary": "auto"}
+        return body
+
+    def _check_responses_stream(self, events: List[SSEEvent]) -> Dict[str, Any]:
+        """校验序号、事件顺序与输出项生命周期，返回最终的 response 对象"""
+        for position, (name, data) in enumerate(events):
+            _check(name == data.get("type"), f"event name {name} != data.type {data.get('type')}")
+            _check(data.get("sequence_number") == position, f"sequence_number {data.get('sequence_number')} at {position}")
+        types = [name for name, _ in events]
+        _check(types[:2] == ["response.created", "response.in_progress"], f"first events {types[:2]}")
+        _check(types[-1] == "response.completed", f"last event {types[-1]}")
+        response_id = events[0][1]["response"]["id"]
+
+        items: List[Dict[str, Any]] = []
+        open_item: Optional[Dict[str, Any]] = None
+        for name, data in events[2:-1]:
+            if name == "response.output_item.added":
+                _check(open_item is None, "item added while another is open")
+                _check(data["output_index"] == len(items), f"output_index {data['output_index']} != {len(items)}")
+                open_item = {"item": data["item"], "deltas": [], "done": None}
+                items.append(open_item)
+                continue
+            _check(open_item is not None, f"{name} outside of an output item")
+            if "item_id" in data:
+                _check(data["item_id"] == open_item["item"]["id"], f"{name} for item {data['item_id']}")
+            if name in (
+                "response.output_text.delta",
+                "response.reasoning_summary_text.delta",
+                "response.function_call_arguments.delta",
+            ):
+                open_item["deltas"].append(data["delta"])
+            elif name in ("response.output_text.done", "response.reasoning_summary_text.done"):
+                _check(data["text"] == "".join(open_item["deltas"]), f"{name} text differs from deltas")
+            elif name == "response.function_call_arguments.done":
+                _check(data["arguments"] == "".join(open_item["deltas"]), "arguments differ from deltas")
+            elif name == "response.output_item.done":
+                open_item["done"] = data["item"]
+                open_item = None
+        _check(open_item is None, "output item never completed")
+
+        response = events[-1][1]["response"]
+        _check(response["id"] == response_id and response["status"] == "completed", "response.completed shape")
+        _check(response["output"] == [item["done"] for item in items], "response.output differs from done items")
+        usage = response["usage"]
+        _check(usage["total_tokens"] == usage["input_tokens"] + usage["output_tokens"], f"usage {usage}")
+        return response
+
+    def responses_stream_text(self) -> None:
+        response = self._check_responses_stream(self._stream("/v1/responses", self._responses_body()))
+        types = [item["type"] for item in response["output"]]
+        _check(types == ["message"], f"output {types}")
+        _check(response["output"][0]["content"][0]["text"], "empty output_text")
+
+    def responses_stream_reasoning(self) -> None:
+        body = self._responses_body(reasoning=True)
+        response = self._check_responses_stream(self._stream("/v1/responses", body))
+        types = [item["type"] for item in response["output"]]
+        _check(types == ["reasoning", "message"], f"output {types}")
+
+    def responses_stream_tools(self) -> None:
+        response = self._check_responses_stream(self._stream("/v1/responses", self._responses_body(tools=True)))
+        calls = [item for item in response["output"] if item["type"] == "function_call"]
+        _check(len(calls) == 1, f"{len(calls)} function_call items")
+        _check(calls[0]["name"] == WEATHER_TOOL["name"] and calls[0]["call_id"], f"call {calls[0]}")
+        _check(isinstance(json.loads(calls[0]["arguments"]), dict), "arguments are not a JSON object")
+
+    def responses_tool_output_turn(self) -> None:
+        body = self._responses_body(tools=True)
+        body["input"] += [
+            {"type": "function_call", "call_id": "call_1", "name": "get_weather", "arguments": '{"query":"Paris"}'},
+            {"type": "function_call_output", "call_id": "call_1", "output": "sunny"},
+        ]
+        response = self._check_responses_stream(self._stream("/v1/responses", body))
+        types = [item["type"] for item in response["output"]]
+        _check(types == ["message"], f"output {types}")
+
+    def responses_non_stream(self) -> None:
+        response = self._post("/v1/responses", self._responses_body(tools=True, reasoning=True))
+        _check(response.status_code == 200, f"status {response.status_code}: {response.text[:200]}")
+        body = response.json()
+        _check(body["object"] == "response" and body["status"] == "completed", "response shape")
+        # 非流式请求的上游模板关闭了思考，不会有 reasoning 项
+        types = [item["type"] for item in body["output"]]
+        _check(types == ["message", "function_call"], f"output {types}")
+        _check(set(body["usage"]) >= {"input_tokens", "output_tokens", "total_tokens"}, f"usage {body['usage']}")
+
+    def responses_error(self) -> None:
+        response = self._post("/v1/responses", {**self._responses_body(), "model": "no-such-model"})
+        _check(response.status_code == 400, f"status {response.status_code}")
+        _check("message" in response.json().get("error", {}), f"body {response.text[:200]}")
+
+    # ---------------- OpenAI Chat Completions ----------------
+
+    def chat_stream_tools(self) -> None:
+        body = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": "weather in Paris?"}],
+            "tools": [{"type": "function", "function": WEATHER_TOOL}],
+        }
+        events = self._stream("/v1/chat/completions", body)
+        _check(events[-1][1] == "[DONE]", "stream does not end with [DONE]")
+        chunks = [data for _, data in events[:-1]]
+        finish = [c["choices"][0]["finish_reason"] for c in chunks if c["choices"][0].get("finish_reason")]
+        _check(finish == ["tool_calls"], f"finish_reason {finish}")
+        arguments = "".join(
+            call["function"].get("arguments", "")
+            for c in chunks
+            for call in c["choices"][0]["delta"].get("tool_calls") or ()
+        )
+        _check(isinstance(json.loads(arguments), dict), "arguments are not a JSON object")
+
+    def cases(self) -> List[Tuple[str, Callable[[], None]]]:
+        return [
+            ("messages: stream text", self.anthropic_stream_text),
+            ("messages: stream thinking", self.anthropic_stream_thinking),
+            ("messages: stream tool_use", self.anthropic_stream_tools),
+            ("messages: tool_result turn", self.anthropic_tool_result_turn),
+            ("messages: non-stream", self.anthropic_non_stream),
+            ("messages: error body", self.anthropic_error),
+            ("responses: stream text", self.responses_stream_text),
+            ("responses: stream reasoning", self.responses_stream_reasoning),
+            ("responses: stream function_call", self.responses_stream_tools),
+            ("responses: function_call_output turn", self.responses_tool_output_turn),
+            ("responses: non-stream", self.responses_non_stream),
+            ("responses: error body", self.responses_error),
+            ("chat.completions: stream tool_calls", self.chat_stream_tools),
+        ]
+
+
+def run(proxy_url: str, token: str, model: str, verbose: bool) -> int:
+    failed = 0
+    with httpx.Client(base_url=proxy_url, headers={"Authorization": f"Bearer {token}"}, timeout=30) as client:
+        suite = Conformance(client, model)
+        for name, case in suite.cases():
+            try:
+                case()
+            except Exception as e:
+                failed += 1
+                print(f"FAIL  {name}: {type(e).__name__}: {e}")
+                if verbose:
+                    traceback.print_exc()
+            else:
+                print(f"PASS  {name}")
+    total = len(suite.cases())
+    print(f"{total - failed}/{total} passed")
+    return 1 if failed else 0
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--proxy-url", help="使用已运行的代理，不启动模拟上游")
+    parser.add_argument("--token", default="conformance")
+    parser.add_argument("--model", default="glm-4.6")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    processes: List[subprocess.Popen] = []
+    proxy_url = args.proxy_url
+    try:
+        if proxy_url is None:
+            env = dict(os.environ)
+            mock_port = _free_port()
+            processes.append(
+                _spawn(
+                    [
+                        "-m", "benchmarks.mock_upstream",
+                        "--port", str(mock_port),
+                        "--thinking-chunks", "5",
+                        "--answer-chunks", "10",
+                    ],
+                    env,
+                )
+            )
+            _wait_for(f"http://127.0.0.1:{mock_port}/docs")
+
+            proxy_port = _free_port()
+            env["PROXY_URL"] = f"http://127.0.0.1:{mock_port}"
+            env.setdefault("LOG_LEVEL", "WARNING")
+            processes.append(
+                _spawn(
+                    [
+                        "-m", "uvicorn", "api.app:app",
+                        "--host", "127.0.0.1",
+                        "--port", str(proxy_port),
+                        "--log-level", "warning",
+                        "--no-access-log",
+                    ],
+                    env,
+                )
+            )
+            proxy_url = f"http://127.0.0.1:{proxy_port}"
+            _wait_for(f"{proxy_url}/health")
+        return run(proxy_url, args.token, args.model, args.verbose)
+    finally:
+        for process in processes:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""
+端到端压测
+
+默认在子进程中启动 benchmarks.mock_upstream 与指向它的代理（uvicorn api.app:app），
+以 N 个并发流请求 /v1/chat/completions，统计 TTFT p50/p99、chunks/sec
+以及代理进程每个流占用的 RSS，结果写入 JSON 文件，便于比对回归。
+
+用法:
+    python -m benchmarks.load_test --concurrency 50 --requests 500 --output bench_results.json
+    python -m benchmarks.load_test --proxy-url http://127.0.0.1:8001 --proxy-pid 1234
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+import httpx
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _rss_bytes(pid: int) -> Optional[int]:
+    """读取进程当前 RSS（仅 Linux /proc），无法读取时返回 None"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _wait_for(url: str, timeout: float = 20.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+def _spawn(args: List[str], env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, *args],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def _run_stream(client: httpx.AsyncClient, payload: dict, token: str) -> dict:
+    start = time.perf_counter()
+    first_chunk = None
+    chunks = 0
+    try:
+        async with client.stream(
+            "POST",
+            "/v1/chat/completions",
+            json=payload,
+            headers={"Authorization": f"Bearer {token}"},
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return {"ok": False, "status": response.status_code}
+            async for line in response.aiter_lines():
+                if not line.startswith("data:") or line == "data: [DONE]":
+                    continue
+                if first_chunk is None:
+                    first_chunk = time.perf_counter()
+                chunks += 1
+    except httpx.HTTPError as e:
+        return {"ok": False, "status": type(e).__name__}
+    end = time.perf_counter()
+    return {
+        "ok": chunks > 0,
+        "status": 200,
+        "ttft": (first_chunk - start) if first_chunk else None,
+        "duration": end - start,
+        "chunks": chunks,
+    }
+
+
+async def _sample_rss(pid: Optional[int], samples: List[int], stop: asyncio.Event) -> None:
+    if pid is None:
+        return
+    while not stop.is_set():
+        rss = _rss_bytes(pid)
+        if rss is not None:
+            samples.append(rss)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=0.05)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_load(
+    proxy_url: str,
+    proxy_pid: Optional[int],
+    concurrency: int,
+    total_requests: int,
+    model: str,
+    token: str,
+) -> dict:
+    payload = {
+        "model": model,
+        "messages": [{"role": "user", "content": "benchmark prompt"}],
+        "stream": True,
+    }
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    baseline_rss = _rss_bytes(proxy_pid) if proxy_pid else None
+    rss_samples: List[int] = []
+    stop = asyncio.Event()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(base_url=proxy_url, limits=limits, timeout=300) as client:
+
+        async def bounded() -> dict:
+            async with semaphore:
+                return await _run_stream(client, payload, token)
+
+        sampler = asyncio.create_task(_sample_rss(proxy_pid, rss_samples, stop))
+        start = time.perf_counter()
+        results = await asyncio.gather(*[bounded() for _ in range(total_requests)])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await sampler
+
+    ok = [r for r in results if r["ok"]]
+    ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+    total_chunks = sum(r["chunks"] for r in ok)
+    errors: dict = {}
+    for r in results:
+        if not r["ok"]:
+            errors[str(r["status"])] = errors.get(str(r["status"]), 0) + 1
+
+    peak_rss = max(rss_samples) if rss_samples else None
+    rss_per_stream = None
+    if peak_rss is not None and baseline_rss is not None:
+        rss_per_stream = max(0, peak_rss - baseline_rss) / concurrency
+
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "succeeded": len(ok),
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "ttft_p50_ms": round(_percentile(ttfts, 50) * 1000, 2) if ttfts else None,
+        "ttft_p99_ms": round(_percentile(ttfts, 99) * 1000, 2) if ttfts else None,
+        "chunks_total": total_chunks,
+        "chunks_per_sec": round(total_chunks / elapsed, 1) if elapsed else None,
+        "requests_per_sec": round(len(ok) / elapsed, 2) if elapsed else None,
+        "proxy_rss_baseline_bytes": baseline_rss,
+        "proxy_rss_peak_bytes": peak_rss,
+        "rss_per_stream_bytes": round(rss_per_stream) if rss_per_stream is not None else None,
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--model", default="glm-4.6")
+    parser.add_argument("--token", default="bench-token")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--proxy-url", help="压测已经运行的代理，不再自动启动子进程")
+    parser.add_argument("--proxy-pid", type=int, help="已运行代理的进程号，用于采样 RSS")
+    mock = parser.add_argument_group("mock upstream（仅自动启动模式）")
+    mock.add_argument("--thinking-chunks", type=int, default=50)
+    mock.add_argument("--answer-chunks", type=int, default=200)
+    mock.add_argument("--tokens-per-sec", type=float, default=0)
+    mock.add_argument("--first-byte-latency", type=float, default=0)
+    mock.add_argument("--error-rate", type=float, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    processes: List[subprocess.Popen] = []
+    proxy_url = args.proxy_url
+    proxy_pid = args.proxy_pid
+    try:
+        if proxy_url is None:
+            env = dict(os.environ)
+            mock_port = _free_port()
+            processes.append(
+                _spawn(
+                    [
+                        "-m", "benchmarks.mock_upstream",
+                        "--port", str(mock_port),
+                        "--thinking-chunks", str(args.thinking_chunks),
+                        "--answer-chunks", str(args.answer_chunks),
+                        "--tokens-per-sec", str(args.tokens_per_sec),
+                        "--first-byte-latency", str(args.first_byte_latency),
+                        "--error-rate", str(args.error_rate),
+                    ],
+                    env,
+                )
+            )
+            _wait_for(f"http://127.0.0.1:{mock_port}/docs")
+
+            proxy_port = _free_port()
+            env["PROXY_URL"] = f"http://127.0.0.1:{mock_port}"
+            env.setdefault("LOG_LEVEL", "WARNING")
+            proxy = _spawn(
+                [
+                    "-m", "uvicorn", "api.app:app",
+                    "--host", "127.0.0.1",
+                    "--port", str(proxy_port),
+                    "--log-level", "warning",
+                    "--no-access-log",
+                ],
+                env,
+            )
+            processes.append(proxy)
+            proxy_url = f"http://127.0.0.1:{proxy_port}"
+            proxy_pid = proxy.pid
+            _wait_for(f"{proxy_url}/health")
+
+        result = asyncio.run(
+            run_load(proxy_url, proxy_pid, args.concurrency, args.requests, args.model, args.token)
+        )
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    result["timestamp"] = int(time.time())
+    result["python"] = platform.python_version()
+    result["mock"] = {
+        "thinking_chunks": args.thinking_chunks,
+        "answer_chunks": args.answer_chunks,
+        "tokens_per_sec": args.tokens_per_sec,
+        "first_byte_latency": args.first_byte_latency,
+        "error_rate": args.error_rate,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+本地模拟的 z.ai 上游
+
+实现 /api/chat/completions（按 thinking/answer/other/done 阶段输出与 chat.z.ai
+相同格式的 "data: {"data": {...}}" SSE）与 /api/v1/files/，
+支持配置输出速率、首字节延迟与错误注入。请求声明了函数工具且最后一条消息不是工具结果时，
+在回答之后以 tool_call 阶段的 <glm_block> 调用第一个函数。
+
+用法:
+    python -m benchmarks.mock_upstream --port 9100 --tokens-per-sec 200 --error-rate 0.01
+    PROXY_URL=http://127.0.0.1:9100 python main.py
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+
+
+@dataclass
+class MockConfig:
+    thinking_chunks: int = 50
+    answer_chunks: int = 200
+    chunk_text: str = "token "
+    # 每秒输出的 chunk 数，0 表示不限速
+    tokens_per_sec: float = 0.0
+    first_byte_latency: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+    # 输出过程中断开连接的概率
+    abort_rate: float = 0.0
+    upload_latency: float = 0.0
+
+
+config = MockConfig()
+app = FastAPI(title="Mock z.ai upstream")
+
+
+def _event(data: dict) -> str:
+    return "data: " + json.dumps({"type": "chat:completion", "data": data}, ensure_ascii=False) + "\n\n"
+
+
+def _requested_thinking(body: dict) -> bool:
+    return bool(body.get("features", {}).get("enable_thinking", True))
+
+
+def _tool_call_events(body: dict):
+    """调用请求中声明的第一个函数；工具结果已经返回时不再调用"""
+    messages = body.get("messages") or []
+    if messages and messages[-1].get("role") == "tool":
+        return
+    for tool in body.get("tools") or ():
+        name = (tool.get("function") or {}).get("name")
+        if tool.get("type") == "function" and name:
+            break
+    else:
+        return
+    block = json.dumps(
+        {
+            "type": "mcp",
+            "data": {
+                "metadata": {
+                    "id": f"call_{uuid.uuid4().hex[:24]}",
+                    "name": name,
+                    "arguments": json.dumps({"query": "mock"}),
+                }
+            },
+        },
+        ensure_ascii=False,
+    )
+    text = f'<glm_block view="">{block}</glm_block>'
+    # 分两段下发，覆盖块跨事件的情况
+    middle = len(text) // 2
+    for part in (text[:middle], text[middle:]):
+        yield _event({"phase": "tool_call", "edit_index": 0, "edit_content": part})
+
+
+async def _generate(body: dict):
+    thinking_chunks = config.thinking_chunks if _requested_thinking(body) else 0
+    total = thinking_chunks + config.answer_chunks
+    abort_at = random.randint(1, max(1, total)) if random.random() < config.abort_rate else None
+    interval = 1.0 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0.0
+    start = time.perf_counter()
+
+    for i in range(total):
+        if abort_at is not None and i == abort_at:
+            return
+        if interval:
+            # 按目标时间点发送，避免逐个 sleep 的误差累积
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if i < thinking_chunks:
+            delta = config.chunk_text
+            if i == 0:
+                delta = '<details type="reasoning" done="false">\n<summary>Thinking…</summary>\n' + delta
+            yield _event({"phase": "thinking", "delta_content": delta})
+        elif i == thinking_chunks and thinking_chunks:
+            yield _event(
+                {
+                    "phase": "answer",
+                    "edit_index": 0,
+                    "edit_content": "<details><summary>Thought</summary>\n</details>\n" + config.chunk_text,
+                }
+            )
+        else:
+            yield _event({"phase": "answer", "delta_content": config.chunk_text})
+
+    for event in _tool_call_events(body):
+        yield event
+    yield _event(
+        {
+            "phase": "other",
+            "delta_content": "",
+            "usage": {
+                "prompt_tokens": 16,
+                "completion_tokens": total,
+                "total_tokens": 16 + total,
+            },
+        }
+    )
+    yield _event({"phase": "done", "done": True})
+
+
+@app.post("/api/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if config.first_byte_latency:
+        await asyncio.sleep(config.first_byte_latency)
+    if config.error_rate and random.random() < config.error_rate:
+        return Response(
+            status_code=config.error_status,
+            content=json.dumps({"detail": "injected error"}),
+            media_type="application/json",
+        )
+    return StreamingResponse(_generate(body), media_type="text/event-stream")
+
+
+@app.post("/api/v1/files/")
+async def upload_file(request: Request):
+    await request.body()
+    if config.upload_latency:
+        await asyncio.sleep(config.upload_latency)
+    file_id = str(uuid.uuid4())
+    return {"id": file_id, "meta": {"cdn_url": f"https://cdn.example.invalid/{file_id}"}}
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--thinking-chunks", type=int, default=config.thinking_chunks)
+    parser.add_argument("--answer-chunks", type=int, default=config.answer_chunks)
+    parser.add_argument("--tokens-per-sec", type=float, default=config.tokens_per_sec)
+    parser.add_argument("--first-byte-latency", type=float, default=config.first_byte_latency)
+    parser.add_argument("--error-rate", type=float, default=config.error_rate)
+    parser.add_argument("--error-status", type=int, default=config.error_status)
+    parser.add_argument("--abort-rate", type=float, default=config.abort_rate)
+    parser.add_argument("--upload-latency", type=float, default=config.upload_latency)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    import uvicorn
+
+    args = parse_args(argv)
+    for field in MockConfig.__dataclass_fields__:
+        if hasattr(args, field):
+            setattr(config, field, getattr(args, field))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+上游 SSE 转录数据
+
+基准测试既可以读取录制下来的上游转录（每行一条 "data: {...}"，或 api.recording 录制的文件），
+也可以按需合成一份格式相同的转录。
+"""
+import json
+from typing import List
+
+from api.recording import RECORDING_SUFFIX, load_recording
+
+
+def synthesize_transcript(
+    thinking_chunks: int = 2000,
+    answer_chunks: int = 2000,
+    chunk_text: str = "模型输出 token ",
+) -> List[str]:
+    """合成一份包含 thinking/answer/other/done 阶段的上游转录"""
+    lines = []
+
+    def emit(data: dict) -> None:
+        lines.append(
+            "data: "
+            + json.dumps({"type": "chat:completion", "data": data}, ensure_ascii=False)
+        )
+
+    for i in range(thinking_chunks):
+        delta = chunk_text
+        if i == 0:
+            delta = '<details type="reasoning" done="false">\n<summary>Thinking…</summary>\n' + delta
+        emit({"phase": "thinking", "delta_content": delta})
+    for i in range(answer_chunks):
+        if i == 0:
+            emit(
+                {
+                    "phase": "answer",
+                    "edit_index": 0,
+                    "edit_content": "<details><summary>Thought</summary>\n</details>\n"
+                    + chunk_text,
+                }
+            )
+        else:
+            emit({"phase": "answer", "delta_content": chunk_text})
+    emit(
+        {
+            "phase": "other",
+            "delta_content": "",
+            "usage": {
+                "prompt_tokens": 16,
+                "completion_tokens": thinking_chunks + answer_chunks,
+                "total_tokens": 16 + thinking_chunks + answer_chunks,
+            },
+        }
+    )
+    emit({"phase": "done", "done": True})
+    return lines
+
+
+def load_transcript(path: str) -> List[str]:
+    """
+    读取上游转录，只保留 data 行
+
+    支持纯文本转录（每行一条 "data: {...}"）与 RECORD_ENABLED 录制的 .ndjson.gz 文件。
+    """
+    if path.endswith(RECORDING_SUFFIX):
+        return [line for _, line in load_recording(path) if line.startswith("data:")]
+    with open(path, encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f if line.startswith("data:")]
@@ -1,18 +1,45 @@
-import uvicorn
+import glob
 import os
-from api.app import app
+import uvicorn
 from api.config import get_settings
 
 settings = get_settings()
 
+
+def __getattr__(name):
+    # 兼容 `uvicorn main:app` 的启动方式，按需导入应用
+    if name == "app":
+        from api.app import app
+
+        return app
+    raise AttributeError(name)
+
+
+def _prepare_multiprocess_metrics() -> None:
+    """多 worker 时清理上一次运行遗留的 Prometheus 多进程指标文件"""
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not metrics_dir:
+        return
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+        os.remove(path)
+
+
 if __name__ == "__main__":
+    workers = max(1, settings.WORKERS)
+    _prepare_multiprocess_metrics()
+    # 以导入字符串启动，uvicorn 才会按 workers 启动多个进程；reload 与多进程互斥
     uvicorn.run(
-        app,
+        "api.app:app",
         host=settings.HOST,
         port=settings.PORT,
-        reload=settings.DEBUG,
-        workers=settings.WORKERS,
+        reload=settings.DEBUG and workers == 1,
+        workers=workers,
+        loop=settings.UVICORN_LOOP,
+        http=settings.UVICORN_HTTP,
         log_level=settings.LOG_LEVEL.lower(),
         proxy_headers=True,
-        forwarded_allow_ips="*"
-    )
\ No newline at end of file
+        forwarded_allow_ips="*",
+        # 收到 SIGTERM 后停止接收新连接，等待在途 SSE 流结束后再退出
+        timeout_graceful_shutdown=settings.SHUTDOWN_GRACE_PERIOD,
+    )